@@ -1,14 +1,20 @@
 import argparse
 import concurrent.futures
+import contextlib
 import datetime
+import json
 import math
 import multiprocessing
 import os
+import random
 import subprocess
 import pathlib
 from pathlib import Path
 import signal
 
+import perf_stats
+import telemetry
+import tracing
 from utils import (
     Timer,
     file_or_dir_name,
@@ -21,6 +27,17 @@ from utils import (
 TIMEOUT = 600  # in seconds
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "")) / "results"
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
+SAMPLING_SCRIPT = "history_sampling.py"
+METRICS_DIR_ENV = "METRICS_DIR"
+"""Environment variable with the directory to which jobs write their metrics"""
+JOURNAL_FILE = "journal.jsonl"
+"""Name of the file in the results folder to which each finished job is appended"""
+STATISTICS_FILE = "statistics.csv"
+"""Name of the file in the results folder with the runtime statistics of repeated jobs"""
+RECORD_FILE_ENV = "RECORD_FILE"
+"""Environment variable with the file to which a job writes its results as JSON (see `history_sampling.py`)"""
+RESULTS_FILE = "results.jsonl"
+"""Name of the file in the results folder with the result record of each finished job, read by `prepare_results.py`"""
 
 
 def main():
@@ -88,6 +105,65 @@ def main():
         type=str,
         help="working directory for the program",
     )
+    arg_parser.add_argument(
+        "--listen",
+        metavar="HOST:PORT",
+        action="store",
+        type=str,
+        help="do not run jobs locally but serve them to workers started with `python scripts/work_queue.py HOST:PORT`",
+    )
+    arg_parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="run history_sampling.py jobs in long-lived worker processes instead of starting a new interpreter for each job",
+    )
+    arg_parser.add_argument(
+        "--precompute",
+        action="store_true",
+        help="compute model counts and initial samples shared by history_sampling.py jobs once before running the jobs",
+    )
+    arg_parser.add_argument(
+        "--metrics",
+        metavar="DIR",
+        action="store",
+        type=str,
+        help="periodically write live metrics of the run and of each job to Prometheus text files in DIR",
+    )
+    arg_parser.add_argument(
+        "--trace",
+        metavar="DIR",
+        action="store",
+        type=str,
+        help="record a timeline of the run and of each job in DIR, merged into DIR/trace.json (Chrome trace format)",
+    )
+    arg_parser.add_argument(
+        "--resume",
+        metavar="DIR",
+        action="store",
+        type=str,
+        help="continue an interrupted run in the given results folder, only re-running failed or missing jobs",
+    )
+    arg_parser.add_argument(
+        "--repetitions",
+        metavar="N",
+        action="store",
+        type=int,
+        default=1,
+        help="run each job N times and report the median runtime, see statistics.csv in the results folder (default: 1)",
+    )
+    arg_parser.add_argument(
+        "--warmup",
+        metavar="N",
+        action="store",
+        type=int,
+        default=0,
+        help="run each job N times before the measured repetitions and discard the results",
+    )
+    arg_parser.add_argument(
+        "--shuffle",
+        action="store_true",
+        help="run the jobs of each repetition in random order",
+    )
     # use REMAINDER to capture everything after `--`
     arg_parser.add_argument(
         "command", nargs=argparse.REMAINDER, help="command and arguments of the program"
@@ -157,10 +233,49 @@ def main():
         basename = args.name
     else:
         basename = file_or_dir_name(input_path)
-    output_dir = timestamp + "_" + basename
 
-    output_path = os.path.join(current_dir, OUTPUT_DIR, output_dir)
-    os.makedirs(output_path)
+    # result dict: (job name, repetition) -> result
+    results: dict[tuple[str, int], str] = dict()
+
+    if args.resume:
+        output_path = os.path.join(current_dir, args.resume)
+        journal_path = os.path.join(output_path, JOURNAL_FILE)
+        if not os.path.isfile(journal_path):
+            print(f"Cannot resume: {journal_path} not found")
+            exit(1)
+        # keep successful results, failed jobs are run again
+        results = {
+            key: result
+            for key, result in read_journal(journal_path).items()
+            if is_success(result)
+        }
+        print(f"resuming {output_path}: {label(len(results), 'job')} already finished")
+    else:
+        output_dir = timestamp + "_" + basename
+        output_path = os.path.join(current_dir, OUTPUT_DIR, output_dir)
+        os.makedirs(output_path)
+        journal_path = os.path.join(output_path, JOURNAL_FILE)
+
+    # rounds of jobs: for each repetition, all combinations of files and parameter sets that have no result yet
+    all_jobs = [(file, params) for file in input_file_paths for params in param_sets]
+    rounds = []
+    for repetition in range(1, args.repetitions + 1):
+        jobs = [
+            (file, params)
+            for file, params in all_jobs
+            if (job_name(file, params), repetition) not in results
+        ]
+        if jobs:
+            rounds.append((repetition, jobs))
+    if rounds and args.warmup:
+        # warm-up rounds have negative numbers, their results are discarded
+        rounds = [(-k, all_jobs[:]) for k in range(1, args.warmup + 1)] + rounds
+    if args.shuffle:
+        for _, jobs in rounds:
+            random.shuffle(jobs)
+    if args.listen and len(rounds) > 1:
+        print("--repetitions and --warmup are not supported with --listen")
+        exit(1)
 
     # get the number of available CPU cores
     if args.cores == 0:
@@ -169,33 +284,76 @@ def main():
         num_cores = args.cores
 
     # print rough estimate of worst-case runtime
-    num_jobs = num_files * len(param_sets)
-    wc_time = math.ceil(num_jobs / num_cores) * args.timeout
-    print(
-        f"{label(num_jobs, 'job')} scheduled with a timeout of {human_duration(args.timeout)} on {label(num_cores, 'core')}"
-    )
-    print(f"{human_duration(wc_time)} worst-case runtime")
-
-    # result dict: file name -> result
-    results: dict[str, str] = dict()
+    num_jobs = sum(len(jobs) for _, jobs in rounds)
+    if args.listen:
+        print(
+            f"{label(num_jobs, 'job')} scheduled with a timeout of {human_duration(args.timeout)} for remote workers"
+        )
+    else:
+        wc_time = sum(math.ceil(len(jobs) / num_cores) for _, jobs in rounds) * args.timeout
+        print(
+            f"{label(num_jobs, 'job')} scheduled with a timeout of {human_duration(args.timeout)} on {label(num_cores, 'core')}"
+        )
+        print(f"{human_duration(wc_time)} worst-case runtime")
 
     os.chdir(work_dir)
-    # process files in parallel
-    with concurrent.futures.ProcessPoolExecutor(max_workers=num_cores) as executor:
-        # Submit all file processing tasks to the executor
-        futures = {
-            executor.submit(process_file, file, output_path, params, args): file
-            for file in input_file_paths
-            for params in param_sets
-        }
+    command = args.command
+    if args.precompute:
+        # compute what all jobs on a history share once, and pass it to the jobs via the cache
+        import precompute
+
+        cache_dir = Path(output_path) / "cache"
+        precomputations = precompute.plan(
+            [
+                sampling_args(command) + params + file.split(" ")
+                for file, params in all_jobs
+            ]
+        )
+        precompute.run(precomputations, cache_dir, num_cores)
+        command = command + ["--cache", str(cache_dir)]
+
+    if args.metrics:
+        # jobs write their own metrics to a file next to the metrics of the run
+        metrics_dir = os.path.join(current_dir, args.metrics)
+        os.makedirs(metrics_dir, exist_ok=True)
+        os.environ[METRICS_DIR_ENV] = metrics_dir
+        telemetry.init(os.path.join(metrics_dir, "benchmark.prom"))
+        telemetry.set_gauge("benchmark_jobs", num_jobs, help="number of jobs in this run")
+        if not args.listen:  # the coordinator updates them itself
+            update_job_metrics(num_jobs, 0, num_cores)
+
+    if args.trace:
+        trace_dir = os.path.join(current_dir, args.trace)
+        os.makedirs(trace_dir, exist_ok=True)
+        tracing.init(trace_dir)
+
+    completed = 0
+    for repetition, jobs in rounds:
+        round_path = repetition_path(output_path, repetition)
+        os.makedirs(round_path, exist_ok=True)
+        if len(rounds) > 1:
+            print(f"{repetition_name(repetition)}: {label(len(jobs), 'job')}")
+        finished_jobs = start_jobs(args, jobs, round_path, command, num_cores)
 
         # collect results as they are completed
-        completed = 0
-        for future in concurrent.futures.as_completed(futures):
-            file = futures[future]
+        for file, params, future in finished_jobs:
+            test_result = None
             try:
                 name, test_result = future.result()
-                results[name] = test_result
+                if repetition > 0:
+                    results[(name, repetition)] = test_result
+                    job = {
+                        "name": name,
+                        "file": file,
+                        "params": params,
+                        "repetition": repetition,
+                        "result": test_result,
+                    }
+                    append_journal(journal_path, job)
+                    append_journal(
+                        os.path.join(output_path, RESULTS_FILE),
+                        job | read_record(log_file(file, round_path, params)),
+                    )
             except Exception as exc:
                 print(f"{file} raised an exception: {exc}")
             finally:
@@ -203,35 +361,278 @@ def main():
                 print(
                     f"completed {completed}/{num_jobs} ({(completed/num_jobs) * 100:.2f}%) after {human_duration(timer.stop())}"
                 )
+                telemetry.inc(
+                    "benchmark_jobs_completed",
+                    labels={"result": test_result_kind(test_result)},
+                )
+                if not args.listen:
+                    update_job_metrics(num_jobs, completed, num_cores)
+    telemetry.close()
     os.chdir(current_dir)
+    if args.trace:
+        tracing.flush()
+        trace_path = os.path.join(trace_dir, tracing.MERGED_TRACE_FILE)
+        num_events = tracing.merge(Path(trace_dir), Path(trace_path))
+        print(f"Wrote trace with {num_events} events: {trace_path}")
 
-    # write CSV file
+    # results of all repetitions per job
+    job_results: dict[str, list[str]] = dict()
+    for file, params in all_jobs:
+        name = job_name(file, params)
+        runs = [
+            results[(name, repetition)]
+            for repetition in range(1, args.repetitions + 1)
+            if (name, repetition) in results
+        ]
+        if runs:
+            job_results[name] = runs
+
+    # write CSV file, with the median runtime if jobs were repeated
     header = "name;runtime"
     csv_path = os.path.join(output_path, basename + ".csv")
     with open(csv_path, "w") as csv_file:
         csv_file.write(header + "\n")
-        for name, result in results.items():
-            csv_file.write(f"{name};{result}\n")
+        for name, runs in job_results.items():
+            csv_file.write(f"{name};{combined_result(runs)}\n")
     print("Wrote results:", csv_path)
 
+    if args.repetitions > 1:
+        stats_path = os.path.join(output_path, STATISTICS_FILE)
+        write_statistics(stats_path, job_results)
+        print("Wrote statistics:", stats_path)
+
+
+def start_jobs(args, jobs, output_path, command, num_cores):
+    """Start running the jobs with the execution mode selected by `args`, see `run_jobs`"""
+    if args.listen:
+        # let workers on other machines pull the jobs
+        from work_queue import serve_jobs
+
+        return serve_jobs(args.listen, jobs, output_path, command, args.timeout)
+    elif args.in_process:
+        # run jobs in long-lived history_sampling workers
+        from in_process import run_jobs_in_process
+
+        return run_jobs_in_process(jobs, output_path, command, args.timeout, num_cores)
+    else:
+        # process files in parallel
+        return run_jobs(jobs, output_path, command, args.timeout, num_cores)
+
+
+def repetition_name(repetition):
+    """
+    >>> repetition_name(2)
+    "repetition 2"
+    >>> repetition_name(-1)
+    "warm-up 1"
+    """
+    return f"repetition {repetition}" if repetition > 0 else f"warm-up {-repetition}"
+
+
+def repetition_path(output_path, repetition):
+    """
+    Folder for the logs of a repetition.
+    The first repetition is written to the results folder itself, like a run without repetitions.
+    """
+    if repetition == 1:
+        return output_path
+    if repetition > 1:
+        return os.path.join(output_path, f"repetition_{repetition}")
+    return os.path.join(output_path, f"warmup_{-repetition}")
+
+
+def combined_result(runs: list[str]) -> str:
+    """
+    The median runtime of the successful runs of a job, or the first result if no run succeeded
+
+    >>> combined_result(["1.0", "timeout", "3.0", "2.5"])
+    "2.5"
+    """
+    runtimes = sorted(float(run) for run in runs if is_success(run))
+    if not runtimes:
+        return runs[0]
+    return str(perf_stats.summarize(runtimes)["median"])
+
+
+def write_statistics(path, job_results: dict[str, list[str]]):
+    """Write the median, interquartile range and confidence interval of the runtime of each job"""
+    columns = ["n", "median", "q1", "q3", "iqr", "ci_low", "ci_high"]
+    with open(path, "w") as csv_file:
+        csv_file.write(";".join(["name", "repetitions", *columns]) + "\n")
+        for name, runs in job_results.items():
+            summary = perf_stats.summarize([float(run) for run in runs if is_success(run)])
+            csv_file.write(
+                ";".join([name, str(len(runs)), *(str(summary[c]) for c in columns)]) + "\n"
+            )
+
+
+def run_jobs(jobs, output_path, command, timeout, num_cores):
+    """
+    Run the jobs, given as `(file, params)` pairs, in a process pool on this machine.
+    Yields a `(file, params, future)` tuple for each job as soon as it is completed.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_cores) as executor:
+        futures = {
+            executor.submit(
+                process_file, file, output_path, params, command, timeout
+            ): (file, params)
+            for file, params in jobs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            file, params = futures[future]
+            yield file, params, future
+
+
+def update_job_metrics(num_jobs, completed, num_cores):
+    """
+    Update the number of queued and running jobs.
+    Locally, all cores are busy as long as there are enough jobs left.
+    """
+    remaining = num_jobs - completed
+    running = min(num_cores, remaining)
+    telemetry.set_gauge("benchmark_jobs_running", running)
+    telemetry.set_gauge("benchmark_jobs_queued", remaining - running)
+
+
+def test_result_kind(result):
+    """
+    >>> test_result_kind("12.3")
+    "finished"
+    >>> test_result_kind("error (1)")
+    "error"
+    """
+    if result is None:
+        return "exception"
+    if is_success(result):
+        return "finished"
+    return result.split(" ")[0]
+
+
+def sampling_args(command: list[str]) -> list[str]:
+    """
+    Arguments passed to `history_sampling.py` in the given benchmark command
 
-def process_file(file_path, output_path, params, args):
+    >>> sampling_args(["python", "scripts/history_sampling.py", "-n", "1000", "--csv"])
+    ["-n", "1000", "--csv"]
+    """
+    for i, arg in enumerate(command):
+        if os.path.basename(arg) == SAMPLING_SCRIPT:
+            return command[i + 1 :]
+    raise ValueError(
+        f"only supported for {SAMPLING_SCRIPT}, but the command is: {' '.join(command)}"
+    )
+
+
+def job_name(file_path, params):
+    """
+    Name identifying a job in the results, e.g. "data/test/history1 (-m none)"
+    """
+    return f"{file_path}" + (f" ({' '.join(params)})" if params else "")
+
+
+def is_success(result):
+    """
+    Whether a job result is a runtime (and not a timeout, memout or error)
+
+    >>> is_success("3.14")
+    True
+    >>> is_success("timeout")
+    False
+    """
+    try:
+        float(result)
+        return True
+    except ValueError:
+        return False
+
+
+def append_journal(journal_path, record):
+    """Append a record to the journal and make sure it is on disk before continuing"""
+    with open(journal_path, "ab+") as journal:
+        journal.seek(0, os.SEEK_END)
+        if journal.tell() > 0:
+            journal.seek(-1, os.SEEK_END)
+            if journal.read(1) != b"\n":
+                # terminate a partially written last line (e.g. after a crash), so that this record stays readable
+                journal.write(b"\n")
+        journal.write((json.dumps(record) + "\n").encode())
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def read_journal(journal_path) -> dict[tuple[str, int], str]:
+    """
+    Read the results recorded in a journal as a dict from job name and repetition to result.
+    If a job was recorded multiple times, the last record wins.
+    Partially written lines (e.g. after a crash) are ignored.
+    """
+    results = dict()
+    with open(journal_path) as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[(record["name"], record.get("repetition", 1))] = record["result"]
+    return results
+
+
+def log_file(file_path, output_path, params):
+    """Path of the log file of a job in the results folder `output_path`"""
     file_name = file_or_dir_name(file_path)
-    name = f"{file_path}" + (f" ({' '.join(params)})" if params else "")
-    print(f"{name}: started")
     dir = os.path.split(os.path.dirname(file_path))[1]
-    output_file = os.path.join(
+    return os.path.join(
         output_path,
         f"{dir}_{file_name}" + ("_" + "_".join(params) if params else "") + ".log",
     )
-    command = args.command + params + file_path.split(" ")
+
+
+def record_file(output_file):
+    """Path of the result record of the job with the log file `output_file`"""
+    name, _ = os.path.splitext(output_file)
+    return name + ".json"
+
+
+def read_record(output_file) -> dict:
+    """The result record written by the job with the log file `output_file`, or an empty dict if it wrote none"""
+    try:
+        with open(record_file(output_file)) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return dict()
+
+
+def metrics_file(output_file):
+    """Path of the metrics file of the job with the log file `output_file`"""
+    name, _ = os.path.splitext(os.path.basename(output_file))
+    return os.path.join(os.environ[METRICS_DIR_ENV], name + ".prom")
+
+
+def process_file(file_path, output_path, params, command, timeout):
+    name = job_name(file_path, params)
+    print(f"{name}: started")
+    output_file = log_file(file_path, output_path, params)
+    command = command + params + file_path.split(" ")
 
     with open(output_file, "a") as file:
         file.write("Running command: " + " ".join(command) + "\n")
+    with tracing.span("job", cat="job", args={"name": name, "command": " ".join(command)}):
+        return name, run_command(name, command, output_file, timeout)
+
+
+def run_command(name, command, output_file, timeout):
+    """Run the command of the job `name`, writing its output to `output_file`. Returns the result for the CSV file."""
+    env = os.environ | {RECORD_FILE_ENV: record_file(output_file)}
+    if os.getenv(METRICS_DIR_ENV):
+        env["METRICS_FILE"] = metrics_file(output_file)
+    # a record left by an earlier run of the job (e.g. before resuming) does not belong to this run
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(record_file(output_file))
     try:
         timer = Timer(enable_printing=False)
         process = subprocess.Popen(
             command,
+            env=env,
             text=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -239,7 +640,7 @@ def process_file(file_path, output_path, params, args):
             start_new_session=True,
         )
         try:  # to catch timeout
-            stdout, stderr = process.communicate(timeout=args.timeout)
+            stdout, stderr = process.communicate(timeout=timeout)
             timing = timer.stop()
             returncode = process.returncode
             # write output to log file
@@ -265,15 +666,15 @@ def process_file(file_path, output_path, params, args):
             with open(output_file, "a") as file:
                 if e.stdout:
                     file.write(e.stdout.decode())
-                file.write(f"timeout of {args.timeout}s reached\n")
+                file.write(f"timeout of {timeout}s reached\n")
             test_result = f"timeout"
-            print(f"{name}: timeout after {args.timeout}s")
+            print(f"{name}: timeout after {timeout}s")
     except Exception as e:
         with open(output_file, "a") as file:
             file.write(str(e) + "\n")
         raise e
 
-    return name, test_result
+    return test_result
 
 
 if __name__ == "__main__":
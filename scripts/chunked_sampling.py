@@ -0,0 +1,297 @@
+import hashlib
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from pysat.formula import CNF
+from pysat.solvers import Solver
+
+import retainment_sampling as sampling
+from retainment import compute_model_count, conjunction
+from retainment_sampling import Algorithm, Method, Sampler, get_samples
+from sample_archive import SUFFIX, SampleArchive, SampleWriter, to_bits, to_literals
+from utils import PhaseTimer, copy_tool_stats, tool_stats_since
+
+"""
+Retainment sampling for large numbers of samples, in which the samples of an update are never all in memory at once
+(`history_sampling.py --chunk-size N`).
+
+The samplers are asked for at most `chunk_size` samples at a time. The samples are checked chunk by chunk
+and written to a sample archive (see `sample_archive.py`), from which the next update reads the old samples again chunk by chunk.
+Duplicate samples are counted by a 64-bit fingerprint of each sample, so the memory needed to count the unique samples
+of a history is 8 bytes per unique sample, independent of the number of variables.
+
+With a chunk size of at least the number of samples, the samplers are called exactly as by `retainment_sampling.retainment_sampling`,
+so the same seed yields the same samples.
+All snapshots must have the same variables (as in the unified histories), since the samples are stored with one bit per variable.
+"""
+
+DEFAULT_CHUNK_SIZE = 1000
+"""Number of samples requested from the sampler at once"""
+
+
+def dimacs_num_vars(file: Path) -> int:
+    """Number of variables in the header of a DIMACS file"""
+    with open(file) as f:
+        for line in f:
+            if line.startswith("p "):
+                return int(line.split()[2])
+    raise ValueError(f"{file} has no 'p cnf' header")
+
+
+def sample_chunks(
+    file: Path, n: int, engine: Sampler, chunk_size: int = DEFAULT_CHUNK_SIZE, projection: int | None = None
+):
+    """`n` samples of `file` (see `retainment_sampling.get_samples`) in lists of at most `chunk_size` samples"""
+    for start in range(0, n, chunk_size):
+        yield get_samples(file, min(chunk_size, n - start), engine, projection)
+
+
+def sample_to_archive(file: Path, n: int, engine: Sampler, path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Path:
+    """Write `n` samples of `file` to the archive `path`"""
+    with SampleWriter(path, dimacs_num_vars(file)) as writer:
+        for samples in sample_chunks(file, n, engine, chunk_size):
+            writer.write(samples)
+    return path
+
+
+def fingerprints(packed: np.ndarray) -> np.ndarray:
+    """64-bit fingerprint of each row of packed samples (see `SampleArchive.packed`)"""
+    digests = b"".join(hashlib.blake2b(row.tobytes(), digest_size=8).digest() for row in packed)
+    return np.frombuffer(digests, dtype=np.uint64)
+
+
+class UniqueSamples:
+    """Counts the unique samples of several archives by their fingerprints"""
+
+    def __init__(self):
+        self.fingerprints = np.zeros(0, dtype=np.uint64)
+        """Sorted fingerprints of the unique samples"""
+        self.pending: list[np.ndarray] = []
+        self.num_pending = 0
+
+    def add(self, packed: np.ndarray):
+        """Add samples given as packed rows"""
+        self.pending.append(fingerprints(packed))
+        self.num_pending += len(packed)
+        # merging is linear in the number of unique samples, so merge only when as many fingerprints are pending
+        if self.num_pending >= max(len(self.fingerprints), DEFAULT_CHUNK_SIZE):
+            self.merge()
+
+    def add_samples(self, samples: list[list[int]]):
+        """Add samples given as lists of literals, which must assign all variables"""
+        if samples:
+            self.add(np.packbits(to_bits(samples, len(samples[0])), axis=1, bitorder="little"))
+
+    def add_archive(self, path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        with SampleArchive(path) as archive:
+            for start in range(0, len(archive), chunk_size):
+                self.add(archive.packed(start, start + chunk_size))
+
+    def merge(self):
+        self.fingerprints = np.unique(np.concatenate([self.fingerprints, *self.pending]))
+        self.pending = []
+        self.num_pending = 0
+
+    def __len__(self) -> int:
+        self.merge()
+        return len(self.fingerprints)
+
+
+def retainment_sampling_chunked(
+    engine: Sampler,
+    method: Method,
+    algorithm: Algorithm,
+    file_old: Path,
+    file_new: Path,
+    num_samples: int,
+    output: Path,
+    samples_old: Path | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    count_old: int | None = None,
+    count_new: int | None = None,
+    count_conj: int | None = None,
+) -> tuple[Path, dict]:
+    """
+    Retainment sampling (see `retainment_sampling.retainment_sampling`) that reads the old samples from the archive `samples_old`
+    and writes the new samples to the archive `output`.
+
+    Returns the archive with the new samples, which is `samples_old` itself if the update does not change the configuration space,
+    and the same statistics as `retainment_sampling`.
+    """
+    phases = PhaseTimer(sampling.PHASES)
+    tools_before = copy_tool_stats()
+
+    def breakdown():
+        return {**phases.as_dict(), **tool_stats_since(tools_before, sampling.TOOLS)}
+
+    num_vars = dimacs_num_vars(file_new)
+    assert dimacs_num_vars(file_old) == num_vars, f"{file_old} and {file_new} have different variables"
+    tmp_dir = Path(tempfile.mkdtemp())
+    try:
+        # compute model count of conjunction
+        with phases.phase("conjunction"):
+            file_conj = conjunction(file_old, file_new, directory=tmp_dir)
+        if count_conj is None:
+            with phases.phase("count_conj"):
+                count_conj = compute_model_count(file_conj)
+        assert count_conj is not None
+
+        # check for empty intersection
+        if count_conj == 0:
+            # no retainment possible, fall back to regular sampling
+            with phases.phase("sample_new"):
+                sample_to_archive(file_new, num_samples, engine, output, chunk_size)
+            return output, {**sampling.incomparable_stats(num_samples), **breakdown()}
+
+        # generate samples for old model
+        if samples_old is None:
+            with phases.phase("sample_old"):
+                samples_old = sample_to_archive(
+                    file_old, num_samples, engine, tmp_dir / f"{file_old.stem}{SUFFIX}", chunk_size
+                )
+
+        # get model counts for old and new file
+        if count_old is None:
+            with phases.phase("count_old"):
+                count_old = compute_model_count(file_old)
+        assert count_old
+        if count_new is None:
+            with phases.phase("count_new"):
+                count_new = compute_model_count(file_new)
+        assert count_new
+
+        # check for refactoring update (no change in configuration space)
+        if count_conj == count_old and count_conj == count_new:
+            if samples_old.parent == tmp_dir:
+                samples_old = Path(shutil.move(samples_old, output))
+            return samples_old, {**sampling.refactoring_stats(num_samples), **breakdown()}
+
+        # determine update types
+        if count_conj == count_old:
+            update_type = "generalization"
+        elif count_conj == count_new:
+            update_type = "spezialization"
+        else:
+            update_type = "changing"
+
+        # Create solvers for old and new CNF
+        if sampling.VALIDATE_SAMPLES:
+            f_old = CNF(from_file=file_old)
+            checker_old = Solver()
+            is_sat = checker_old.append_formula(f_old.clauses, no_return=False)
+            assert is_sat, f"{file_old} is UNSAT"
+
+        with phases.phase("check_old"):
+            f_new = CNF(from_file=file_new)
+            checker_new = Solver()
+            is_sat = checker_new.append_formula(f_new.clauses, no_return=False)
+            assert is_sat, f"{file_new} is UNSAT"
+
+        # compute expected retainment
+        max_keep = count_conj / count_old
+        max_use = count_conj / count_new
+        expected_retainment = min(max_keep, max_use)
+
+        # determine number of samples for new/old (checking the old samples does not use the random number generator)
+        num_valid_old_expected = num_samples * max_keep
+        num_needed_old = sampling.needed_old(algorithm, num_samples, max_use)
+        num_needed_new = num_samples - num_needed_old
+
+        with SampleWriter(output, num_vars) as writer:
+            # keep the first `num_needed_old` old samples that are valid for the new model
+            with phases.phase("check_old"), SampleArchive(samples_old) as archive:
+                assert len(archive) == num_samples
+                num_valid_old = 0
+                for start in range(0, len(archive), chunk_size):
+                    bits = archive.bits(start, start + chunk_size)
+                    valid = np.array(
+                        [checker_new.solve(assumptions=sample) for sample in to_literals(bits)], dtype=bool
+                    )
+                    writer.write_bits(bits[valid][: max(num_needed_old - num_valid_old, 0)])
+                    num_valid_old += int(valid.sum())
+
+            # samples for the conjunction (old)
+            num_more_old = max(num_needed_old - num_valid_old, 0)
+            if num_more_old:
+                with phases.phase("sample_conj"):
+                    for samples_conj in sample_chunks(file_conj, num_more_old, engine, chunk_size):
+                        if sampling.VALIDATE_SAMPLES:
+                            for sample in samples_conj:
+                                assert checker_new.solve(
+                                    assumptions=sample
+                                ), f"sample produced by {engine} for conjunction is invalid for {file_new}: {sample}"
+                        writer.write(samples_conj)
+            assert writer.num_samples == num_needed_old
+
+            # generate new samples
+            num_candidates_new = 0
+            if num_needed_new == 0:
+                chunks = []
+            elif method == Method.rejection:
+                chunks = rejected_chunks(
+                    engine, file_old, file_new, num_needed_new, 1 - max_use, chunk_size, num_vars
+                )
+            elif method == Method.tseitin:
+                chunks = tseitin_chunks(engine, file_old, file_new, num_needed_new, tmp_dir, chunk_size)
+            with phases.phase("sample_new"):
+                for samples_new, num_candidates_new in chunks:
+                    if sampling.VALIDATE_SAMPLES:
+                        for sample in to_literals(samples_new):
+                            assert not checker_old.solve(
+                                assumptions=sample
+                            ), f"{method} sampling (with {engine}) produced a sample valid for {file_old}, even though it shouldn't be"
+                            assert checker_new.solve(
+                                assumptions=sample
+                            ), f"{method} sampling (with {engine}) produced invalid sample for {file_new}"
+                    writer.write_bits(samples_new)
+            spur_fallback = writer.num_samples != num_samples
+
+        if spur_fallback:
+            print(f"Rejection sampling failed, falling back to regular sampling with SPUR.")
+            with phases.phase("sample_new"):
+                sample_to_archive(file_new, num_samples, Sampler.spur, output, chunk_size)
+            return output, {"spur_fallback": True, **breakdown()}
+    finally:
+        # remove tmp dir
+        shutil.rmtree(tmp_dir)
+
+    return output, {
+        "num_samples": num_samples,
+        "num_valid_old_expected": num_valid_old_expected,
+        "num_valid_old": num_valid_old,
+        "num_needed_old": num_needed_old,
+        "num_retained": min(num_valid_old, num_needed_old),
+        "num_retained_expected": num_samples * expected_retainment,
+        "num_more_old": num_more_old,
+        "num_needed_new": num_needed_new,
+        "num_candidates_new": num_candidates_new,
+        "update_type": update_type,
+        "short_circuit": False,
+        **breakdown(),
+    }
+
+
+def rejected_chunks(
+    engine: Sampler, file_old: Path, file_new: Path, n: int, hitrate: float, chunk_size: int, num_vars: int
+):
+    """Samples of `file_new` that are invalid for `file_old` as boolean matrices, with the number of candidates checked so far"""
+    for accepted, num_candidates in sampling.rejection_batches(
+        engine,
+        file_old,
+        file_new,
+        n,
+        hitrate=hitrate,
+        max_candidates=min(chunk_size, sampling.REJECTION_MAX_CANDIDATES),
+    ):
+        yield to_bits(accepted, num_vars), num_candidates
+
+
+def tseitin_chunks(engine: Sampler, file_old: Path, file_new: Path, n: int, directory: Path, chunk_size: int):
+    """Samples of not F and F' (see `retainment_sampling.tseitin_formula`) as boolean matrices without the auxiliary variables"""
+    path = directory / f"not_{file_old.stem}_and_{file_new.stem}.dimacs"
+    cnf, num_vars = sampling.tseitin_formula(file_old, file_new)
+    cnf.to_file(path)
+    for samples in sample_chunks(path, n, engine, chunk_size, projection=num_vars):
+        yield to_bits(samples, num_vars), 0
@@ -0,0 +1,90 @@
+import argparse
+import math
+import os
+import sys
+
+from benchmark import JOURNAL_FILE, is_success, read_journal
+import perf_stats
+
+"""
+Compare the runtimes of two `benchmark.py` result folders, e.g. before and after a change:
+```
+python scripts/compare_results.py results/<baseline> results/<current>
+```
+For each job that occurs in both folders, prints the median runtimes, the relative change,
+and a bootstrap confidence interval of the ratio of the medians (see `perf_stats.py`).
+A change is marked as significant if the interval does not contain 1, which requires at least two successful repetitions per folder (`benchmark.py --repetitions`).
+"""
+
+
+def runtimes(results_dir) -> dict[str, list[float]]:
+    """Runtimes of the successful runs of each job in a results folder"""
+    journal = read_journal(os.path.join(results_dir, JOURNAL_FILE))
+    runs: dict[str, list[float]] = dict()
+    for (name, _), result in sorted(journal.items()):
+        runs.setdefault(name, [])
+        if is_success(result):
+            runs[name].append(float(result))
+    return runs
+
+
+def compare(baseline: dict[str, list[float]], current: dict[str, list[float]], confidence):
+    """Rows of the report, with the verdict "faster", "slower", or "" (no significant change)"""
+    rows = []
+    for name in baseline:
+        if name not in current:
+            continue
+        old, new = baseline[name], current[name]
+        if not old or not new:
+            rows.append((name, len(old), len(new), math.nan, math.nan, math.nan, math.nan, "failed"))
+            continue
+        old_median = perf_stats.summarize(old)["median"]
+        new_median = perf_stats.summarize(new)["median"]
+        low, high = perf_stats.ratio_ci(old, new, confidence)
+        if high < 1:
+            verdict = "faster"
+        elif low > 1:
+            verdict = "slower"
+        else:
+            verdict = ""
+        rows.append((name, len(old), len(new), old_median, new_median, low, high, verdict))
+    return rows
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="compare_results",
+        description="Compare the runtimes of two benchmark.py result folders",
+    )
+    arg_parser.add_argument("baseline", help="results folder of the baseline")
+    arg_parser.add_argument("current", help="results folder to compare to the baseline")
+    arg_parser.add_argument(
+        "--confidence",
+        type=float,
+        default=perf_stats.CONFIDENCE,
+        help=f"confidence level of the intervals (default: {perf_stats.CONFIDENCE})",
+    )
+    arg_parser.add_argument(
+        "--fail-on-slowdown",
+        action="store_true",
+        help="exit with status 1 if any job is significantly slower",
+    )
+    args = arg_parser.parse_args()
+
+    rows = compare(runtimes(args.baseline), runtimes(args.current), args.confidence)
+    print(f"{'job':60} {'n':>7} {'baseline':>10} {'current':>10} {'change':>8}  {int(args.confidence * 100)}% CI of ratio")
+    for name, n_old, n_new, old, new, low, high, verdict in rows:
+        change = f"{new / old - 1:+8.1%}" if old > 0 else f"{'':8}"
+        interval = "n/a" if math.isnan(low) else f"[{low:.3f}, {high:.3f}]"
+        print(
+            f"{name:60} {n_old:>3}/{n_new:<3} {old:9.2f}s {new:9.2f}s {change}  {interval:18} {verdict}"
+        )
+    num_faster = sum(1 for row in rows if row[-1] == "faster")
+    num_slower = sum(1 for row in rows if row[-1] == "slower")
+    print(f"{num_faster} significantly faster, {num_slower} significantly slower, {len(rows)} compared")
+    if args.fail_on_slowdown and num_slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,84 @@
 import os
+import re
 import csv
+import json
 import argparse
+import concurrent.futures
+
+import numpy as np
 
 EXTENSIONS = [".cnf", ".dimacs"]
+HEADER = re.compile(rb"^[ \t]*p\s+cnf\s+(\d+)\s+(\d+)", re.MULTILINE)
+NON_CLAUSE_LINES = re.compile(rb"^[ \t]*[cp].*$", re.MULTILINE)
+"""Comment and header lines, which may be indented"""
+CSV_COLUMNS = [
+    "File",
+    "Vars",
+    "Clauses",
+    "Literals",
+    "Unit clauses",
+    "Binary clauses",
+    "Max clause length",
+    "Mean clause length",
+    "Positive literals",
+    "Pure vars",
+    "Unused vars",
+    "Min occurrences",
+    "Median occurrences",
+    "Max occurrences",
+    "Components",
+]
+"""Columns of the CSV output. The JSON output additionally contains the full histograms."""
+
 
+def components(variables: np.ndarray, clause_ids: np.ndarray, num_vars: int) -> int:
+    """
+    Number of connected components of the variable interaction graph (variables are connected if they occur in a clause together),
+    counting only variables that occur in some clause.
+    Each literal is connected to the next literal of the same clause, and the smallest variable of each component is propagated
+    along these edges (with pointer jumping) until nothing changes.
+    """
+    same_clause = clause_ids[1:] == clause_ids[:-1]
+    u, v = variables[:-1][same_clause], variables[1:][same_clause]
+    labels = np.arange(num_vars + 1)
+    while True:
+        smaller = np.minimum(labels[u], labels[v])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, u, smaller)
+        np.minimum.at(new_labels, v, smaller)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    occurring = np.unique(variables)
+    return len(np.unique(labels[occurring]))
 
-def parse_dimacs(path):
-    """Parse DIMACS file, returning (filename, vars, clauses)."""
-    n_vars = 0
-    n_clauses = 0
-    found_header = False
-    n_vars_header = 0
-    n_clauses_header = 0
-
-    with open(path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("c"):
-                continue
-            if line.startswith("p cnf"):
-                found_header = True
-                parts = line.strip().split()
-                n_vars_header = int(parts[2])
-                n_clauses_header = int(parts[3])
-                continue
-            # Clause lines: integers ending with 0
-            lits = [int(x) for x in line.split() if x]
-            if lits:
-                if lits[-1] != 0:
-                    raise ValueError(f"Malformed clause in {path}: {line}")
-                n_clauses += 1
-                for lit in lits[:-1]:
-                    n_vars = max(n_vars, abs(lit))
-    if not found_header:
+
+def parse_dimacs(path, root=None) -> dict:
+    """Parse a DIMACS file and compute its statistics in one pass over the literals"""
+    name = os.path.relpath(path, root) if root else os.path.basename(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    header = HEADER.search(data)
+    if header is None:
         raise ValueError(f"Missing header 'p cnf' in {path}")
+    n_vars_header, n_clauses_header = int(header[1]), int(header[2])
+
+    # all literals of all clauses, each clause terminated by 0
+    try:
+        tokens = np.array(NON_CLAUSE_LINES.sub(b"", data).split()).astype(np.int64)
+    except ValueError as e:
+        raise ValueError(f"Malformed clause in {path}: {e}") from e
+    if len(tokens) and tokens[-1] != 0:
+        raise ValueError(f"Malformed clause in {path}: last clause is not terminated by 0")
+    ends = np.flatnonzero(tokens == 0)
+    lengths = np.diff(ends, prepend=-1) - 1
+    literals = tokens[tokens != 0]
+    clause_ids = np.repeat(np.arange(len(lengths)), lengths)
+    variables = np.abs(literals)
+
+    n_clauses = len(lengths)
+    n_vars = int(variables.max()) if len(variables) else 0
     if n_vars != n_vars_header:
         print(
             f"Warning: Mismatching variable count in {path}: {n_vars_header} in header but {n_vars} in file."
@@ -42,38 +87,90 @@ def parse_dimacs(path):
         print(
             f"Warning: Mismatching clause count in {path}: {n_clauses_header} in header but {n_clauses} in file."
         )
-    return os.path.basename(path), n_vars, n_clauses
+
+    num_vars = max(n_vars, n_vars_header)
+    positive = np.bincount(variables[literals > 0], minlength=num_vars + 1)[1:]
+    negative = np.bincount(variables[literals < 0], minlength=num_vars + 1)[1:]
+    occurrences = positive + negative
+    used = occurrences > 0
+    length_histogram = np.bincount(lengths) if n_clauses else np.zeros(1, dtype=int)
+    occurrence_histogram = np.bincount(occurrences[used]) if used.any() else np.zeros(1, dtype=int)
+
+    return {
+        "File": name,
+        "Vars": n_vars,
+        "Clauses": n_clauses,
+        "Literals": len(literals),
+        "Unit clauses": int(np.count_nonzero(lengths == 1)),
+        "Binary clauses": int(np.count_nonzero(lengths == 2)),
+        "Max clause length": int(lengths.max()) if n_clauses else 0,
+        "Mean clause length": float(lengths.mean()) if n_clauses else 0.0,
+        "Positive literals": float(positive.sum() / len(literals)) if len(literals) else 0.0,
+        "Pure vars": int(np.count_nonzero(used & ((positive == 0) | (negative == 0)))),
+        "Unused vars": int(np.count_nonzero(~used)),
+        "Min occurrences": int(occurrences[used].min()) if used.any() else 0,
+        "Median occurrences": float(np.median(occurrences[used])) if used.any() else 0.0,
+        "Max occurrences": int(occurrences.max()) if used.any() else 0,
+        "Components": components(variables, clause_ids, num_vars) if used.any() else 0,
+        "clause_length_histogram": {
+            int(length): int(count) for length, count in enumerate(length_histogram) if count
+        },
+        "occurrence_histogram": {
+            int(occ): int(count) for occ, count in enumerate(occurrence_histogram) if count
+        },
+    }
 
 
-def collect_stats(path):
-    """Collect stats from a file or directory."""
-    if os.path.isdir(path):
-        files = [
-            os.path.join(path, f)
-            for f in os.listdir(path)
+def find_files(path) -> list[str]:
+    """The DIMACS files in `path` and its subdirectories, or `path` itself if it is a file"""
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for directory, _, names in os.walk(path):
+        files.extend(
+            os.path.join(directory, f)
+            for f in names
             if any(f.endswith(ext) for ext in EXTENSIONS)
-        ]
-    else:
-        files = [path]
-    return [parse_dimacs(f) for f in files]
+        )
+    return sorted(files)
+
+
+def collect_stats(path, jobs=None) -> list[dict]:
+    """Collect stats from a file or directory, parsing the files in `jobs` processes in parallel"""
+    files = find_files(path)
+    root = path if os.path.isdir(path) else None
+    if jobs == 1 or len(files) == 1:
+        return [parse_dimacs(f, root) for f in files]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(
+            executor.map(parse_dimacs, files, [root] * len(files), chunksize=max(1, len(files) // 64))
+        )
 
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("path", help="Path to DIMACS file or folder")
     ap.add_argument("--csv", help="Output CSV file", default=None)
+    ap.add_argument(
+        "--json", help="Output JSON file, including the clause length and occurrence histograms", default=None
+    )
+    ap.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Number of files parsed in parallel (default: number of cores)"
+    )
     args = ap.parse_args()
 
-    stats = collect_stats(args.path)
+    stats = collect_stats(args.path, args.jobs)
 
     # Print to console
-    print(f"{'File':30} {'Vars':>8} {'Clauses':>8}")
+    print(f"{'File':30} {'Vars':>8} {'Clauses':>8} {'Units':>6} {'Pos':>5} {'Comps':>6}")
     num_vars_list = []
     num_clauses_list = []
-    for name, vars, clauses in sorted(stats):
-        num_vars_list.append(vars)
-        num_clauses_list.append(clauses)
-        print(f"{name:30} {vars:8} {clauses:8}")
+    for s in sorted(stats, key=lambda s: s["File"]):
+        num_vars_list.append(s["Vars"])
+        num_clauses_list.append(s["Clauses"])
+        print(
+            f"{s['File']:30} {s['Vars']:8} {s['Clauses']:8} {s['Unit clauses']:6} {s['Positive literals']:5.2f} {s['Components']:6}"
+        )
 
     print(f"Vars: Min - Max\n{min(num_vars_list)} {max(num_vars_list)}")
     print(f"Clauses: Min - Max\n{min(num_clauses_list)} {max(num_clauses_list)}")
@@ -81,9 +178,12 @@ def main():
     # Export CSV if requested
     if args.csv:
         with open(args.csv, "w", newline="") as out:
-            writer = csv.writer(out)
-            writer.writerow(["File", "Vars", "Clauses"])
+            writer = csv.DictWriter(out, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
             writer.writerows(stats)
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(stats, out, indent=2)
 
 
 if __name__ == "__main__":
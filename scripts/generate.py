@@ -9,15 +9,74 @@ OUTPUT_DIR = Path("data") / "generated"
 
 
 def remove_clauses(clauses: list[list[int]], indices: list[int]):
+    indices = set(indices)
     return [cl for i, cl in enumerate(clauses) if i not in indices]
 
 
 def remove_variables(clauses: list[list[int]], vars_to_remove: list[int]):
-    return [
-        [lit for lit in cl if abs(lit) not in vars_to_remove]
-        for cl in clauses
-        if all(abs(lit) not in vars_to_remove for lit in cl)
-    ]
+    """Remove all clauses that contain one of the variables"""
+    vars_to_remove = set(vars_to_remove)
+    return [cl for cl in clauses if all(abs(lit) not in vars_to_remove for lit in cl)]
+
+
+class ClauseStore:
+    """
+    Ordered clauses with an index from each variable to the ids of the clauses it occurs in,
+    so that removing clauses or variables does not need to scan all clauses.
+    """
+
+    def __init__(self, clauses: list[list[int]]):
+        self.clauses: dict[int, list[int]] = dict()
+        """Clauses by id, in order"""
+        self.occurrences: dict[int, set[int]] = dict()
+        """Ids of the clauses each variable occurs in. Only contains variables that occur in some clause."""
+        self.next_id = 0
+        for clause in clauses:
+            self.add(clause)
+
+    def __len__(self):
+        return len(self.clauses)
+
+    def variables(self) -> set[int]:
+        """
+        Variables of the clauses. The set is built in clause order, like `set(abs(l) for cl in clauses for l in cl)`,
+        since `random.sample` draws from its iteration order.
+        """
+        return set(abs(l) for cl in self.clauses.values() for l in cl)
+
+    def to_list(self) -> list[list[int]]:
+        return list(self.clauses.values())
+
+    def add(self, clause: list[int]) -> int:
+        id = self.next_id
+        self.next_id += 1
+        self.clauses[id] = clause
+        for lit in clause:
+            self.occurrences.setdefault(abs(lit), set()).add(id)
+        return id
+
+    def remove(self, id: int) -> list[int]:
+        clause = self.clauses.pop(id)
+        for lit in clause:
+            ids = self.occurrences.get(abs(lit))
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self.occurrences[abs(lit)]
+        return clause
+
+    def remove_at(self, positions: set[int]) -> list[list[int]]:
+        """Remove the clauses at the given positions in the current order, and return them in order"""
+        ids = [id for i, id in enumerate(self.clauses) if i in positions]
+        return [self.remove(id) for id in ids]
+
+    def remove_variables(self, variables: list[int]):
+        """Remove all clauses that contain one of the variables"""
+        ids = set()
+        for var in variables:
+            ids |= self.occurrences.get(var, set())
+        for id in ids:
+            self.remove(id)
 
 
 def write_cnf(clauses: list[list[int]], path, var_names):
@@ -46,34 +105,33 @@ def apply_random_steps(
     full_out_dir.mkdir(exist_ok=True, parents=True)
     random.seed(seed)
 
-    clauses = base_clauses[:]
+    clauses = ClauseStore(base_clauses)
     var_names = base_var_names.copy()
     history = []
-    snapshots = [(clauses[:], var_names.copy())]
     all_removed_clauses = []
 
-    for _ in range(steps):
+    # The snapshots are numbered in reverse (the base model is the last one), so snapshot k is known
+    # as soon as step k is done and is written right away instead of keeping all of them in memory.
+    padding = len(str(steps))
+
+    def write_snapshot(k):
+        out_file = os.path.join(full_out_dir, f"{name}_{steps - k:0{padding}d}.dimacs")
+        write_cnf(clauses.to_list(), out_file, var_names)
+
+    write_snapshot(0)
+    for k in range(1, steps + 1):
         step = {}
         clause_count = len(clauses)
-        var_set = set(abs(l) for cl in clauses for l in cl)
+        var_set = clauses.variables()
 
         # Remove clauses
         if clause_count > 0 and random.random() < prob_remove_clause:
             n = random.randint(
                 1, max(1, clause_count // 10)
             )  # remove up to 10% of clauses
-            to_remove_ids = random.sample(range(clause_count), n)
-            remaining_clauses = []
-            removed_clauses = []
-            for i, clause in enumerate(clauses):
-                if i in to_remove_ids:
-                    removed_clauses.append(clause)
-                else:
-                    remaining_clauses.append(clause)
-            # clauses = remove_clauses(clauses, to_remove)
-            # removed_clauses.append(to_remove[:])
+            to_remove_ids = set(random.sample(range(clause_count), n))
+            removed_clauses = clauses.remove_at(to_remove_ids)
             step["remove_clauses"] = removed_clauses
-            clauses = remaining_clauses
             all_removed_clauses.extend(removed_clauses)
 
         # Add clauses
@@ -88,7 +146,7 @@ def apply_random_steps(
                     [abs(l) in var_set for l in all_removed_clauses[i]]
                 ):  # only add the clause if all variables still exist
                     clause = all_removed_clauses.pop(i)
-                    clauses.append(clause)
+                    clauses.add(clause)
                     to_add.append(clause)
             step["add_clauses"] = to_add
 
@@ -96,7 +154,7 @@ def apply_random_steps(
         if random.random() < prob_remove_var and var_set:
             n = random.randint(1, max(1, len(var_set) // 10))
             to_remove = random.sample(list(var_set), n)
-            clauses = remove_variables(clauses, to_remove)
+            clauses.remove_variables(to_remove)
             for v in to_remove:
                 var_names.pop(v, None)
             step["remove_vars"] = to_remove
@@ -112,14 +170,9 @@ def apply_random_steps(
                 var_names[vid] = new_name
             step["rename_vars"] = mapping
 
-        snapshots.append((clauses[:], var_names.copy()))
+        write_snapshot(k)
         history.append(step)
 
-    padding = len(str(steps))
-    for i, (snapshot_clauses, snapshot_names) in enumerate(reversed(snapshots)):
-        out_file = os.path.join(full_out_dir, f"{name}_{i:0{padding}d}.dimacs")
-        write_cnf(snapshot_clauses, out_file, snapshot_names)
-
     metadata = {
         "seed": seed,
         "steps": steps,
@@ -132,6 +185,18 @@ def apply_random_steps(
         json.dump(metadata, f, indent=2)
 
 
+def history_name(
+    base_name: str,
+    seed: int,
+    prob_remove_clause: float,
+    prob_add_clause: float,
+    prob_remove_var: float,
+    prob_rename_var: float,
+) -> str:
+    """Default name of the output directory of a generated history"""
+    return f"{base_name}_seed{seed}_pc{prob_remove_clause}_pa{prob_add_clause}_pv{prob_remove_var}_pr{prob_rename_var}"
+
+
 def parse_var_names(cnf_file) -> dict[int, str]:
     var_names = {}
     with open(cnf_file) as f:
@@ -165,9 +230,13 @@ if __name__ == "__main__":
         args.seed = random.randint(0, 99999)
 
     base_name = Path(args.cnf_file).stem
-    out_dir = (
-        args.out_dir
-        or f"{base_name}_seed{args.seed}_pc{args.p_remove_clause}_pa{args.p_add_clause}_pv{args.p_remove_var}_pr{args.p_rename_var}"
+    out_dir = args.out_dir or history_name(
+        base_name,
+        args.seed,
+        args.p_remove_clause,
+        args.p_add_clause,
+        args.p_remove_var,
+        args.p_rename_var,
     )
     print("Saving generated history to", out_dir)
 
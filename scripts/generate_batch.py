@@ -0,0 +1,222 @@
+import argparse
+import concurrent.futures
+import itertools
+import multiprocessing
+import shutil
+import subprocess
+import sys
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+
+from pysat.formula import CNF
+
+import generate
+import retainment
+import run_pmc
+from utils import Timer, label, run_tool
+
+"""
+Generate the artificial histories of RQ2 in parallel (called by `generate_histories.sh`).
+```
+python scripts/generate_batch.py --jobs 8
+python scripts/generate_batch.py --models data/unwise/ea2468.dimacs --seed 1 2 3 --p_remove_var 0.1 0.3
+```
+One history is generated for each combination of base model, seed and change probabilities.
+Each history then goes through the same stages as in the sequential script: unify (`unified-cli`), preprocess (`run_pmc.py`),
+and compute the predicted retainment (`retainment.py`).
+The histories are processed in parallel, each one in a worker of a process pool that runs all its stages, so while one history is
+being preprocessed, others are still being generated. Regenerating all histories takes about as long as the slowest one (given enough cores).
+The base models are parsed once, before the workers are forked.
+
+The outputs are the same as those of the sequential script: `data/generated/<history>`, `data/generated_unified/<history>`,
+`data/generated_unified_pmc/<history>`, `experiments/batch_gen.txt`, and the plots of the history stats and retainment.
+"""
+
+DEFAULT_MODELS = [
+    Path("data") / "unwise" / "ea2468.dimacs",
+    Path("data") / "unwise" / "uclinux-base.dimacs",
+    Path("data") / "unwise" / "adderii.dimacs",
+    Path("data") / "unwise" / "automotive01.dimacs",
+]
+DEFAULT_STEPS = 50
+DEFAULT_P_REMOVE_CLAUSE = 0.4
+DEFAULT_P_ADD_CLAUSE = 0.9
+DEFAULT_P_REMOVE_VAR = 0.3
+DEFAULT_P_RENAME_VAR = 0.1
+DEFAULT_SEED = 56926
+UNIFIED_DIR = Path(f"{generate.OUTPUT_DIR}_unified")
+PMC_DIR = Path(f"{UNIFIED_DIR}_pmc")
+BATCH_FILE = Path("experiments") / "batch_gen.txt"
+MP_CONTEXT = multiprocessing.get_context("fork")
+"""The workers are forked, so that they share the parsed base models instead of parsing or unpickling them again"""
+
+_base_models: dict[Path, tuple[list[list[int]], dict[int, str]]] = dict()
+"""Clauses and variable names of each base model, read by the workers"""
+
+
+@dataclass(frozen=True)
+class HistoryJob:
+    model: Path
+    steps: int
+    seed: int
+    prob_remove_clause: float
+    prob_add_clause: float
+    prob_remove_var: float
+    prob_rename_var: float
+
+    @property
+    def name(self) -> str:
+        return generate.history_name(
+            self.model.stem,
+            self.seed,
+            self.prob_remove_clause,
+            self.prob_add_clause,
+            self.prob_remove_var,
+            self.prob_rename_var,
+        )
+
+
+def unify(generated_dir: Path, unified_dir: Path):
+    """Like `unify.sh`, for a single history"""
+    if unified_dir.exists():
+        shutil.rmtree(unified_dir)
+    shutil.copytree(generated_dir, unified_dir)
+    result = run_tool(
+        "unified-cli",
+        ["unified-cli", "--overwrite", str(unified_dir)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"unified-cli failed on {unified_dir}:\n{result.stdout}")
+
+
+def process_history(job: HistoryJob) -> dict[str, float]:
+    """Run all stages for one history, returns the time of each stage"""
+    times = dict()
+    timer = Timer(enable_printing=False)
+    clauses, var_names = _base_models[job.model]
+    generate.apply_random_steps(
+        name=job.model.stem,
+        base_clauses=clauses,
+        base_var_names=var_names,
+        steps=job.steps,
+        out_dir=job.name,
+        prob_remove_clause=job.prob_remove_clause,
+        prob_add_clause=job.prob_add_clause,
+        prob_remove_var=job.prob_remove_var,
+        prob_rename_var=job.prob_rename_var,
+        seed=job.seed,
+    )
+    times["generate"] = timer.stop()
+
+    timer.start()
+    unify(generate.OUTPUT_DIR / job.name, UNIFIED_DIR / job.name)
+    times["unify"] = timer.stop()
+
+    timer.start()
+    run_pmc.process_dir(UNIFIED_DIR / job.name, PMC_DIR / job.name, job.name)
+    times["pmc"] = timer.stop()
+
+    timer.start()
+    retainment.main(PMC_DIR / job.name)
+    times["retainment"] = timer.stop()
+    return times
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="generate_batch",
+        description="Generate, unify and preprocess artificial histories in parallel, and compute their retainment",
+    )
+    arg_parser.add_argument(
+        "--models",
+        nargs="+",
+        type=Path,
+        default=DEFAULT_MODELS,
+        help="base models (default: the four models of RQ2)",
+    )
+    arg_parser.add_argument(
+        "--steps", type=int, default=DEFAULT_STEPS, help="number of snapshots to generate"
+    )
+    for option, default in [
+        ("--p_remove_clause", DEFAULT_P_REMOVE_CLAUSE),
+        ("--p_add_clause", DEFAULT_P_ADD_CLAUSE),
+        ("--p_remove_var", DEFAULT_P_REMOVE_VAR),
+        ("--p_rename_var", DEFAULT_P_RENAME_VAR),
+    ]:
+        arg_parser.add_argument(
+            option, nargs="+", type=float, default=[default], help=f"(default: {default})"
+        )
+    arg_parser.add_argument(
+        "--seed", nargs="+", type=int, default=[DEFAULT_SEED], help=f"(default: {DEFAULT_SEED})"
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="number of histories processed in parallel (default: number of cores)",
+    )
+    arg_parser.add_argument(
+        "--no-plots", action="store_true", help="do not plot the history stats and retainment"
+    )
+    args = arg_parser.parse_args()
+
+    jobs = [
+        HistoryJob(model, args.steps, *params)
+        for model in args.models
+        for params in itertools.product(
+            args.seed,
+            args.p_remove_clause,
+            args.p_add_clause,
+            args.p_remove_var,
+            args.p_rename_var,
+        )
+    ]
+    for model in args.models:
+        _base_models[model] = (CNF(from_file=model).clauses, generate.parse_var_names(model))
+
+    print(f"processing {len(jobs)} {'history' if len(jobs) == 1 else 'histories'} with {label(args.jobs, 'worker')}")
+    timer = Timer(enable_printing=False)
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.jobs, mp_context=MP_CONTEXT
+    ) as executor:
+        futures = {executor.submit(process_history, job): job for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                times = future.result()
+            except Exception as e:
+                print(f"FAILED {job.name}:")
+                traceback.print_exception(e)
+                failed.append(job)
+                continue
+            print(
+                f"Finished {job.name}: "
+                + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in times.items())
+            )
+    print(f"processing took {timer.stop():.1f} seconds")
+
+    BATCH_FILE.parent.mkdir(exist_ok=True, parents=True)
+    with BATCH_FILE.open("w") as f:
+        for directory in sorted(PMC_DIR.iterdir()):
+            if directory.is_dir():
+                f.write(f"{directory}\n")
+    print(f"Wrote {BATCH_FILE}")
+
+    if failed:
+        print(f"{len(failed)} {'history' if len(failed) == 1 else 'histories'} failed, not plotting")
+        sys.exit(1)
+    if not args.no_plots:
+        for script in ["plot_history_stats.py", "plot_retainment.py"]:
+            subprocess.run(
+                [sys.executable, f"scripts/plot/{script}", f"{PMC_DIR}/"], check=True
+            )
+
+
+if __name__ == "__main__":
+    main()
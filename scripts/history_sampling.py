@@ -1,29 +1,50 @@
 import argparse
+import json
 import os
 from pathlib import Path
 import random
+import shutil
+import tempfile
 
 import numpy.random
 import pandas as pd
 from tqdm import tqdm
 
-from utils import Timer
+from utils import Timer, copy_tool_stats, peak_memory_usage, reset_peak_memory, tool_stats_since
 from retainment import compute_model_count
+import chunked_sampling
+import precompute
+import sample_store
+from sample_store import SampleStore
+import memory_profile
+from simplify import clear as clear_simplified
+import telemetry
+import tracing
+import retainment_sampling as sampling  # the module, `retainment_sampling` is the function
+from sample_archive import SUFFIX, SampleArchive, to_bits
 from retainment_sampling import (
     get_samples,
     retainment_sampling,
     Sampler,
     Method,
     Algorithm,
+    TOOLS,
 )
 
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "output"))
+RECORD_FILE_ENV = "RECORD_FILE"
+"""Environment variable with a file to which the results are written as JSON (set by `benchmark.py` for each job)"""
 DEFAULT_SAMPLER = Sampler.spur
 DEFAULT_METHOD = Method.none
 DEFAULT_ALGORITHM = Algorithm.uniform
 
 
 def main():
+    args = make_arg_parser().parse_args()
+    benchmark(**benchmark_args(args))
+
+
+def make_arg_parser() -> argparse.ArgumentParser:
     arg_parser = argparse.ArgumentParser(
         description="uniform sampling for feature model histories"
     )
@@ -80,28 +101,68 @@ def main():
         "--seed",
         action="store",
         type=int,
-        default=random.randint(0, 99999),
-        help="random seed",
+        help="random seed (default: a fresh random seed)",
     )
     arg_parser.add_argument(
         "--no-sample-reuse",
         action="store_true",
         help="generate fresh samples instead of using the samples from the previous update",
     )
+    arg_parser.add_argument(
+        "--cache",
+        action="store",
+        type=Path,
+        help="directory with precomputed model counts and samples (see precompute.py)",
+    )
+    arg_parser.add_argument(
+        "--memory-profile",
+        action="store_true",
+        help="trace memory usage and report the top allocation sites after each update (see memory_profile.py)",
+    )
+    arg_parser.add_argument(
+        "--simplify",
+        action="store_true",
+        help="sample simplified formulas without the backbone and free variables, and expand the samples (see simplify.py)",
+    )
+    arg_parser.add_argument(
+        "--sample-store",
+        action="store_true",
+        help="store generated samples and look them up there instead of running the sampler again (see sample_store.py). "
+        "Off by default, since samples found in the store do not measure the runtime of the sampler",
+    )
+    arg_parser.add_argument(
+        "--sample-store-dir",
+        type=Path,
+        default=sample_store.DEFAULT_DIR,
+        help=f"directory of the sample store (default: {sample_store.DEFAULT_DIR})",
+    )
+    arg_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="request at most this many samples at once and keep the samples of each update in a sample archive instead of in memory, for large numbers of samples (see chunked_sampling.py)",
+    )
+
+    return arg_parser
 
-    # parse arguments
-    args = arg_parser.parse_args()
 
-    benchmark(
+def benchmark_args(args: argparse.Namespace) -> dict:
+    """Keyword arguments for `benchmark` from the parsed command-line arguments"""
+    return dict(
         directory=Path(args.directory),
         num_samples=int(args.num_samples),
         algorithm=Algorithm[args.algorithm],
         method=Method[args.method],
         sampler=Sampler[args.sampler],
-        seed=args.seed,
+        # not from `random`, which a previous job in the same process (see in_process.py) has seeded
+        seed=args.seed if args.seed is not None else random.SystemRandom().randint(0, 99999),
         read_model_count=args.read_model_count,
         no_reuse=args.no_sample_reuse,
         write_csv=args.csv,
+        cache_dir=args.cache,
+        profile_memory=args.memory_profile,
+        simplify=args.simplify,
+        sample_store_dir=args.sample_store_dir if args.sample_store else None,
+        chunk_size=args.chunk_size,
     )
 
 
@@ -115,6 +176,11 @@ def benchmark(
     read_model_count=False,
     no_reuse=False,
     write_csv=False,
+    cache_dir: Path | None = None,
+    profile_memory=False,
+    simplify=False,
+    sample_store_dir: Path | None = None,
+    chunk_size: int | None = None,
 ):
     print(directory)
     print(num_samples, "samples")
@@ -122,13 +188,46 @@ def benchmark(
     print("seed:", seed)
     random.seed(seed)
     numpy.random.seed(seed)
+    sampling.SIMPLIFY = simplify
+    sampling.SAMPLE_STORE = SampleStore(sample_store_dir) if sample_store_dir else None
 
     # start timer
     timer = Timer()
+    tools_before = copy_tool_stats()
+    reset_peak_memory()  # in a long-lived worker, only this job counts
 
     # collect all DIMACS files from directory
     dimacs_files = sorted(directory.glob("*.dimacs"))
 
+    if profile_memory:
+        memory_profile.init()
+    else:
+        memory_profile.init_from_env()
+    telemetry.init_from_env(
+        labels={"directory": directory, "method": method, "algorithm": algorithm}
+    )
+    telemetry.set_gauge(
+        "history_sampling_updates",
+        len(dimacs_files) - 1,
+        help="number of updates in the history",
+    )
+
+    # precomputed results shared with other runs on the same history
+    conjunction_count: dict[tuple[str, str], int] = dict()
+    samples_first = None
+    if cache_dir is not None and not cache_dir.exists():
+        # e.g. a remote worker (see work_queue.py) without the cache of the coordinator
+        print(f"Warning: cache {cache_dir} not found, computing everything in this job")
+        cache_dir = None
+    if cache_dir is not None:
+        history_cache = precompute.history_cache_dir(cache_dir, directory)
+        conjunction_count = precompute.read_conjunction_counts(history_cache)
+        # the precomputed samples are samples of the original formula, drawn with a single call of the sampler
+        if not simplify and chunk_size is None:
+            samples_first = precompute.load_initial_samples(
+                history_cache, sampler, num_samples, seed
+            )
+
     # model count
     model_count: dict[str, int | None] = dict()
     if read_model_count:
@@ -141,66 +240,167 @@ def benchmark(
             k: int(v)
             for k, v in df_mc.set_index("file")["model_count"].to_dict().items()
         }
+    elif cache_dir is not None and (
+        model_count := precompute.read_model_counts(history_cache)  # type: ignore
+    ):
+        print("Using precomputed model counts")
     elif method not in [Method.none]:  # Method.bdd
         print("Computing model count of each file:")
-        for file in tqdm(dimacs_files):
-            count = compute_model_count(file)
-            assert count
-            model_count[file.name] = count
+        with tracing.span("model_counts", args={"directory": directory}):
+            for file in tqdm(dimacs_files):
+                count = compute_model_count(file)
+                assert count
+                model_count[file.name] = count
+        memory_profile.snapshot("model counts")
 
     # perform sampling according to the selected method
-    all_samples: set[tuple[int]] = set()
-    if method == Method.none:
-        for file in tqdm(dimacs_files):
-            samples = get_samples(file, num_samples, sampler)
-            all_samples = all_samples.union(samples_to_set(samples))
-    else:
-        print("Processing pairs")
-        records = []
-        samples_old = get_samples(dimacs_files[0], num_samples, sampler)
-        for i in tqdm(range(len(dimacs_files) - 1)):
-            file_old, file_new = dimacs_files[i], dimacs_files[i + 1]
-            sample_timer = Timer(enable_printing=False)
-            samples, results = retainment_sampling(
-                sampler,
-                method,
-                algorithm,
-                file_old,
-                file_new,
-                num_samples,
-                samples_old=samples_old,
-                count_old=model_count.get(file_old.name),
-                count_new=model_count.get(file_new.name),
-            )
-            sampling_time = sample_timer.stop()
-            records.append(
-                {
-                    "directory": directory,
-                    "seed": seed,
-                    "file_old": file_old.name,
-                    "file_new": file_new.name,
-                    "sampler": sampler,
-                    "method": method,
-                    "algorithm": algorithm,
-                    "sampling_time": sampling_time,
-                    **results,
-                }
-            )
-            if no_reuse:
-                samples_old = get_samples(file_new, num_samples, sampler)
-            else:
-                if len(samples) != num_samples:
-                    print(
-                        f"Update {i}: Warning: number of samples is {len(samples)}, but should be {num_samples}"
+    all_samples: set[bytes] = set()
+    samples_dir = None
+    try:
+        if chunk_size is not None:
+            # the samples of each snapshot are kept in an archive in samples_dir, and only their fingerprints in memory
+            all_samples = chunked_sampling.UniqueSamples()
+            samples_dir = Path(tempfile.mkdtemp())
+        if samples_first is None:
+            with tracing.span("initial_samples", args={"file": dimacs_files[0].name}):
+                if chunk_size is not None:
+                    samples_first = chunked_sampling.sample_to_archive(
+                        dimacs_files[0], num_samples, sampler, samples_dir / f"0{SUFFIX}", chunk_size
                     )
-                samples_old = samples if len(samples) == num_samples else None
-            all_samples = all_samples.union(samples_to_set(samples))
+                else:
+                    samples_first = get_samples(dimacs_files[0], num_samples, sampler)
+            memory_profile.snapshot("initial samples")
+        if method == Method.none:
+            for i, file in enumerate(tqdm(dimacs_files)):
+                if chunk_size is not None:
+                    if i == 0:
+                        all_samples.add_archive(samples_first)
+                    else:
+                        with tracing.span("snapshot", args={"file": file.name}):
+                            for samples in chunked_sampling.sample_chunks(file, num_samples, sampler, chunk_size):
+                                all_samples.add_samples(samples)
+                else:
+                    if i == 0:
+                        samples = samples_first
+                    else:
+                        with tracing.span("snapshot", args={"file": file.name}):
+                            samples = get_samples(file, num_samples, sampler)
+                    with tracing.span("union"):
+                        all_samples = all_samples.union(samples_to_set(samples))
+                memory_profile.snapshot(f"snapshot {file.name}")
+                telemetry.inc(
+                    "history_sampling_snapshots_done",
+                    help="number of snapshots sampled so far",
+                )
+        else:
+            print("Processing pairs")
+            records = []
+            samples_old = samples_first
+            for i in tqdm(range(len(dimacs_files) - 1)):
+                file_old, file_new = dimacs_files[i], dimacs_files[i + 1]
+                memory_profile.reset_peaks()
+                sample_timer = Timer(enable_printing=False)
+                with tracing.span(
+                    "update", args={"update": i, "file_old": file_old.name, "file_new": file_new.name}
+                ):
+                    if chunk_size is not None:
+                        samples, results = chunked_sampling.retainment_sampling_chunked(
+                            sampler,
+                            method,
+                            algorithm,
+                            file_old,
+                            file_new,
+                            num_samples,
+                            samples_dir / f"{i + 1}{SUFFIX}",
+                            samples_old=samples_old,
+                            chunk_size=chunk_size,
+                            count_old=model_count.get(file_old.name),
+                            count_new=model_count.get(file_new.name),
+                            count_conj=conjunction_count.get((file_old.name, file_new.name)),
+                        )
+                    else:
+                        samples, results = retainment_sampling(
+                            sampler,
+                            method,
+                            algorithm,
+                            file_old,
+                            file_new,
+                            num_samples,
+                            samples_old=samples_old,
+                            count_old=model_count.get(file_old.name),
+                            count_new=model_count.get(file_new.name),
+                            count_conj=conjunction_count.get((file_old.name, file_new.name)),
+                        )
+                sampling_time = sample_timer.stop()
+                records.append(
+                    {
+                        "directory": directory,
+                        "seed": seed,
+                        "file_old": file_old.name,
+                        "file_new": file_new.name,
+                        "sampler": sampler,
+                        "method": method,
+                        "algorithm": algorithm,
+                        "sampling_time": sampling_time,
+                        **results,
+                    }
+                )
+                if chunk_size is not None:
+                    with SampleArchive(samples) as archive:
+                        num_samples_new = len(archive)
+                else:
+                    num_samples_new = len(samples)
+                previous = samples_old
+                if no_reuse:
+                    with tracing.span("snapshot", args={"file": file_new.name}):
+                        if chunk_size is not None:
+                            samples_old = chunked_sampling.sample_to_archive(
+                                file_new, num_samples, sampler, samples_dir / f"{i + 1}_fresh{SUFFIX}", chunk_size
+                            )
+                        else:
+                            samples_old = get_samples(file_new, num_samples, sampler)
+                else:
+                    if num_samples_new != num_samples:
+                        print(
+                            f"Update {i}: Warning: number of samples is {num_samples_new}, but should be {num_samples}"
+                        )
+                    samples_old = samples if num_samples_new == num_samples else None
+                with tracing.span("union"):
+                    if chunk_size is not None:
+                        all_samples.add_archive(samples, chunk_size)
+                        # only the old samples of the next update are needed on disk
+                        for path in {previous, samples} - {samples_old}:
+                            if path is not None:
+                                path.unlink(missing_ok=True)
+                    else:
+                        all_samples = all_samples.union(samples_to_set(samples))
+                records[-1] |= memory_profile.update_stats()
+                memory_profile.snapshot(f"update {i} ({file_old.name} -> {file_new.name})")
+                telemetry.inc(
+                    "history_sampling_updates_done",
+                    help="number of updates processed so far",
+                )
+                telemetry.set_gauge(
+                    "history_sampling_updates_per_second", (i + 1) / timer.elapsed()
+                )
+    finally:
+        # also if the job fails, since the archives can take gigabytes
+        if samples_dir is not None:
+            shutil.rmtree(samples_dir)
 
     duration = timer.stop()
+    telemetry.close()
+    memory_profile.stop()
+    clear_simplified()
     total_samples = len(dimacs_files) * num_samples
     print(f"Total samples: {total_samples}")
     unique_samples = len(all_samples)
     print(f"Unique samples: {unique_samples} (-{1-(unique_samples/total_samples):.2%})")
+    peak_memory, peak_memory_tools = peak_memory_usage()
+    print(
+        f"Peak memory: {'unknown' if peak_memory is None else f'{peak_memory} bytes'}"
+        f" (tools: {'unknown' if peak_memory_tools is None else f'{peak_memory_tools} bytes'})"
+    )
     # print("last sample:", hash(tuple(samples[-1])))
 
     if write_csv and method != Method.none:
@@ -223,20 +423,43 @@ def benchmark(
         "total_samples": total_samples,
         "unique_samples": unique_samples,
         "time": duration,
+        "peak_memory": peak_memory,
     }
+    record_file = os.getenv(RECORD_FILE_ENV)
+    if record_file:
+        record = results | {
+            "directory": str(directory),
+            "num_samples": num_samples,
+            "snapshots": len(dimacs_files),
+            "no_reuse": no_reuse,
+            "simplify": simplify,
+            "sample_store": sample_store_dir is not None,
+            "chunk_size": chunk_size,
+            "peak_memory_tools": peak_memory_tools,
+            **tool_stats_since(tools_before, TOOLS),
+        }
+        with open(record_file, "w") as f:
+            json.dump(record, f)
     return results
 
 
-def samples_to_set(samples: list[list[int]]) -> set[tuple[int]]:
+def samples_to_set(samples: list[list[int]]) -> set[bytes]:
     """
-    >>> samples_to_set([[-1,3,2],[3,-2,1],[-3,2,-1]])
-    {(-1, 2, -3), (-1, 2, 3), (1, -2, 3)}
+    The samples as rows with one bit per variable (see `sample_archive.py`), which take far less memory than tuples of literals.
+    All samples must assign the same variables (samples of Tseitin formulas are projected onto the variables of the model).
+    Each row starts with the number of variables, so that samples of snapshots with different numbers of variables are never equal.
+
+    >>> len(samples_to_set([[-1,3,2],[3,-2,1],[1,-2,3]]))
+    2
+    >>> samples_to_set([[1, -2]]) == samples_to_set([[1, -2, -3]])
+    False
     """
-    sample_set = set()
-    for s in samples:
-        s.sort(key=abs)
-        sample_set.add(tuple(s))
-    return sample_set
+    if not samples:
+        return set()
+    num_vars = len(samples[0])
+    rows = numpy.packbits(to_bits(samples, num_vars), axis=1, bitorder="little")
+    prefix = num_vars.to_bytes(4, "little")
+    return {prefix + row.tobytes() for row in rows}
 
 
 if __name__ == "__main__":
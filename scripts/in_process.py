@@ -0,0 +1,189 @@
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import traceback
+
+from benchmark import (
+    METRICS_DIR_ENV,
+    RECORD_FILE_ENV,
+    job_name,
+    log_file,
+    metrics_file,
+    record_file,
+    sampling_args,
+)
+from utils import Timer, human_duration
+
+"""
+Run `history_sampling.py` jobs of `benchmark.py --in-process` in long-lived worker processes.
+
+Each worker imports `history_sampling` (and with it pandas, numpy, pysat, ...) once and then calls `history_sampling.benchmark()` directly for every job,
+so the measured runtime does not include starting the Python interpreter and importing the libraries.
+The output of a job is written to its log file just like for jobs that run as separate processes.
+If a job reaches the timeout, its worker (including all child processes like SPUR or sharpSAT) is killed and replaced by a fresh one.
+"""
+
+MP_CONTEXT = multiprocessing.get_context("spawn")
+"""Workers are started from threads, so do not fork"""
+
+
+def serve(connection):
+    """Main loop of a worker process: run the jobs received over `connection`"""
+    # become leader of a new process group, so that the worker can be killed together with all tools it started
+    os.setsid()
+    import history_sampling
+    import memory_profile
+    import simplify
+
+    while (job := connection.recv()) is not None:
+        argv, output_file = job
+        if os.getenv(METRICS_DIR_ENV):
+            os.environ["METRICS_FILE"] = metrics_file(output_file)
+        os.environ[RECORD_FILE_ENV] = record_file(output_file)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(record_file(output_file))
+        with open(output_file, "a") as log:
+            with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+                try:
+                    args = history_sampling.make_arg_parser().parse_args(argv)
+                    timer = Timer(enable_printing=False)
+                    history_sampling.benchmark(**history_sampling.benchmark_args(args))
+                    status = (0, timer.stop())
+                except SystemExit as e:  # e.g. invalid arguments
+                    status = (e.code if isinstance(e.code, int) else 1, None)
+                except MemoryError:
+                    traceback.print_exc()
+                    status = (-6, None)
+                except Exception:
+                    traceback.print_exc()
+                    status = (1, None)
+                finally:
+                    # a job with --memory-profile must not profile the following jobs,
+                    # and the simplified files of a job are not needed by the next
+                    memory_profile.stop()
+                    simplify.clear()
+        # only after the log is closed, so that the output of the job is in the log before the caller appends to it
+        connection.send(status)
+
+
+class SamplingWorker:
+    """Handle of a worker process that runs `history_sampling` jobs"""
+
+    def __init__(self):
+        self.process = None
+        self.connection = None
+        self.start()
+
+    def start(self):
+        self.connection, child_connection = MP_CONTEXT.Pipe()
+        self.process = MP_CONTEXT.Process(
+            target=serve, args=(child_connection,), daemon=True
+        )
+        self.process.start()
+
+    def kill(self):
+        """Kill the worker and all processes it started"""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)  # type: ignore
+        except ProcessLookupError:
+            pass
+        self.process.join()  # type: ignore
+
+    def stop(self):
+        try:
+            self.connection.send(None)  # type: ignore
+        except OSError:
+            pass
+        self.process.join()  # type: ignore
+
+    def run(self, argv, output_file, timeout):
+        """
+        Run `history_sampling` with the arguments `argv`, writing its output to `output_file`.
+        Returns the exit code and the runtime (`None` unless the exit code is 0).
+        Raises `TimeoutError` if the job takes longer than `timeout` seconds.
+        """
+        self.connection.send((argv, output_file))  # type: ignore
+        if not self.connection.poll(timeout):  # type: ignore
+            self.kill()
+            self.start()
+            raise TimeoutError
+        try:
+            return self.connection.recv()  # type: ignore
+        except EOFError:
+            # the worker died, e.g. killed by the OS because it ran out of memory
+            self.process.join()  # type: ignore
+            exitcode = self.process.exitcode  # type: ignore
+            self.start()
+            return exitcode, None
+
+    def process_file(self, file_path, output_path, params, command, timeout):
+        """Counterpart of `benchmark.process_file` that runs the job in this worker"""
+        name = job_name(file_path, params)
+        print(f"{name}: started")
+        output_file = log_file(file_path, output_path, params)
+        argv = sampling_args(command) + params + file_path.split(" ")
+        with open(output_file, "a") as file:
+            file.write("Running command: " + " ".join(command + params + [file_path]) + "\n")
+        try:
+            returncode, timing = self.run(argv, output_file, timeout)
+        except TimeoutError:
+            with open(output_file, "a") as file:
+                file.write(f"timeout of {timeout}s reached\n")
+            print(f"{name}: timeout after {timeout}s")
+            return name, "timeout"
+
+        if returncode == 0:
+            with open(output_file, "a") as file:
+                file.write(f"overall time: {human_duration(timing)}\n")
+            test_result = str(timing)
+            print(f"{name}: finished")
+        elif returncode == -6:
+            test_result = "memout"
+            print(f"{name}: memout")
+        else:
+            test_result = f"error ({returncode})"
+            print(f"{name}: error {returncode}")
+        return name, test_result
+
+
+def run_jobs_in_process(jobs, output_path, command, timeout, num_cores):
+    """
+    Run the jobs, given as `(file, params)` pairs, in `num_cores` long-lived `history_sampling` workers.
+    Yields a `(file, params, future)` tuple for each job as soon as it is completed.
+    """
+    sampling_args(command)  # fail early if the command is not supported
+    pending = queue.Queue()
+    for job in jobs:
+        pending.put(job)
+    finished = queue.Queue()
+
+    def work():
+        worker = SamplingWorker()
+        try:
+            while True:
+                try:
+                    file, params = pending.get_nowait()
+                except queue.Empty:
+                    return
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(
+                        worker.process_file(file, output_path, params, command, timeout)
+                    )
+                except Exception as e:
+                    future.set_exception(e)
+                finished.put((file, params, future))
+        finally:
+            worker.stop()
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(num_cores)]
+    for thread in threads:
+        thread.start()
+    for _ in range(len(jobs)):
+        yield finished.get()
+    for thread in threads:
+        thread.join()
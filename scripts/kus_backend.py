@@ -0,0 +1,240 @@
+import argparse
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from run_pmc import file_hash
+from utils import Timer, label, record_tool_stats, run_tool
+import tracing
+
+"""
+Runs KUS for `retainment_sampling.get_samples_kus`, with a cache of the compiled d-DNNFs and a long-lived worker process.
+
+d-DNNF cache: KUS compiles a formula `<file>` with d4 to `<file>.nnf` before it samples. Afterwards, the d-DNNF is moved
+to the cache in `data/nnf_cache/` (`KUS_NNF_CACHE`) under the hash of the content of the formula. When KUS samples a formula
+with the same content again, e.g. the same snapshot in the next update or in another run, or the temporary conjunction
+of the same two snapshots, it gets the cached d-DNNF with `--dDNNF` and skips the compilation.
+The cache is limited to `KUS_NNF_CACHE_MAX_GB` gigabytes (default: 10) and evicts the least recently used d-DNNFs.
+
+Worker: instead of starting `python3 KUS.py` for every call, a worker process (see `kus_worker.py`) started on the first call
+runs `KUS.py` for each call, so Python and the modules KUS imports are loaded once per run.
+KUS has no interface to keep a parsed d-DNNF between calls, so each call still parses the cached d-DNNF.
+With `KUS_WORKER=0`, or after the worker process died, `python3 KUS.py` is started for every call.
+If KUS fails on an input, only that call fails (with `KusError`) and the worker keeps running.
+The output of KUS and d4 in the worker goes to a temporary log file, which is kept if a call failed.
+```
+python scripts/kus_backend.py             # size and number of cached d-DNNFs
+python scripts/kus_backend.py --max-gb 1  # evict down to 1 GB
+python scripts/kus_backend.py --clear
+```
+"""
+
+NNF_CACHE_DIR = Path(os.getenv("KUS_NNF_CACHE", Path("data") / "nnf_cache"))
+NNF_CACHE_MAX_BYTES = int(float(os.getenv("KUS_NNF_CACHE_MAX_GB", 10)) * 10**9)
+USE_WORKER = os.getenv("KUS_WORKER", "1") != "0"
+WORKER_SCRIPT = Path(__file__).with_name("kus_worker.py").absolute()
+
+
+class NnfCache:
+    """Compiled d-DNNFs by the hash of the content of the formula"""
+
+    def __init__(self, directory: Path = NNF_CACHE_DIR, max_bytes: int = NNF_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size: int | None = None
+        """Total size of the d-DNNFs, computed on the first write"""
+        self._hashes: dict[tuple[str, int, int], str] = dict()
+        """Hash of each formula by path, modification time and size"""
+
+    def path(self, file: Path) -> Path:
+        stat = file.stat()
+        key = (str(file.resolve()), stat.st_mtime_ns, stat.st_size)
+        if key not in self._hashes:
+            self._hashes[key] = file_hash(file).hexdigest()
+        digest = self._hashes[key]
+        return (self.directory / digest[:2] / f"{digest}.nnf").absolute()
+
+    def get(self, file: Path) -> Path | None:
+        """The cached d-DNNF of `file`, or `None` if it has not been compiled yet"""
+        path = self.path(file)
+        try:
+            os.utime(path)  # most recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, file: Path, nnf_file: Path):
+        """Move the d-DNNF `nnf_file` of `file` into the cache, and evict old d-DNNFs if the cache is too large"""
+        path = self.path(file)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        # unique per process, so that processes compiling the same formula do not write into the same temporary file
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        shutil.move(nnf_file, tmp_path)
+        os.replace(tmp_path, path)
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += path.stat().st_size
+        if self.size > self.max_bytes:
+            self.evict(self.max_bytes)
+
+    def entries(self) -> list[tuple[Path, int, int]]:
+        """Path, size and modification time of each d-DNNF"""
+        entries = []
+        for path in self.directory.glob("*/*.nnf"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def evict(self, max_bytes: int) -> int:
+        """Delete the least recently used d-DNNFs until the cache is at most `max_bytes` large, returns how many were deleted"""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        deleted = 0
+        for path, size, _ in entries:
+            if self.size <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+            deleted += 1
+        return deleted
+
+
+class WorkerError(Exception):
+    """The worker process exited or cannot be reached"""
+
+
+class KusError(Exception):
+    """KUS failed on an input"""
+
+
+class KusWorker:
+    """Runs `KUS.py` in a long-lived process (see `kus_worker.py`)"""
+
+    def __init__(self, kus_path: str):
+        self.log = tempfile.NamedTemporaryFile("w", prefix="kus_worker_", suffix=".log", delete=False)
+        """Everything KUS and d4 print"""
+        self.keep_log = False
+        """Whether the log is kept after closing, to diagnose a failure"""
+        self.process = subprocess.Popen(
+            ["python3", str(WORKER_SCRIPT), kus_path],
+            cwd=kus_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.log,
+            text=True,
+        )
+
+    def run(self, args: list[str]):
+        """
+        Run `KUS.py` with the command-line arguments `args`, recording the call in `utils.tool_stats`.
+        Raises `KusError` if KUS fails, and `WorkerError` if the worker process exited.
+        """
+        timer = Timer(enable_printing=False)
+        with tracing.span("kus", cat="tool", args={"cmd": " ".join(["KUS.py", *args]), "worker": True}):
+            try:
+                self.process.stdin.write(json.dumps({"args": args}) + "\n")
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+            except BrokenPipeError:
+                line = ""
+        if not line:
+            self.keep_log = True
+            raise WorkerError(f"KUS worker exited with {self.process.wait()} (output in {self.log.name})")
+        try:
+            response = json.loads(line)
+        except json.JSONDecodeError:
+            self.keep_log = True
+            raise WorkerError(f"invalid response of the KUS worker: {line!r} (output in {self.log.name})")
+        record_tool_stats("kus", timer.stop(), response["cpu_time"])
+        if not response["ok"]:
+            self.keep_log = True
+            raise KusError(f"{response['error'].rstrip()} (output in {self.log.name})")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+        if not self.keep_log:
+            os.remove(self.log.name)
+
+
+_cache = NnfCache()
+_worker: KusWorker | None = None
+_worker_failed = False
+
+
+def run_kus(file: Path, n: int, seed: int, output_file: Path):
+    """Run KUS to write `n` samples of `file` to `output_file`, with the cached d-DNNF of `file` if there is one"""
+    global _worker, _worker_failed
+    kus_path = os.getenv("KUS")
+    assert kus_path, "set environment variable 'KUS' to point to the KUS repository"
+    args = ["--samples", str(n), "--outputfile", str(output_file), "--seed", str(seed)]
+    # KUS writes the d-DNNF of a formula next to it
+    compiled_file = file.with_name(file.name + ".nnf").absolute()
+    nnf_file = _cache.get(file)
+    if nnf_file is None and compiled_file.exists():
+        _cache.put(file, compiled_file)
+        nnf_file = _cache.get(file)
+    if nnf_file is not None:
+        args.extend(["--dDNNF", str(nnf_file)])
+    else:
+        args.append(str(file.absolute()))
+
+    if USE_WORKER and not _worker_failed:
+        try:
+            if _worker is None:
+                _worker = KusWorker(kus_path)
+                atexit.register(_worker.close)
+            _worker.run(args)
+        except WorkerError as e:
+            # KusError (KUS failed on this input) is raised to the caller, like a failing `python3 KUS.py`
+            print(f"KUS worker failed, starting KUS for each call from now on: {e}")
+            _worker.close()
+            _worker_failed = True
+    if not USE_WORKER or _worker_failed:
+        result = run_tool("kus", ["python3", "KUS.py", *args], capture_output=True, cwd=kus_path)
+        result.check_returncode()
+
+    if nnf_file is None and compiled_file.exists():
+        _cache.put(file, compiled_file)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="kus_backend", description="Show the size of the cache of compiled d-DNNFs and evict d-DNNFs"
+    )
+    arg_parser.add_argument(
+        "--directory", type=Path, default=NNF_CACHE_DIR, help=f"d-DNNF cache (default: {NNF_CACHE_DIR})"
+    )
+    arg_parser.add_argument(
+        "--max-gb", type=float, help="delete the least recently used d-DNNFs until the cache is at most this large"
+    )
+    arg_parser.add_argument("--clear", action="store_true", help="delete all d-DNNFs")
+    args = arg_parser.parse_args()
+
+    cache = NnfCache(args.directory)
+    if args.clear:
+        args.max_gb = 0
+    if args.max_gb is not None:
+        deleted = cache.evict(int(args.max_gb * 10**9))
+        print(f"deleted {label(deleted, 'd-DNNF')}")
+    entries = cache.entries()
+    print(f"{cache.directory}: {label(len(entries), 'd-DNNF')}, {sum(size for _, size, _ in entries) / 10**9:.3f} GB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import json
+import os
+import resource
+import runpy
+import sys
+import traceback
+from pathlib import Path
+
+"""
+Long-lived process that runs `KUS.py` for each request of `kus_backend.KusWorker`, started in the KUS repository:
+```
+python3 kus_worker.py <KUS repository>
+```
+Each request is a JSON line `{"args": [...]}` with the command-line arguments of `KUS.py` on stdin,
+each response a JSON line `{"ok": true, "cpu_time": 1.2}` (or `{"ok": false, "error": "...", ...}`) on stdout.
+`KUS.py` runs in this process as if it was started as a script, so Python and the modules KUS imports are only loaded once.
+Everything KUS and d4 print goes to stderr, since stdout is reserved for the responses.
+
+Only uses the standard library, since it runs with the Python of KUS.
+"""
+
+
+def cpu_time() -> float:
+    """CPU time of this process and its terminated child processes (d4)"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def main():
+    script = str(Path(sys.argv[1]) / "KUS.py")
+    sys.path.insert(0, sys.argv[1])
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    for line in sys.stdin:
+        request = json.loads(line)
+        before = cpu_time()
+        response = {"ok": True}
+        sys.argv = [script, *request["args"]]
+        try:
+            runpy.run_path(script, run_name="__main__")
+        except SystemExit as e:
+            if e.code not in [None, 0]:
+                response = {"ok": False, "error": f"KUS.py exited with {e.code}"}
+        except Exception:
+            response = {"ok": False, "error": traceback.format_exc()}
+        sys.stdout.flush()
+        response["cpu_time"] = cpu_time() - before
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    main()
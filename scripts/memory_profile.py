@@ -0,0 +1,194 @@
+import contextlib
+import linecache
+import os
+import subprocess
+import sys
+import threading
+import tracemalloc
+
+from telemetry import memory_in_use
+
+"""
+Opt-in memory profiling of the sampling pipeline.
+
+Enabled with `history_sampling.py --memory-profile` or by setting the environment variable `MEMORY_PROFILE=1` (e.g. for all jobs of `benchmark.py`).
+While enabled,
+- Python allocations are traced with `tracemalloc`. At the boundaries of the stages of `history_sampling` (model counting, initial samples, each update),
+  a snapshot is taken and the allocation sites that grew the most since the previous snapshot are printed, grouped by module and by line.
+- the resident memory of the external tools started with `utils.run_tool` is sampled while they run.
+- the results of each update in the CSV file contain the peak memory of the Python heap during the update and during each phase of retainment sampling,
+  the resident memory of the process after the update, and the peak resident memory of the tools run during the update.
+While disabled, the functions of this module return immediately.
+"""
+
+MEMORY_PROFILE_ENV = "MEMORY_PROFILE"
+TOP_ALLOCATION_SITES = 10
+"""Number of allocation sites shown per snapshot"""
+RSS_SAMPLING_INTERVAL = 0.05
+"""Seconds between two samples of the resident memory of a running tool"""
+
+_enabled = False
+_last_snapshot: tracemalloc.Snapshot | None = None
+_peak_before = 0
+"""Peak of the traced Python heap before the peak of `tracemalloc` was last reset by `measure_peak`"""
+peak_child_rss = 0
+"""Peak resident memory (bytes) of tools run since the last `reset_peaks`"""
+_env_before: str | None = None
+"""Value of `MEMORY_PROFILE` before `init`, restored by `stop`"""
+
+
+def init():
+    """Enable memory profiling for this process and the processes it starts"""
+    global _enabled, _env_before
+    if not _enabled:
+        _env_before = os.environ.get(MEMORY_PROFILE_ENV)
+    _enabled = True
+    os.environ[MEMORY_PROFILE_ENV] = "1"
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def init_from_env():
+    """Enable memory profiling if the environment variable `MEMORY_PROFILE` is set"""
+    if os.getenv(MEMORY_PROFILE_ENV, "") not in ["", "0"]:
+        init()
+
+
+def stop():
+    """Disable memory profiling again, e.g. at the end of a job in a long-lived worker (see `in_process.py`)"""
+    global _enabled, _last_snapshot
+    if not _enabled:
+        return
+    _enabled = False
+    _last_snapshot = None
+    tracemalloc.stop()
+    if _env_before is None:
+        os.environ.pop(MEMORY_PROFILE_ENV, None)
+    else:
+        os.environ[MEMORY_PROFILE_ENV] = _env_before
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset_peaks():
+    """Start measuring new peaks, e.g. at the start of an update"""
+    global peak_child_rss, _peak_before
+    if _enabled:
+        tracemalloc.reset_peak()
+        _peak_before = 0
+        peak_child_rss = 0
+
+
+def peak_memory() -> int:
+    """Peak size (bytes) of the traced Python heap since the last call of `reset_peaks`"""
+    return max(_peak_before, tracemalloc.get_traced_memory()[1])
+
+
+@contextlib.contextmanager
+def measure_peak():
+    """
+    Measure the peak of the traced Python heap while the body runs (not nestable).
+
+    >>> with measure_peak() as memory:
+    ...     squares = [x * x for x in range(10**6)]
+    >>> memory["peak"]
+    40448632
+    """
+    global _peak_before
+    memory = dict()
+    if not _enabled:
+        yield memory
+        return
+    _peak_before = peak_memory()
+    tracemalloc.reset_peak()
+    try:
+        yield memory
+    finally:
+        memory["peak"] = tracemalloc.get_traced_memory()[1]
+
+
+def update_stats() -> dict:
+    """Memory statistics since the last call of `reset_peaks`, for the results of an update"""
+    if not _enabled:
+        return dict()
+    return {
+        "peak_memory": peak_memory(),
+        "rss": memory_in_use(),
+        "peak_child_rss": peak_child_rss,
+    }
+
+
+def snapshot(stage: str):
+    """Print the allocation sites that grew the most since the previous snapshot"""
+    global _last_snapshot
+    if not _enabled:
+        return
+    # leave out the allocations of the profiling itself
+    current = tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, module.__file__)
+            for module in [tracemalloc, linecache, sys.modules[__name__]]
+        ]
+    )
+    current_size, peak_size = tracemalloc.get_traced_memory()
+    print(
+        f"[memory] {stage}: {current_size / 2**20:.1f} MiB traced (peak {peak_size / 2**20:.1f} MiB), {memory_in_use() / 2**20:.1f} MiB resident"
+    )
+    for key_type in ["filename", "lineno"]:
+        if _last_snapshot is None:
+            stats = current.statistics(key_type)
+        else:
+            stats = current.compare_to(_last_snapshot, key_type)
+        print(f"[memory]   top allocation sites by {'module' if key_type == 'filename' else 'line'}:")
+        for stat in stats[:TOP_ALLOCATION_SITES]:
+            frame = stat.traceback[0]
+            site = os.path.basename(frame.filename)
+            if key_type == "lineno":
+                site += f":{frame.lineno}  {linecache.getline(frame.filename, frame.lineno).strip()}"
+            size_diff = getattr(stat, "size_diff", stat.size)
+            print(
+                f"[memory]     {stat.size / 2**20:9.2f} MiB ({size_diff / 2**20:+.2f} MiB) in {stat.count} blocks  {site}"
+            )
+    _last_snapshot = current
+
+
+def process_rss(pid: int) -> int:
+    """Resident memory (bytes) of the process `pid`, or 0 if it is not available"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def run_sampled(cmd, capture_output=False, text=None, **kwargs):
+    """
+    Like `subprocess.run`, but samples the resident memory of the process while it runs.
+    Returns the completed process and its peak resident memory in bytes.
+    """
+    global peak_child_rss
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+    peak = 0
+    with subprocess.Popen(cmd, text=text, **kwargs) as process:
+        finished = threading.Event()
+
+        def sample():
+            nonlocal peak
+            while True:
+                peak = max(peak, process_rss(process.pid))
+                if finished.wait(RSS_SAMPLING_INTERVAL):
+                    return
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            finished.set()
+            sampler.join()
+    peak_child_rss = max(peak_child_rss, peak)
+    return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr), peak
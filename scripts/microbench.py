@@ -0,0 +1,338 @@
+import argparse
+import datetime
+import fnmatch
+import json
+import platform
+import random
+import sys
+import tempfile
+import timeit
+from dataclasses import dataclass
+from pathlib import Path
+
+from pysat.formula import CNF
+from pysat.solvers import Solver
+
+import generate
+import perf_stats
+import sample_archive
+import simplify
+from history_sampling import samples_to_set
+from retainment import conjunction, read_dimacs
+from retainment_sampling import (
+    expand_spur_sample,
+    parse_spur_output,
+    read_samples,
+    reject_valid,
+    write_samples,
+)
+from utils import git_commit
+
+"""
+Micro-benchmarks for the Python code that runs between the calls of the external tools.
+
+```
+python scripts/microbench.py run -o baseline.json
+# ... change something ...
+python scripts/microbench.py run -o current.json
+python scripts/microbench.py compare baseline.json current.json
+```
+`run` times each benchmark repeatedly (with `timeit`) and writes the timings to a JSON file.
+`compare` prints the change of the median time per benchmark and exits with status 1 if a benchmark got slower than the threshold.
+
+The inputs are recorded feature models: two consecutive snapshots of a history (default: the first two of `data/histories_unified_pmc/BusyBox`)
+and a large model (default: `data/unwise/automotive01.dimacs`).
+No external tools are needed: samples are generated with a stub sampler (a SAT solver with random phases),
+and SPUR output files are written in SPUR's format from these samples, with some variables left open as '*'.
+"""
+
+DEFAULT_HISTORY = Path("data") / "histories_unified_pmc" / "BusyBox"
+DEFAULT_MODEL = Path("data") / "unwise" / "automotive01.dimacs"
+DEFAULT_REPEAT = 7
+DEFAULT_SAMPLES = 1000
+DEFAULT_THRESHOLD = 0.1
+"""Relative slowdown of the median time that `compare` reports as a regression"""
+WILDCARD_PROBABILITY = 0.1
+"""Probability that a variable in a stub SPUR sample is left open ('*')"""
+
+
+@dataclass
+class Inputs:
+    file_old: Path
+    file_new: Path
+    model: Path
+    num_samples: int
+    tmp_dir: Path
+
+
+def stub_samples(file: Path, n: int, seed: int = 0) -> list[list[int]]:
+    """`n` valid (but not uniform) samples of `file`, found by a SAT solver with random phases"""
+    rng = random.Random(seed)
+    cnf = CNF(from_file=file)
+    samples = []
+    with Solver(name="m22", bootstrap_with=cnf.clauses) as solver:
+        for _ in range(n):
+            solver.set_phases(
+                [var if rng.random() < 0.5 else -var for var in range(1, cnf.nv + 1)]
+            )
+            assert solver.solve(), f"{file} is UNSAT"
+            model = solver.get_model()
+            samples.append(model[: cnf.nv] + list(range(len(model) + 1, cnf.nv + 1)))
+    return samples
+
+
+def write_stub_spur_output(samples: list[list[int]], path: Path, seed: int = 0):
+    """Write `samples` in the output format of SPUR, with some variables left open"""
+    rng = random.Random(seed)
+    with path.open("w") as f:
+        f.write("#START_SAMPLES\n")
+        for sample in samples:
+            line = "".join(
+                "*" if rng.random() < WILDCARD_PROBABILITY else "1" if lit > 0 else "0"
+                for lit in sample
+            )
+            f.write(f"1,{line}\n")
+        f.write("#END_SAMPLES\n")
+
+
+BENCHMARKS = dict()
+"""Setup functions by benchmark name. A setup function prepares the inputs and returns the function to time."""
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+@benchmark("parse_spur_output")
+def setup_parse_spur_output(inputs: Inputs):
+    path = inputs.tmp_dir / "spur.samples"
+    write_stub_spur_output(stub_samples(inputs.file_new, inputs.num_samples), path)
+    return lambda: parse_spur_output(path)
+
+
+@benchmark("expand_spur_sample")
+def setup_expand_spur_sample(inputs: Inputs):
+    path = inputs.tmp_dir / "spur.samples"
+    write_stub_spur_output(stub_samples(inputs.file_new, inputs.num_samples), path)
+    raw_samples = parse_spur_output(path)
+    return lambda: [expand_spur_sample(line) for line in raw_samples]
+
+
+@benchmark("samples_to_set")
+def setup_samples_to_set(inputs: Inputs):
+    samples = stub_samples(inputs.file_new, inputs.num_samples)
+    return lambda: samples_to_set(samples)
+
+
+@benchmark("read_dimacs")
+def setup_read_dimacs(inputs: Inputs):
+    return lambda: read_dimacs(inputs.model)
+
+
+@benchmark("conjunction")
+def setup_conjunction(inputs: Inputs):
+    return lambda: conjunction(inputs.file_old, inputs.file_new, directory=inputs.tmp_dir)
+
+
+@benchmark("write_samples")
+def setup_write_samples(inputs: Inputs):
+    samples = stub_samples(inputs.file_new, inputs.num_samples)
+    path = inputs.tmp_dir / "samples.txt"
+    return lambda: write_samples(samples, path)
+
+
+@benchmark("read_samples")
+def setup_read_samples(inputs: Inputs):
+    path = inputs.tmp_dir / "samples.txt"
+    write_samples(stub_samples(inputs.file_new, inputs.num_samples), path)
+    return lambda: read_samples(path)
+
+
+@benchmark("write_samples.archive")
+def setup_write_archive(inputs: Inputs):
+    samples = stub_samples(inputs.file_new, inputs.num_samples)
+    path = inputs.tmp_dir / f"samples{sample_archive.SUFFIX}"
+    return lambda: write_samples(samples, path)
+
+
+@benchmark("read_samples.archive")
+def setup_read_archive(inputs: Inputs):
+    path = inputs.tmp_dir / f"samples{sample_archive.SUFFIX}"
+    write_samples(stub_samples(inputs.file_new, inputs.num_samples), path)
+    return lambda: read_samples(path)
+
+
+@benchmark("reject_valid")
+def setup_reject_valid(inputs: Inputs):
+    # as in rejection sampling: check candidates for the new snapshot against the old one
+    candidates = stub_samples(inputs.file_new, inputs.num_samples)
+    checker_old = Solver(bootstrap_with=CNF(from_file=inputs.file_old).clauses)
+    return lambda: reject_valid(checker_old, candidates, len(candidates))
+
+
+@benchmark("generate.remove_variables")
+def setup_remove_variables(inputs: Inputs):
+    clauses = CNF(from_file=inputs.model).clauses
+    variables = sorted(set(abs(lit) for clause in clauses for lit in clause))
+    # as in generate.apply_random_steps: remove up to 10% of the variables
+    to_remove = random.Random(0).sample(variables, len(variables) // 10)
+    return lambda: generate.remove_variables(clauses, to_remove)
+
+
+@benchmark("simplify")
+def setup_simplify(inputs: Inputs):
+    cnf = CNF(from_file=inputs.model)
+    return lambda: simplify.simplify(cnf.clauses, cnf.nv)
+
+
+def time_benchmark(function, repeat: int) -> tuple[int, list[float]]:
+    """Number of calls per measurement (at least 0.2 seconds) and the time per call of each measurement"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return number, [t / number for t in timer.repeat(repeat=repeat, number=number)]
+
+
+def run(args):
+    history_files = sorted(args.history.glob("*.dimacs"))
+    assert len(history_files) >= 2, f"{args.history} needs at least two snapshots"
+    selected = [
+        name
+        for name in BENCHMARKS
+        if not args.filter or any(fnmatch.fnmatch(name, pattern) for pattern in args.filter)
+    ]
+    results = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "inputs": {
+            "file_old": str(history_files[0]),
+            "file_new": str(history_files[1]),
+            "model": str(args.model),
+            "num_samples": args.samples,
+        },
+        "benchmarks": dict(),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs = Inputs(
+            history_files[0], history_files[1], args.model, args.samples, Path(tmp)
+        )
+        for name in selected:
+            function = BENCHMARKS[name](inputs)
+            number, times = time_benchmark(function, args.repeat)
+            summary = perf_stats.summarize(times)
+            results["benchmarks"][name] = {"number": number, "times": times, **summary}
+            print(
+                f"{name:30} {summary['median'] * 1000:10.3f} ms  (IQR {summary['iqr'] * 1000:.3f} ms, {args.repeat} x {number} calls)"
+            )
+
+    output = args.output or Path("results") / (
+        f"microbench_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+    )
+    output.parent.mkdir(exist_ok=True, parents=True)
+    with output.open("w") as f:
+        json.dump(results, f, indent=2)
+    print("Wrote results:", output)
+
+
+def compare(args) -> int:
+    """Print the changes from the baseline, returns the number of regressions"""
+    with args.baseline.open() as f:
+        baseline = json.load(f)["benchmarks"]
+    with args.current.open() as f:
+        current = json.load(f)["benchmarks"]
+
+    regressions = 0
+    print(f"{'benchmark':30} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in [*baseline, *(name for name in current if name not in baseline)]:
+        if name not in baseline or name not in current:
+            print(f"{name:30} only in {'current' if name in current else 'baseline'}")
+            continue
+        old, new = baseline[name]["median"], current[name]["median"]
+        change = new / old - 1
+        if change > args.threshold:
+            verdict = "REGRESSION"
+            regressions += 1
+        elif change < -args.threshold:
+            verdict = "improvement"
+        else:
+            verdict = ""
+        print(
+            f"{name:30} {old * 1000:9.3f} ms {new * 1000:9.3f} ms {change:+8.1%}  {verdict}"
+        )
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="microbench",
+        description="Micro-benchmarks for the Python hot paths of the sampling pipeline",
+    )
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="JSON file for the results. Default: results/microbench_<date>.json",
+    )
+    run_parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help=f"number of measurements per benchmark (default: {DEFAULT_REPEAT})",
+    )
+    run_parser.add_argument(
+        "-n",
+        "--samples",
+        type=int,
+        default=DEFAULT_SAMPLES,
+        help=f"number of samples used as input (default: {DEFAULT_SAMPLES})",
+    )
+    run_parser.add_argument(
+        "--history",
+        type=Path,
+        default=DEFAULT_HISTORY,
+        help=f"history whose first two snapshots are used as input (default: {DEFAULT_HISTORY})",
+    )
+    run_parser.add_argument(
+        "--model",
+        type=Path,
+        default=DEFAULT_MODEL,
+        help=f"large feature model used as input (default: {DEFAULT_MODEL})",
+    )
+    run_parser.add_argument(
+        "-k",
+        "--filter",
+        action="append",
+        help="only run benchmarks matching this pattern (can be given multiple times)",
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare results to a baseline"
+    )
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"relative change of the median time that counts as regression (default: {DEFAULT_THRESHOLD})",
+    )
+    args = arg_parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    elif compare(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
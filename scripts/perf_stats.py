@@ -0,0 +1,77 @@
+import numpy as np
+
+"""
+Statistics for repeated runtime measurements (`benchmark.py --repetitions`, `compare_results.py`).
+
+Confidence intervals are percentile bootstrap intervals of the median, which need no assumptions about the distribution of the runtimes.
+The random number generator of the bootstrap has a fixed seed, so the same measurements always give the same intervals.
+"""
+
+CONFIDENCE = 0.95
+BOOTSTRAP_RESAMPLES = 10_000
+BOOTSTRAP_SEED = 0
+
+
+def bootstrap_medians(values, resamples=BOOTSTRAP_RESAMPLES, rng=None) -> np.ndarray:
+    """Medians of `resamples` resamples (with replacement) of `values`"""
+    values = np.asarray(values, dtype=float)
+    if rng is None:
+        rng = np.random.default_rng(BOOTSTRAP_SEED)
+    indices = rng.integers(0, len(values), size=(resamples, len(values)))
+    return np.median(values[indices], axis=1)
+
+
+def interval(estimates: np.ndarray, confidence=CONFIDENCE) -> tuple[float, float]:
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(estimates, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def median_ci(values, confidence=CONFIDENCE) -> tuple[float, float]:
+    """
+    Bootstrap confidence interval of the median of `values`
+
+    >>> median_ci([1.0, 1.1, 1.2, 0.9, 1.0])
+    (0.9, 1.2)
+    """
+    if len(values) < 2:
+        return float("nan"), float("nan")
+    return interval(bootstrap_medians(values), confidence)
+
+
+def ratio_ci(baseline, current, confidence=CONFIDENCE) -> tuple[float, float]:
+    """
+    Bootstrap confidence interval of the ratio of the medians `current / baseline`.
+    If the interval does not contain 1, the difference is significant.
+    """
+    if len(baseline) < 2 or len(current) < 2:
+        return float("nan"), float("nan")
+    rng = np.random.default_rng(BOOTSTRAP_SEED)
+    ratios = bootstrap_medians(current, rng=rng) / bootstrap_medians(baseline, rng=rng)
+    return interval(ratios, confidence)
+
+
+def summarize(values, confidence=CONFIDENCE) -> dict:
+    """Median, quartiles, interquartile range and confidence interval of the median of `values`"""
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return {
+            "n": 0,
+            "median": float("nan"),
+            "q1": float("nan"),
+            "q3": float("nan"),
+            "iqr": float("nan"),
+            "ci_low": float("nan"),
+            "ci_high": float("nan"),
+        }
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    ci_low, ci_high = median_ci(values, confidence)
+    return {
+        "n": len(values),
+        "median": float(median),
+        "q1": float(q1),
+        "q3": float(q3),
+        "iqr": float(q3 - q1),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+    }
@@ -0,0 +1,273 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import traceback
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+import plot_benchmarks
+import plot_boxes
+import plot_history_stats
+import plot_retainment
+import plot_updates
+import plot_variance
+from results_store import HISTORY_DIRS, ResultsStore, history_dirs
+
+"""
+Render all figures of the paper at once.
+```
+python scripts/plot/plot_all.py
+python scripts/plot/plot_all.py --jobs 4 --force
+python scripts/plot/plot_all.py --results results/<timestamp>_bench/full_results.csv
+```
+The results are loaded once into the results store (see `results_store.py`) and shared with a process pool (forked workers),
+which renders the figures in parallel with the non-interactive Agg backend:
+- history stats (Fig. 5) and average expected retainment (Fig. 6b) of each folder of histories in `data/`,
+- the expected retainment of the updates of each history in `data/histories_unified_pmc/` (Fig. 6a),
+- the boxplots of actual and expected retainment (Fig. 7),
+- the sweet spots of the `benchmark.py` results folder given with `--results` (Fig. 8),
+- the variance of the number of retained samples.
+A figure is only rendered again if its inputs or the script that plots it changed since the last time,
+as recorded in `output/plots/rendered.json`, so after adding a few results only the affected figures are rendered.
+"""
+
+PLOTS_DIR = Path(os.getenv("OUTPUT_DIR", "output")) / "plots"
+RENDERED_FILE = PLOTS_DIR / "rendered.json"
+"""Signature of the inputs of each figure when it was rendered"""
+UPDATES_DIR = HISTORY_DIRS[0]
+UPDATES_WIDTH = {"Fiasco": 5, "FinancialServices": 5}
+"""Width of the expected retainment plots of the histories, 15 for all others"""
+MP_CONTEXT = multiprocessing.get_context("fork")
+"""The workers are forked, so that they share the loaded results store"""
+
+_store: ResultsStore | None = None
+"""Results store with all results, loaded before the workers are forked"""
+
+
+@dataclass
+class Figure:
+    name: str
+    script: Path
+    """Script with the plot function"""
+    render: Callable
+    args: tuple
+    outputs: list[Path]
+    inputs: list[tuple[str, str]] = field(default_factory=list)
+    """Table and source of the results store the figure is plotted from"""
+
+    def signature(self, store: ResultsStore) -> dict:
+        return {
+            "code": [self.script.stat().st_mtime_ns, Path(__file__).stat().st_mtime_ns],
+            "inputs": [store.manifest[table].get(source) for table, source in self.inputs],
+        }
+
+
+def render_history_stats(directory: Path, output_path: Path):
+    sns.set_theme()  # like plot_history_stats.py, the other scripts use the matplotlib style
+    stats = plot_history_stats.compute_stats(history_dirs(directory), _store)
+    plot_history_stats.plot_stats(stats, output_path)
+
+
+def render_retainment(directory: Path, output_path: Path):
+    df = plot_retainment.calculate_er(history_dirs(directory), _store)
+    plot_retainment.plot_er(df).savefig(output_path)
+
+
+def render_updates(directory: Path, width: int, output_path: Path):
+    df = _store.rows("pairs", [directory]).reset_index(drop=True)
+    fig = plot_updates.plot_bars(df, "retainment", "ER*", directory.name, width, height=3)
+    fig.savefig(output_path)
+
+
+def render_boxes(output_path: Path):
+    plot_boxes.plot_boxes(plot_boxes.load_diffs(_store)).savefig(output_path)
+
+
+def render_sweetspots(path: Path):
+    plot_benchmarks.plot_sweetspot(plot_benchmarks.average(_store.rows("benchmarks", [path])))
+
+
+def render_variance(output_path: Path):
+    plot_variance.plot_variance().savefig(output_path)
+
+
+def figures(store: ResultsStore, results: Path | None) -> list[Figure]:
+    figures = []
+    for directory in HISTORY_DIRS:
+        if not directory.exists():
+            continue
+        histories = [
+            ("pairs", os.path.abspath(history))
+            for history in history_dirs(directory)
+            if history.name not in plot_history_stats.IGNORE
+        ]
+        figures.append(
+            Figure(
+                f"history stats of {directory.name}",
+                Path(plot_history_stats.__file__),
+                render_history_stats,
+                (directory, PLOTS_DIR / f"{directory.name}_evolution_stats.pdf"),
+                [PLOTS_DIR / f"{directory.name}_evolution_stats.pdf"],
+                histories,
+            )
+        )
+        output_path = plot_retainment.OUTPUT_DIR / f"{directory.name}_avg_{plot_retainment.COLUMN}.pdf"
+        figures.append(
+            Figure(
+                f"average retainment of {directory.name}",
+                Path(plot_retainment.__file__),
+                render_retainment,
+                (directory, output_path),
+                [output_path],
+                histories,
+            )
+        )
+    if UPDATES_DIR.exists():
+        for history in history_dirs(UPDATES_DIR):
+            output_path = plot_updates.OUTPUT_DIR / "bars" / f"{history.name}_ER*.pdf"
+            figures.append(
+                Figure(
+                    f"updates of {history.name}",
+                    Path(plot_updates.__file__),
+                    render_updates,
+                    (history, UPDATES_WIDTH.get(history.name, 15), output_path),
+                    [output_path],
+                    [("pairs", os.path.abspath(history))],
+                )
+            )
+    updates = store.table("updates")
+    if len(updates):
+        runs = sorted(set(updates[updates["model"].isin(plot_boxes.models)]["source"]))
+        figures.append(
+            Figure(
+                "boxplots",
+                Path(plot_boxes.__file__),
+                render_boxes,
+                (plot_boxes.output_path(),),
+                [plot_boxes.output_path()],
+                [("updates", source) for source in runs],
+            )
+        )
+    if results is not None:
+        figures.append(
+            Figure(
+                f"sweet spots of {results.parent.name}",
+                Path(plot_benchmarks.__file__),
+                render_sweetspots,
+                (results,),
+                [plot_benchmarks.OUTPUT_DIR / "sweet_spots.csv"],
+                [("benchmarks", os.path.abspath(results))],
+            )
+        )
+    figures.append(
+        Figure(
+            "variance",
+            Path(plot_variance.__file__),
+            render_variance,
+            (plot_variance.OUTPUT_DIR / "variance.pdf",),
+            [plot_variance.OUTPUT_DIR / "variance.pdf"],
+        )
+    )
+    return figures
+
+
+def render(figure: Figure):
+    # importing plot_history_stats set the seaborn theme for all figures
+    sns.reset_orig()
+    try:
+        figure.render(*figure.args)
+    finally:
+        plt.close("all")
+
+
+def main():
+    global _store
+    arg_parser = argparse.ArgumentParser(
+        prog="plot_all",
+        description="Render all figures in parallel, skipping figures whose inputs did not change",
+    )
+    arg_parser.add_argument(
+        "--results",
+        type=Path,
+        help="full_results.csv of a benchmark.py results folder (RQ2) to also render its sweet spots (Fig. 8)",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="number of figures rendered in parallel (default: number of cores)",
+    )
+    arg_parser.add_argument(
+        "--force", action="store_true", help="render all figures, even if their inputs did not change"
+    )
+    args = arg_parser.parse_args()
+
+    results = args.results
+
+    _store = ResultsStore()
+    for directory in HISTORY_DIRS:
+        if directory.exists():
+            _store.add_histories(history_dirs(directory))
+    _store.add_runs(plot_boxes.OUTPUT_DIR)
+    if results is not None:
+        _store.add_benchmarks([results])
+    _store.save()
+
+    rendered = dict()
+    if RENDERED_FILE.exists():
+        with RENDERED_FILE.open() as f:
+            rendered = json.load(f)
+    all_figures = figures(_store, results)
+    todo = []
+    for figure in all_figures:
+        if (
+            not args.force
+            and rendered.get(figure.name) == figure.signature(_store)
+            and all(output.exists() for output in figure.outputs)
+        ):
+            continue
+        todo.append(figure)
+        for output in figure.outputs:
+            output.parent.mkdir(exist_ok=True, parents=True)
+    print(
+        f"rendering {len(todo)} {'figure' if len(todo) == 1 else 'figures'} ({len(all_figures) - len(todo)} unchanged)"
+    )
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.jobs, mp_context=MP_CONTEXT
+    ) as executor:
+        futures = {executor.submit(render, figure): figure for figure in todo}
+        for future in concurrent.futures.as_completed(futures):
+            figure = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"FAILED {figure.name}:")
+                traceback.print_exception(e)
+                failed.append(figure)
+                rendered.pop(figure.name, None)
+                continue
+            rendered[figure.name] = figure.signature(_store)
+
+    RENDERED_FILE.parent.mkdir(exist_ok=True, parents=True)
+    with RENDERED_FILE.open("w") as f:
+        json.dump(rendered, f, indent=2)
+    if failed:
+        print(f"{len(failed)} of {len(todo)} figures failed")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
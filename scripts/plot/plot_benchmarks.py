@@ -2,6 +2,8 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import pandas as pd
 
+from results_store import ResultsStore
+
 OUTPUT_DIR = Path("output") / "plots"
 
 
@@ -129,6 +131,18 @@ def plot_sweetspot(data):
     print("wrote to", output_path)
 
 
+def average(data: pd.DataFrame) -> pd.DataFrame:
+    # Group by 'directory', 'method', 'sampler', and 'total_samples',
+    # and then aggregate 'unique_samples' and 'time' by taking the mean
+    return (
+        data.groupby(["directory", "method", "sampler", "total_samples"])[
+            ["unique_samples", "time"]
+        ]
+        .mean()
+        .reset_index()
+    )
+
+
 def main():
     import sys
 
@@ -137,17 +151,12 @@ def main():
         exit(1)
 
     file_path = Path(sys.argv[1])
-    data = pd.read_csv(file_path)
+    store = ResultsStore()
+    store.add_benchmarks([file_path])
+    store.save()
+    data = store.rows("benchmarks", [file_path])
 
-    # Group by 'directory', 'method', 'sampler', and 'total_samples',
-    # and then aggregate 'unique_samples' and 'time' by taking the mean
-    averaged_df = (
-        data.groupby(["directory", "method", "sampler", "total_samples"])[
-            ["unique_samples", "time"]
-        ]
-        .mean()
-        .reset_index()
-    )
+    averaged_df = average(data)
 
     # Print the resulting DataFrame
     print(averaged_df)
@@ -5,9 +5,10 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+from results_store import ResultsStore
+
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "output"))
 OUTPUT_DIR_PLOTS = OUTPUT_DIR / "plots" / "boxplots"
-OUTPUT_DIR_PLOTS.mkdir(exist_ok=True, parents=True)
 
 models = ["BusyBox", "Fiasco", "soletta", "uClibc"]  # "FinancialServices"
 seeds = [16873]  # , 93022, 53581]
@@ -45,79 +46,109 @@ palette = {
 }
 
 
-# Collect data
-all_data = []
-for model in models:
-    skip = False
-    for algorithm in ["uniform", "expectation_uniform"]:
-        for seed in seeds:
-            path = (
-                OUTPUT_DIR
-                / f"{model}_seed{seed}_{algorithm}_{method}_{solver}_{num_samples}{reuse_str}.csv"
-            )
-            if not path.exists():
-                print("Missing:", path)
-                skip = True
-                break
-            print("Reading", path)
-    if skip:
-        continue
-
-    for algorithm in ["uniform", "expectation_uniform"]:
-        for seed in seeds:
-            df = pd.read_csv(
-                OUTPUT_DIR
-                / f"{model}_seed{seed}_{algorithm}_{method}_{solver}_{num_samples}{reuse_str}.csv"
+def load_diffs(store: ResultsStore | None = None) -> pd.DataFrame:
+    """Difference of actual and expected retainment of each update, from the `updates` table of the results store"""
+    store = store or ResultsStore()
+    store.add_runs(OUTPUT_DIR)
+    store.save()
+    updates = store.table("updates")
+    updates = updates[
+        updates["model"].isin(models)
+        & updates["algorithm"].isin(algorithm_map)
+        & updates["seed"].isin(seeds)
+        & (updates["method"] == method)
+        & (updates["sampler"] == solver)
+        & (updates["num_samples"] == num_samples)
+        & (updates["no_reuse"] == no_reuse)
+    ]
+
+    # only models with the results of both algorithms for all seeds
+    present = set(updates["source"])
+    complete = []
+    for model in models:
+        missing = False
+        for algorithm in algorithm_map:
+            for seed in seeds:
+                path = (
+                    OUTPUT_DIR
+                    / f"{model}_seed{seed}_{algorithm}_{method}_{solver}_{num_samples}{reuse_str}.csv"
+                )
+                if os.path.abspath(path) not in present:
+                    print("Missing:", path)
+                    missing = True
+        if not missing:
+            complete.append(model)
+    updates = updates[updates["model"].isin(complete)]
+
+    if drop_trivial:
+        updates = updates[
+            (updates["num_retained_expected"] != 0.0)
+            & (updates["num_retained_expected"] != float(num_samples))
+        ]
+    df_all = pd.DataFrame(
+        {
+            "Model": pd.Categorical(updates["model"], complete, ordered=True),
+            "Algorithm": pd.Categorical(updates["algorithm"], list(algorithm_map), ordered=True),
+            "Seed": pd.Categorical(updates["seed"], seeds, ordered=True),
+            "Diff": (updates["num_retained"] - updates["num_retained_expected"]) / num_samples,
+        }
+    )
+    # in the order of the models, algorithms and seeds, and of the updates of each run
+    df_all = df_all.sort_values(["Model", "Algorithm", "Seed"], kind="stable").drop(columns="Seed")
+    df_all["Model"] = df_all["Model"].astype(str)
+    df_all["Algorithm"] = df_all["Algorithm"].astype(str)
+    if clipped:
+        for row in df_all[df_all["Diff"].abs() > ylim].itertuples():
+            print(
+                f"Warning: Clipped datapoint for {row.Model} ({algorithm_map[row.Algorithm]}) at {row.Diff}"
             )
-            if drop_trivial:
-                df = df[
-                    (df["num_retained_expected"] != 0.0)
-                    & (df["num_retained_expected"] != float(num_samples))
-                ]
-            diffs = (df["num_retained"] - df["num_retained_expected"]) / num_samples
-            for val in diffs:
-                if clipped and abs(val) > ylim:
-                    print(
-                        f"Warning: Clipped datapoint for {model} ({algorithm_map[algorithm]}) at {val}"
-                    )
-                all_data.append({"Model": model, "Algorithm": algorithm, "Diff": val})
-
-# Create a single boxplot
-df_all = pd.DataFrame(all_data)
-df_all["Renamed Model"] = df_all["Model"].map(rename)
-df_all["Algorithm Name"] = df_all["Algorithm"].map(algorithm_map)
-
-# Combine for hue grouping (e.g., for side-by-side coloring)
-fig, ax = plt.subplots(figsize=figsize)
-sns.boxplot(
-    data=df_all,
-    x="Renamed Model",
-    y="Diff",
-    hue="Algorithm Name",
-    palette=palette,
-    ax=ax,
-    medianprops=dict(color="black", linewidth=1.5),
-    gap=0.1,
-    fill=False,
-)
-plt.legend()
-
-
-ax.grid(which="major", axis="y", alpha=0.5)
-ax.set_ylabel("Retainment: Actual - Expected")
-ax.set_xlabel("")
-# ax.set_ylabel("Retainment Difference")
-plt.title("")
-plt.suptitle("")  # Remove automatic title
-if clipped:
-    # ax.set_ylim(-51 / num_samples, 51 / num_samples)
-    ax.set_ylim(-ylim, ylim)
-
-
-output_path = (
-    OUTPUT_DIR_PLOTS
-    / f"boxplot_ALL_seed{'-'.join(map(str,seeds))}_{method}_{solver}_{num_samples}{reuse_str}{drop_trivial_str}{clipped_str}.pdf"
-)
-print("Writing to", output_path)
-plt.tight_layout()
-plt.savefig(output_path)
+    df_all["Renamed Model"] = df_all["Model"].map(rename)
+    df_all["Algorithm Name"] = df_all["Algorithm"].map(algorithm_map)
+    return df_all.reset_index(drop=True)
+
+
+def plot_boxes(df_all: pd.DataFrame):
+    # Combine for hue grouping (e.g., for side-by-side coloring)
+    fig, ax = plt.subplots(figsize=figsize)
+    sns.boxplot(
+        data=df_all,
+        x="Renamed Model",
+        y="Diff",
+        hue="Algorithm Name",
+        palette=palette,
+        ax=ax,
+        medianprops=dict(color="black", linewidth=1.5),
+        gap=0.1,
+        fill=False,
+    )
+    plt.legend()
+
+    ax.grid(which="major", axis="y", alpha=0.5)
+    ax.set_ylabel("Retainment: Actual - Expected")
+    ax.set_xlabel("")
+    # ax.set_ylabel("Retainment Difference")
+    plt.title("")
+    plt.suptitle("")  # Remove automatic title
+    if clipped:
+        # ax.set_ylim(-51 / num_samples, 51 / num_samples)
+        ax.set_ylim(-ylim, ylim)
+    plt.tight_layout()
+    return fig
+
+
+def output_path() -> Path:
+    return (
+        OUTPUT_DIR_PLOTS
+        / f"boxplot_ALL_seed{'-'.join(map(str,seeds))}_{method}_{solver}_{num_samples}{reuse_str}{drop_trivial_str}{clipped_str}.pdf"
+    )
+
+
+def main():
+    fig = plot_boxes(load_diffs())
+    OUTPUT_DIR_PLOTS.mkdir(exist_ok=True, parents=True)
+    print("Writing to", output_path())
+    fig.savefig(output_path())
+
+
+if __name__ == "__main__":
+    main()
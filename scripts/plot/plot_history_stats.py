@@ -5,6 +5,8 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+from results_store import UPDATE_TYPES, ResultsStore
+
 sns.set_theme()
 
 
@@ -16,61 +18,28 @@ LEGEND = False
 ABBREVIATE = {"FinancialServices": "Fin.Serv.", "automotive2": "autom."}
 
 
-def compute_stats(test_dirs: list[Path]) -> pd.DataFrame:
-    stats_list = []
-    # print(test_dirs)
-    # print(sorted(test_dirs))
-    for test_dir in sorted(test_dirs, key=lambda p: str(p).lower()):
-        if test_dir.name in IGNORE:
-            continue
-        model_count_path = test_dir / "model_counts.csv"
-        assert (
-            model_count_path.exists()
-        ), f"{model_count_path} not found. Generate by running retainment.py"
-        df_mc = pd.read_csv(model_count_path)
-        model_count = {
-            k: int(v)
-            for k, v in df_mc.set_index("file")["model_count"].to_dict().items()
-        }
-
-        updates_path = test_dir / "pairs.csv"
-        assert (
-            updates_path.exists()
-        ), f"{updates_path} not found. Generate by running retainment.py"
-        df_updates = pd.read_csv(updates_path)
-
-        stats = {
-            "path": test_dir,
-            "updates": 0,
-            "incomparable": 0,
-            "unchanged": 0,
-            "generalization": 0,
-            "specialization": 0,
-            "changed": 0,
-        }
-        for i, row in df_updates.iterrows():
-            stats["updates"] += 1
-            mc_old = int(model_count[row["file old"]])
-            mc_new = int(model_count[row["file new"]])
-            mc_conj = int(row["conjunction model count"])
-            # s = 1 - mc_conj / mc_old
-            # r = 1 - mc_conj / mc_new
-            # retainment = s**2 + r**2 + min((1 - s) ** 2, (1 - r) ** 2)
-            # print(retainment)
-
-            if mc_conj == 0:
-                stats["incomparable"] += 1
-            elif mc_old == mc_conj and mc_new == mc_conj:
-                stats["unchanged"] += 1
-            elif mc_old == mc_conj and mc_new > mc_conj:
-                stats["generalization"] += 1
-            elif mc_new == mc_conj and mc_old > mc_conj:
-                stats["specialization"] += 1
-            else:
-                stats["changed"] += 1
-        stats_list.append(stats)
-
-    return pd.DataFrame(stats_list)
+def compute_stats(test_dirs: list[Path], store: ResultsStore | None = None) -> pd.DataFrame:
+    """Number of updates of each type per history, from the `pairs` table of the results store"""
+    test_dirs = sorted(
+        (test_dir for test_dir in test_dirs if test_dir.name not in IGNORE),
+        key=lambda p: str(p).lower(),
+    )
+    store = store or ResultsStore()
+    store.add_histories(test_dirs)
+    store.save()
+    pairs = store.rows("pairs", test_dirs)
+
+    sources = [os.path.abspath(test_dir) for test_dir in test_dirs]
+    counts = (
+        pairs.groupby(["source", "update_type"])
+        .size()
+        .unstack(fill_value=0)
+        .reindex(index=sources, columns=UPDATE_TYPES, fill_value=0)
+    )
+    stats = pd.DataFrame({"path": test_dirs, "updates": counts.sum(axis=1).to_numpy()})
+    for update_type in UPDATE_TYPES:
+        stats[update_type] = counts[update_type].to_numpy()
+    return stats
 
 
 def plot_stats(stats_df: pd.DataFrame, output_path: Path):
@@ -5,6 +5,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 
+from results_store import ResultsStore
+
 """
 Plot total predicted expected retainment
 `python plot_retainment.py test/unified`
@@ -23,18 +25,18 @@ COLOR_MAP = {
 }
 
 
-def calculate_er(test_dirs: list[Path]) -> pd.DataFrame:
-    er_data: dict[str, float] = dict()
-    for path in sorted(test_dirs, key=lambda p: str(p).lower()):
-        if path.name in IGNORE:
-            continue
-        csv_path = path / "pairs.csv"
-        assert (
-            csv_path.exists()
-        ), f"{csv_path} not found. Generate by running retainment.py"
-        update_df = pd.read_csv(csv_path)
-        er_data[path.name] = update_df[COLUMN].mean()
-    return pd.DataFrame(er_data.items())
+def calculate_er(test_dirs: list[Path], store: ResultsStore | None = None) -> pd.DataFrame:
+    test_dirs = sorted(
+        (path for path in test_dirs if path.name not in IGNORE),
+        key=lambda p: str(p).lower(),
+    )
+    store = store or ResultsStore()
+    store.add_histories(test_dirs)
+    store.save()
+    means = store.rows("pairs", test_dirs).groupby("source")[COLUMN].mean()
+    return pd.DataFrame(
+        [(path.name, means.get(os.path.abspath(path), np.nan)) for path in test_dirs]
+    )
 
 
 def plot_er(df: pd.DataFrame):
@@ -3,7 +3,8 @@ from pathlib import Path
 
 import numpy as np
 import matplotlib.pyplot as plt
-import pandas as pd
+
+from results_store import ResultsStore
 
 """
 python scripts/plot_pairs.py test/unified/uClibc/pairs.csv uClibc
@@ -133,8 +134,11 @@ if __name__ == "__main__":
     if len(sys.argv) == 4:
         width = int(sys.argv[3])
 
-    # read csv
-    df = pd.read_csv(file_path)
+    # the updates of the history from the results store
+    store = ResultsStore()
+    store.add_histories([file_path.parent])
+    store.save()
+    df = store.rows("pairs", [file_path.parent]).reset_index(drop=True)
 
     for key, display_name in [
         ("retainment", "ER*"),
@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+"""
+Consolidated store of the results read by the plot scripts, so that they do not have to re-read hundreds of CSV files each time.
+```
+python scripts/plot/results_store.py
+```
+reads all results into `output/store/` (only the files that changed since the last update) and prints the size of each table.
+The plot scripts update the store with the results they need themselves, so running it by hand is optional.
+
+Tables:
+- `pairs`: one row per update of each history, from `pairs.csv` and `model_counts.csv` written by `retainment.py`,
+  with the model counts and the type of the update (incomparable, unchanged, generalization, specialization, changed).
+  The model counts are kept as decimal strings, since they can be too large even for floats, and the type is classified
+  with the exact counts when the history is added.
+- `updates`: one row per update of each `history_sampling.py --csv` run, from the CSV files in `output/`,
+  with the `model` and `no_reuse` of the run (from the file name).
+- `benchmarks`: one row per job of a `benchmark.py` results folder, from `full_results.csv` (see `prepare_results.py`).
+Each row has the `source` (absolute path of the history directory or CSV file) it was read from.
+
+The tables are stored as Parquet files if `pyarrow` is installed, and as NumPy `.npz` archives (one array per column) otherwise.
+"""
+
+OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "output"))
+STORE_DIR = OUTPUT_DIR / "store"
+MANIFEST_FILE = "manifest.json"
+"""Modification time and size of each source file when its rows were read, by table"""
+HISTORY_DIRS = [Path("data") / "histories_unified_pmc", Path("data") / "generated_unified_pmc"]
+RESULTS_DIR = Path(os.getenv("OUTPUT_DIR", "")) / "results"
+TABLES = ["pairs", "updates", "benchmarks"]
+UPDATE_TYPES = ["incomparable", "unchanged", "generalization", "specialization", "changed"]
+RUN_CSV = re.compile(
+    r"^(?P<model>.+)_seed(?P<seed>\d+)_(?P<algorithm>[a-z_]+?)_(?P<method>[a-z]+)_(?P<sampler>[a-z]+)_(?P<num_samples>\d+)(?P<no_reuse>_no-reuse)?\.csv$"
+)
+"""File names of the CSV files written by `history_sampling.py --csv`"""
+
+try:
+    import pyarrow  # noqa: F401
+
+    FORMAT = "parquet"
+except ImportError:
+    FORMAT = "npz"
+
+
+def write_table(df: pd.DataFrame, path: Path):
+    """Write `df` to `path` (without suffix) in `FORMAT`, replacing the old file only when the new one is complete"""
+    file = path.with_suffix(f".{FORMAT}")
+    tmp_file = file.with_name(f".{file.name}.tmp")
+    if FORMAT == "parquet":
+        df.to_parquet(tmp_file, index=False)
+    else:
+        with tmp_file.open("wb") as f:
+            np.savez(f, **columns_to_arrays(df))
+    os.replace(tmp_file, file)
+
+
+def columns_to_arrays(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """One array per column. Columns with missing values that are not floats get a mask of the missing values."""
+    arrays = {"__columns__": np.array(df.columns, dtype=str)}
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        if kind in ["integer", "floating", "mixed-integer-float", "empty"]:
+            arrays[f"{i}"] = values.to_numpy() if values.dtype.kind in "iuf" else values.to_numpy(dtype=float)
+            continue
+        if kind == "boolean":
+            arrays[f"{i}"] = values.eq(True).to_numpy()
+        else:
+            arrays[f"{i}"] = values.astype(str).to_numpy(dtype=str)
+        if values.isna().any():
+            arrays[f"{i}_null"] = values.isna().to_numpy()
+    return arrays
+
+
+def read_table(path: Path) -> pd.DataFrame | None:
+    """Read a table written by `write_table`, or `None` if it does not exist"""
+    if FORMAT == "parquet":
+        if not path.with_suffix(".parquet").exists():
+            return None
+        return pd.read_parquet(path.with_suffix(".parquet"))
+    if not path.with_suffix(".npz").exists():
+        return None
+    with np.load(path.with_suffix(".npz"), allow_pickle=False) as arrays:
+        columns = dict()
+        for i, column in enumerate(arrays["__columns__"]):
+            values = arrays[f"{i}"]
+            if values.dtype.kind == "U":
+                values = values.astype(object)
+            if f"{i}_null" in arrays:
+                values = pd.Series(values, dtype=object).mask(arrays[f"{i}_null"])
+            columns[str(column)] = values
+    return pd.DataFrame(columns)
+
+
+def signature(files: list[Path]) -> list[int]:
+    """Changes if one of the files changed"""
+    stats = [file.stat() for file in files]
+    return [value for stat in stats for value in (stat.st_mtime_ns, stat.st_size)]
+
+
+def classify(mc_old: int, mc_new: int, mc_conj: int) -> str:
+    """Type of an update, given the model counts of the old and new model and of their conjunction"""
+    if mc_conj == 0:
+        return "incomparable"
+    if mc_old == mc_conj and mc_new == mc_conj:
+        return "unchanged"
+    if mc_old == mc_conj and mc_new > mc_conj:
+        return "generalization"
+    if mc_new == mc_conj and mc_old > mc_conj:
+        return "specialization"
+    return "changed"
+
+
+def read_history(directory: Path) -> pd.DataFrame:
+    """The updates of a history with their model counts and update type"""
+    pairs = pd.read_csv(directory / "pairs.csv", dtype={"conjunction model count": str})
+    counts = pd.read_csv(directory / "model_counts.csv", dtype={"model_count": str})
+    model_count = dict(zip(counts["file"], counts["model_count"]))
+    old = pairs["file old"].map(model_count)
+    new = pairs["file new"].map(model_count)
+    conj = pairs["conjunction model count"]
+    update_type = [
+        classify(int(mc_old), int(mc_new), int(mc_conj))
+        for mc_old, mc_new, mc_conj in zip(old, new, conj)
+    ]
+    return pd.DataFrame(
+        {
+            "history": directory.name,
+            "update": np.arange(len(pairs)),
+            "file old": pairs["file old"],
+            "file new": pairs["file new"],
+            "model count old": old,
+            "model count new": new,
+            "conjunction model count": conj,
+            "percentage of old": pairs["percentage of old"],
+            "percentage of new": pairs["percentage of new"],
+            "retainment": pairs["retainment"],
+            "update_type": update_type,
+        }
+    )
+
+
+def read_run(path: Path) -> pd.DataFrame:
+    """The updates of a `history_sampling.py --csv` run"""
+    match = RUN_CSV.match(path.name)
+    df = pd.read_csv(path, index_col=0)
+    df.insert(0, "model", match["model"])
+    df.insert(1, "no_reuse", match["no_reuse"] is not None)
+    return df
+
+
+def read_benchmark(path: Path) -> pd.DataFrame:
+    """The jobs of a `benchmark.py` results folder"""
+    df = pd.read_csv(path)
+    df.insert(0, "results", path.parent.name)
+    return df
+
+
+class ResultsStore:
+    def __init__(self, directory: Path = STORE_DIR):
+        self.directory = Path(directory)
+        self.manifest: dict[str, dict[str, list[int]]] = {table: dict() for table in TABLES}
+        if (self.directory / MANIFEST_FILE).exists():
+            with (self.directory / MANIFEST_FILE).open() as f:
+                self.manifest |= json.load(f)
+        self.tables: dict[str, pd.DataFrame] = dict()
+        self.changed: set[str] = set()
+
+    def table(self, name: str) -> pd.DataFrame:
+        if name not in self.tables:
+            df = read_table(self.directory / name)
+            self.tables[name] = df if df is not None else pd.DataFrame({"source": []})
+        return self.tables[name]
+
+    def rows(self, name: str, sources) -> pd.DataFrame:
+        """The rows of the table `name` read from `sources`"""
+        df = self.table(name)
+        return df[df["source"].isin([os.path.abspath(source) for source in sources])]
+
+    def add(self, name: str, sources: dict[str, list[Path]], read):
+        """
+        Read the rows of the sources whose files changed with `read(source)` and replace their old rows in the table `name`.
+        `sources` are the files of each source, e.g. the CSV files of a history directory.
+        """
+        manifest = self.manifest[name]
+        changed = {
+            os.path.abspath(source): files
+            for source, files in sources.items()
+            if manifest.get(os.path.abspath(source)) != signature(files)
+        }
+        if not changed:
+            return
+        new_rows = []
+        for source, files in changed.items():
+            df = read(Path(source))
+            df.insert(0, "source", source)
+            new_rows.append(df)
+            manifest[source] = signature(files)
+        df = self.table(name)
+        old_rows = [df[~df["source"].isin(changed)]] if len(df) else []
+        self.tables[name] = pd.concat([*old_rows, *new_rows], ignore_index=True)
+        self.changed.add(name)
+        print(f"results store: read {len(changed)} {'source' if len(changed) == 1 else 'sources'} into {name}")
+
+    def add_histories(self, directories):
+        """Add the histories in `directories` that have been processed by `retainment.py`"""
+        sources = dict()
+        for directory in directories:
+            files = [Path(directory) / "pairs.csv", Path(directory) / "model_counts.csv"]
+            for file in files:
+                assert file.exists(), f"{file} not found. Generate by running retainment.py"
+            sources[directory] = files
+        self.add("pairs", sources, read_history)
+
+    def add_runs(self, directory: Path = OUTPUT_DIR):
+        """Add the CSV files of `history_sampling.py --csv` runs in `directory`"""
+        paths = [path for path in Path(directory).glob("*.csv") if RUN_CSV.match(path.name)]
+        self.add("updates", {path: [path] for path in paths}, read_run)
+
+    def add_benchmarks(self, paths):
+        """Add the `full_results.csv` files in `paths`"""
+        self.add("benchmarks", {path: [Path(path)] for path in paths}, read_benchmark)
+
+    def save(self):
+        if not self.changed:
+            return
+        self.directory.mkdir(exist_ok=True, parents=True)
+        for name in self.changed:
+            write_table(self.tables[name], self.directory / name)
+        tmp_file = self.directory / f".{MANIFEST_FILE}.tmp"
+        with tmp_file.open("w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_file, self.directory / MANIFEST_FILE)
+        self.changed = set()
+
+
+def history_dirs(directory: Path) -> list[Path]:
+    return [path for path in Path(directory).iterdir() if path.is_dir() and (path / "pairs.csv").exists()]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="results_store",
+        description="Read the results used by the plot scripts into the consolidated store",
+    )
+    arg_parser.add_argument(
+        "--histories",
+        nargs="*",
+        type=Path,
+        default=[directory for directory in HISTORY_DIRS if directory.exists()],
+        help="folders of histories processed by retainment.py (default: the histories in data/)",
+    )
+    arg_parser.add_argument(
+        "--runs",
+        type=Path,
+        default=OUTPUT_DIR,
+        help=f"folder with the CSV files of history_sampling.py --csv (default: {OUTPUT_DIR})",
+    )
+    arg_parser.add_argument(
+        "--results",
+        nargs="*",
+        type=Path,
+        default=sorted(RESULTS_DIR.glob("*/full_results.csv")),
+        help="full_results.csv files of benchmark.py results folders (default: all in results/)",
+    )
+    args = arg_parser.parse_args()
+
+    store = ResultsStore()
+    store.add_histories([history for directory in args.histories for history in history_dirs(directory)])
+    store.add_runs(args.runs)
+    store.add_benchmarks(args.results)
+    store.save()
+    for name in TABLES:
+        print(f"{name}: {len(store.table(name))} rows")
+
+
+if __name__ == "__main__":
+    main()
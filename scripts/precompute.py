@@ -0,0 +1,221 @@
+import concurrent.futures
+import csv
+import hashlib
+import pickle
+import random
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy.random
+
+from retainment import compute_model_count, conjunction
+from retainment_sampling import get_samples, Sampler, Method
+from utils import Timer, label
+
+"""
+Shared precomputation for parameter sweeps with `benchmark.py --precompute`.
+
+All `history_sampling.py` jobs on the same history need the same model counts, conjunction model counts, and (for the same seed) the same samples of the first snapshot.
+Instead of recomputing them in every job, the work the jobs share is collected in one `Precomputation` per history, computed once up front in parallel,
+and written to a cache directory that is passed to every job with `--cache`.
+
+Cache layout, with one subdirectory per history:
+```
+<cache>/<history>/model_counts.csv          # file, model_count (like retainment.py)
+<cache>/<history>/conjunction_counts.csv    # file old, file new, conjunction model count
+<cache>/<history>/initial_samples_<sampler>_n<n>_seed<seed>.pickle
+```
+The initial samples are stored together with the state of the random number generators after generating them,
+so a job that loads them continues with exactly the same random numbers as a job that generates them itself.
+"""
+
+MODEL_COUNTS_FILE = "model_counts.csv"
+CONJUNCTION_COUNTS_FILE = "conjunction_counts.csv"
+
+
+@dataclass
+class Precomputation:
+    """The work shared by all jobs on one history"""
+
+    directory: Path
+    model_counts: bool = False
+    conjunction_counts: bool = False
+    initial_samples: set[tuple[Sampler, int, int]] = field(default_factory=set)
+    """`(sampler, num_samples, seed)` combinations for which the first snapshot is sampled"""
+
+
+def history_cache_dir(cache_dir: Path, directory: Path) -> Path:
+    """Directory in the cache for the history in `directory`"""
+    path_hash = hashlib.sha1(str(directory.resolve()).encode()).hexdigest()[:8]
+    return cache_dir / f"{directory.name}_{path_hash}"
+
+
+def initial_samples_file(cache_dir: Path, sampler: Sampler, num_samples: int, seed: int):
+    return cache_dir / f"initial_samples_{sampler}_n{num_samples}_seed{seed}.pickle"
+
+
+def plan(job_args: list[list[str]]) -> dict[Path, Precomputation]:
+    """
+    Collect the shared work of `history_sampling.py` jobs, given by their command-line arguments.
+    """
+    from history_sampling import make_arg_parser, benchmark_args
+
+    precomputations: dict[Path, Precomputation] = dict()
+    for argv in job_args:
+        args = make_arg_parser().parse_args(argv)
+        job = benchmark_args(args)
+        directory = job["directory"]
+        if directory not in precomputations:
+            precomputations[directory] = Precomputation(directory)
+        precomputation = precomputations[directory]
+        if job["method"] != Method.none:
+            precomputation.conjunction_counts = True
+            if not job["read_model_count"]:
+                precomputation.model_counts = True
+        # the seed is only known in advance if it is given explicitly.
+        # Chunked jobs call the sampler once per chunk, so they draw other samples than a single call.
+        if args.seed is not None and not job["simplify"] and job["chunk_size"] is None:
+            precomputation.initial_samples.add(
+                (job["sampler"], job["num_samples"], job["seed"])
+            )
+    return precomputations
+
+
+def count_conjunction(file_old: Path, file_new: Path) -> int | None:
+    with tempfile.TemporaryDirectory() as tmp:
+        return compute_model_count(conjunction(file_old, file_new, directory=Path(tmp)))
+
+
+def sample_first_snapshot(file: Path, sampler: Sampler, num_samples: int, seed: int):
+    """Samples of `file` as generated at the start of `history_sampling.benchmark`, and the random states afterwards"""
+    random.seed(seed)
+    numpy.random.seed(seed)
+    samples = get_samples(file, num_samples, sampler)
+    return samples, random.getstate(), numpy.random.get_state()
+
+
+def run(precomputations: dict[Path, Precomputation], cache_dir: Path, num_cores: int):
+    """Compute everything in `precomputations` in parallel and write it to `cache_dir`"""
+    timer = Timer(enable_printing=False)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_cores) as executor:
+        model_counts = dict()
+        conjunction_counts = dict()
+        samples = dict()
+        for directory, precomputation in precomputations.items():
+            out_dir = history_cache_dir(cache_dir, directory)
+            out_dir.mkdir(exist_ok=True, parents=True)
+            dimacs_files = sorted(directory.glob("*.dimacs"))
+            if precomputation.model_counts and not (out_dir / MODEL_COUNTS_FILE).exists():
+                model_counts[directory] = [
+                    (file, executor.submit(compute_model_count, file))
+                    for file in dimacs_files
+                ]
+            if (
+                precomputation.conjunction_counts
+                and not (out_dir / CONJUNCTION_COUNTS_FILE).exists()
+            ):
+                conjunction_counts[directory] = [
+                    (file_old, file_new, executor.submit(count_conjunction, file_old, file_new))
+                    for file_old, file_new in zip(dimacs_files, dimacs_files[1:])
+                ]
+            for sampler, num_samples, seed in precomputation.initial_samples:
+                path = initial_samples_file(out_dir, sampler, num_samples, seed)
+                if not path.exists() and dimacs_files:
+                    samples[path] = executor.submit(
+                        sample_first_snapshot, dimacs_files[0], sampler, num_samples, seed
+                    )
+
+        num_tasks = (
+            sum(len(tasks) for tasks in model_counts.values())
+            + sum(len(tasks) for tasks in conjunction_counts.values())
+            + len(samples)
+        )
+        num_histories = len(precomputations)
+        print(
+            f"precomputing {label(num_tasks, 'task')} for {num_histories} {'history' if num_histories == 1 else 'histories'}"
+        )
+
+        for directory, tasks in model_counts.items():
+            path = history_cache_dir(cache_dir, directory) / MODEL_COUNTS_FILE
+            rows = [(file.name, task_result(future, file)) for file, future in tasks]
+            write_csv(path, ["file", "model_count"], rows)
+        for directory, tasks in conjunction_counts.items():
+            path = history_cache_dir(cache_dir, directory) / CONJUNCTION_COUNTS_FILE
+            rows = [
+                (file_old.name, file_new.name, task_result(future, f"{file_old} and {file_new}"))
+                for file_old, file_new, future in tasks
+            ]
+            write_csv(path, ["file old", "file new", "conjunction model count"], rows)
+        for path, future in samples.items():
+            result = task_result(future, path.name)
+            if result is not None:
+                with path.open("wb") as f:
+                    pickle.dump(result, f)
+    print(f"precomputation took {timer.stop():.3f} seconds")
+
+
+def task_result(future: concurrent.futures.Future, description):
+    """
+    Result of a precomputation task, or `None` if it failed.
+    A failed value is left out of the cache (an empty value in the CSV files), so the job computes it itself
+    (or fails on its own, as without `--precompute`).
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"precomputation for {description} failed: {e!r}")
+        return None
+
+
+def write_csv(path: Path, header: list[str], rows):
+    # write to a temporary file first, so that an interrupted run does not leave incomplete files behind
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    tmp_path.replace(path)
+
+
+def read_model_counts(cache_dir: Path) -> dict[str, int]:
+    """Model counts per file name, or an empty dict if they are not in the cache"""
+    path = cache_dir / MODEL_COUNTS_FILE
+    if not path.exists():
+        return dict()
+    with path.open() as f:
+        return {
+            row["file"]: int(row["model_count"])
+            for row in csv.DictReader(f)
+            if row["model_count"]
+        }
+
+
+def read_conjunction_counts(cache_dir: Path) -> dict[tuple[str, str], int]:
+    """Conjunction model counts per pair of file names, or an empty dict if they are not in the cache"""
+    path = cache_dir / CONJUNCTION_COUNTS_FILE
+    if not path.exists():
+        return dict()
+    with path.open() as f:
+        return {
+            (row["file old"], row["file new"]): int(row["conjunction model count"])
+            for row in csv.DictReader(f)
+            if row["conjunction model count"]
+        }
+
+
+def load_initial_samples(
+    cache_dir: Path, sampler: Sampler, num_samples: int, seed: int
+) -> list[list[int]] | None:
+    """
+    Samples of the first snapshot if they are in the cache, or `None` otherwise.
+    Also restores the state of the random number generators to the state after generating them.
+    """
+    path = initial_samples_file(cache_dir, sampler, num_samples, seed)
+    if not path.exists():
+        return None
+    with path.open("rb") as f:
+        samples, random_state, numpy_state = pickle.load(f)
+    random.setstate(random_state)
+    numpy.random.set_state(numpy_state)
+    return samples
@@ -1,19 +1,70 @@
 import csv
+import json
 from pathlib import Path
 
+import pandas as pd
 
-def main(log_dir: Path):
+from benchmark import RESULTS_FILE, STATISTICS_FILE
+
+"""
+Collect the results of the `history_sampling.py` jobs of a `benchmark.py` results folder in `full_results.csv`.
+
+The results are read from the result records in `results.jsonl`, which also contain the parameters, the number of snapshots,
+peak memory and tool invocations of each job. For results folders of older runs without `results.jsonl`, they are scraped from the log files instead.
+"""
+
+COLUMNS = [
+    "directory",
+    "seed",
+    "algorithm",
+    "method",
+    "sampler",
+    "total_samples",
+    "unique_samples",
+    "time",
+    "runtime",
+]
+"""First columns of `full_results.csv`, followed by any further fields of the result records"""
+
+
+def runner_csv(log_dir: Path) -> Path:
+    """The CSV file with the runtime of each job written by `benchmark.py`"""
     bench_csv = log_dir / "batch.csv"
-    output_file = log_dir / "full_results.csv"
+    if bench_csv.exists():
+        return bench_csv
+    candidates = [
+        file
+        for file in log_dir.glob("*.csv")
+        if file.name not in ["full_results.csv", STATISTICS_FILE]
+    ]
+    assert len(candidates) == 1, f"expected one runtime CSV file in {log_dir}, found {len(candidates)}"
+    return candidates[0]
+
+
+def load_records(path: Path) -> pd.DataFrame:
+    """The records of `results.jsonl`. If a job was recorded multiple times (e.g. when resuming), the last record wins."""
+    records = []
+    with path.open() as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # partially written last line
+    df = pd.DataFrame.from_records(records)
+    df = df.drop_duplicates(["name", "repetition"], keep="last")
+    # jobs that failed wrote no record, they only have the fields written by benchmark.py
+    if "directory" not in df:
+        df["directory"] = df["file"]
+    df["directory"] = df["directory"].fillna(df["file"])
+    df["params"] = df["params"].map(" ".join)
+    # the algorithm is not used without an update method, like in the results scraped from the logs
+    if "method" in df:
+        df.loc[df["method"] == "none", "algorithm"] = "none"
+    return df
 
-    # Load runtimes from bench.csv
-    runtime_map = {}
-    with bench_csv.open() as f:
-        reader = csv.DictReader(f, delimiter=";")
-        for row in reader:
-            # runtime_map[row["name"]] = float(row["runtime"])
-            runtime_map[row["name"]] = row["runtime"]
 
+def scrape_logs(log_dir: Path) -> pd.DataFrame:
+    """The results of each job from the output in its log file"""
     rows = []
     for file in log_dir.glob("*.log"):
         with file.open() as f:
@@ -48,38 +99,36 @@ def main(log_dir: Path):
             elif line.startswith("Unique samples:"):
                 data["unique_samples"] = int(line.split(":")[1].strip().split()[0])
 
-        # if None in data.values():
-        #     print(f"Missing fields in {file.name}: {data}")
-        #     # print(f"Skipping {file.name}, missing fields: {data}")
-        #     # continue
-
         # Compose key for runtime lookup
         if data["method"] == "none":
-            key = f"{data['directory']} (-m none)"
+            data["name"] = f"{data['directory']} (-m none)"
         else:
-            key = f"{data['directory']} (-a uniform -m {data['method']})"
-        data["runtime"] = runtime_map.get(key)
-
+            data["name"] = f"{data['directory']} (-a uniform -m {data['method']})"
         rows.append(data)
+    return pd.DataFrame(rows, columns=["name", *COLUMNS[:-1]])
+
+
+def main(log_dir: Path):
+    output_file = log_dir / "full_results.csv"
+
+    records_file = log_dir / RESULTS_FILE
+    if records_file.exists():
+        df = load_records(records_file)
+    else:
+        print(f"{records_file} not found, reading the log files")
+        df = scrape_logs(log_dir)
+
+    # Load runtimes from the CSV file of benchmark.py (the median runtime if the jobs were repeated)
+    runtimes = pd.read_csv(runner_csv(log_dir), sep=";", dtype=str)
+    df = df.merge(runtimes[["name", "runtime"]], on="name", how="left")
 
-    # Write to CSV
-    with output_file.open("w", newline="") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=[
-                "directory",
-                "seed",
-                "algorithm",
-                "method",
-                "sampler",
-                "total_samples",
-                "unique_samples",
-                "time",
-                "runtime",
-            ],
-        )
-        writer.writeheader()
-        writer.writerows(rows)
+    extra_columns = [
+        column
+        for column in df.columns
+        if column not in COLUMNS and column not in ["name", "file"]
+    ]
+    df = df.reindex(columns=[*COLUMNS, *extra_columns])
+    df.to_csv(output_file, index=False, quoting=csv.QUOTE_MINIMAL)
 
     print("wrote to", output_file)
 
@@ -88,7 +137,7 @@ if __name__ == "__main__":
     import sys
 
     if len(sys.argv) != 2:
-        print(f"Usage: python {sys.argv[0]} <benchmarks.csv>")
+        print(f"Usage: python {sys.argv[0]} <results folder>")
         sys.exit(1)
 
     main(Path(sys.argv[1]))
@@ -3,10 +3,13 @@ import numpy as np
 import pandas as pd
 import os
 import re
-import subprocess
 from pathlib import Path
 from tqdm import tqdm
 
+import telemetry
+import tracing
+from utils import Timer, run_tool
+
 """
 Process pairs of feature models and compute several stats and *retainment*, the expected percentage of samples of the first model that can be re-used after the update.
 """
@@ -24,7 +27,13 @@ def compute_model_count(file: Path) -> int | None:
         ".",
         file,
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    timer = Timer(enable_printing=False)
+    result = run_tool("sharpsat", cmd, capture_output=True, text=True)
+    telemetry.observe(
+        "model_counter_seconds",
+        timer.stop(),
+        help="model counter invocations and their duration",
+    )
     match = re.search(r"c s exact arb int (\d+)", result.stdout)
     if match:
         return int(match.group(1))
@@ -33,6 +42,7 @@ def compute_model_count(file: Path) -> int | None:
         return None
 
 
+@tracing.traced()
 def read_dimacs(file: Path):
     with file.open("r") as f:
         lines = f.readlines()
@@ -55,6 +65,7 @@ def read_dimacs(file: Path):
     return num_vars, clauses, comments
 
 
+@tracing.traced()
 def conjunction(
     file_old: Path, file_new: Path, directory: Path = Path("conjunctions")
 ) -> Path:
@@ -1,7 +1,6 @@
 import math
 import os
 from pathlib import Path
-import subprocess
 import random
 from enum import StrEnum, auto
 import tempfile
@@ -12,7 +11,13 @@ from pysat.formula import CNF
 from pysat.solvers import Solver
 
 from retainment import compute_model_count, conjunction
-from utils import Timer
+from utils import PhaseTimer, Timer, copy_tool_stats, run_tool, tool_stats_since
+import kus_backend
+import sample_archive
+from sample_store import SampleStore
+import simplify
+import telemetry
+import tracing
 
 
 class Sampler(StrEnum):
@@ -38,17 +43,36 @@ class UnsatError(Exception):
 
 SEED = 4711
 VALIDATE_SAMPLES = False
+SIMPLIFY = False
+"""Sample the simplified formulas instead of the input files (see `simplify.py`), set by `history_sampling.py --simplify`"""
+SAMPLE_STORE: SampleStore | None = None
+"""Store of previously generated samples consulted by `get_samples`, set by `history_sampling.py` (see `sample_store.py`)"""
 DEFAULT_SAMPLER = Sampler.spur
 DEFAULT_METHOD = Method.rejection
 DEFAULT_ALGORITHM = Algorithm.uniform
 SPUR = os.getenv("SPUR", "spur")
 
+PHASES = [
+    "conjunction",
+    "count_conj",
+    "count_old",
+    "count_new",
+    "sample_old",
+    "check_old",
+    "sample_conj",
+    "sample_new",
+]
+"""Phases of `retainment_sampling` whose runtime is reported separately"""
+TOOLS = ["spur", "kus", "sharpsat"]
+"""External tools whose invocations are reported by `retainment_sampling`"""
+
 REJECTION_MAX_CANDIDATES = 10**4
 """In rejection sampling: the maximum number of candidate samples requested at once from the base sampler"""
 REJECTION_TOTAL_MAX_CANDIDATES = 10**6
 """In rejection sampling: the maximum total number of candidate samples before rejection sampling is aborted"""
 
 
+@tracing.traced()
 def parse_spur_output(file: Path) -> list[str]:
     samples = []
     recording = False
@@ -89,55 +113,42 @@ def get_samples_spur(file: Path, n: int) -> list[list[int]]:
             str(random.randint(0, 10000)),
         ]
         # print("Running", " ".join(cmd))
-        result = subprocess.run(cmd, capture_output=True)
+        result = run_tool("spur", cmd, capture_output=True)
         result.check_returncode()
 
         # parse SPUR output
         raw_samples = parse_spur_output(output_file)
         assert len(raw_samples) == n
 
-    # randomly substitute '*' with 0 or 1
-    samples = []
-    for line in raw_samples:
-        sample = []
-        for i in range(len(line)):
-            var = i + 1  # variables are 1-indexed
-            if line[i] == "*":
-                sample.append(random.choice([var, -var]))
-            elif line[i] == "1":
-                sample.append(var)
-            elif line[i] == "0":
-                sample.append(-var)
-            else:
-                raise ValueError
-        samples.append(sample)
-    return samples
+    return [expand_spur_sample(line) for line in raw_samples]
+
+
+def expand_spur_sample(line: str) -> list[int]:
+    """
+    Convert a sample in SPUR's output format to a list of literals, randomly substituting '*' with 0 or 1.
+
+    >>> expand_spur_sample("10*")
+    [1, -2, 3]
+    """
+    sample = []
+    for i in range(len(line)):
+        var = i + 1  # variables are 1-indexed
+        if line[i] == "*":
+            sample.append(random.choice([var, -var]))
+        elif line[i] == "1":
+            sample.append(var)
+        elif line[i] == "0":
+            sample.append(-var)
+        else:
+            raise ValueError
+    return sample
 
 
 def get_samples_kus(file: Path, n: int) -> list[list[int]]:
-    kus_path = os.getenv("KUS")
-    assert kus_path, "set environment variable 'KUS' to point to the KUS repository"
     with tempfile.TemporaryDirectory() as tmp:
         output_file = (Path(tmp) / (file.name + ".samples")).absolute()
-        cmd = [
-            "python3",
-            "KUS.py",
-            "--samples",
-            str(n),
-            "--outputfile",
-            str(output_file),
-            "--seed",
-            str(random.randint(0, 10000)),
-        ]
-        # Re-use the d-DNNF if it has already been constructed
-        nnf_file = file.with_name(file.name + ".nnf").absolute()
-        if nnf_file.exists():
-            cmd.extend(["--dDNNF", str(nnf_file)])
-        else:
-            cmd.append(str(file.absolute()))
-
-        result = subprocess.run(cmd, capture_output=True, cwd=kus_path)
-        result.check_returncode()
+        # runs KUS in a worker process, and re-uses the d-DNNF if the same formula has been compiled before (see `kus_backend.py`)
+        kus_backend.run_kus(file, n, random.randint(0, 10000), output_file)
         samples = []
         with open(output_file, "r") as f:
             for line in f:
@@ -149,17 +160,78 @@ def get_samples_kus(file: Path, n: int) -> list[list[int]]:
     return samples
 
 
-def get_samples(file: Path, n: int, engine: Sampler) -> list[list[int]]:
-    """Generate `n` samples for the given `file`, using the sampler specified by `engine`."""
+def get_samples(file: Path, n: int, engine: Sampler, projection: int | None = None) -> list[list[int]]:
+    """
+    Generate `n` samples for the given `file`, using the sampler specified by `engine`.
+    With a `SAMPLE_STORE`, the sampler runs with its own seed drawn from `random`, so the samples can be looked up in the store by that seed,
+    and `random` is in the same state afterwards whether the samples were generated or found in the store.
+    Without a store, the sampler draws from `random` directly.
+
+    With `projection`, the samples only assign the variables 1..`projection` (e.g. not the auxiliary variables of `tseitin_formula`).
+    Neither SPUR nor KUS can sample a projection, so the other variables are removed from the samples afterwards (see `project`).
+    This keeps the samples uniform only if the other variables are defined by the projected ones, as the Tseitin variables are.
+    """
+    timer = Timer(enable_printing=False)
     match engine:
         case Sampler.kus:
-            return get_samples_kus(file, n)
+            get_samples_engine = get_samples_kus
         case Sampler.spur:
-            return get_samples_spur(file, n)
+            get_samples_engine = get_samples_spur
         case _:
             raise ValueError(f"Unknown engine '{engine}'")
 
+    def generate():
+        if SIMPLIFY:
+            try:
+                samples = simplify.sample(file, n, get_samples_engine)
+            except simplify.Unsatisfiable:
+                raise UnsatError
+        else:
+            samples = get_samples_engine(file, n)
+        if projection is not None:
+            samples = project(samples, projection)
+        return samples
+
+    if SAMPLE_STORE is None:
+        samples = generate()
+    else:
+        seed = random.randint(0, 2**31 - 1)
+        key = SAMPLE_STORE.key(file, engine, seed, n, SIMPLIFY, projection)
+        samples = SAMPLE_STORE.get(key)
+        if samples is not None:
+            telemetry.inc("sample_store_hits_total", labels={"sampler": engine}, help="samples found in the sample store")
+            return samples
+        state = random.getstate()
+        random.seed(seed)
+        try:
+            samples = generate()
+        finally:
+            random.setstate(state)
+        SAMPLE_STORE.put(key, samples, SAMPLE_STORE.provenance(file, engine, seed, n, SIMPLIFY, projection))
+    telemetry.observe(
+        "sampler_seconds",
+        timer.stop(),
+        labels={"sampler": engine},
+        help="sampler invocations and their duration",
+    )
+    telemetry.inc("sampler_samples_total", n, labels={"sampler": engine})
+    return samples
+
+
+def project(samples: list[list[int]], num_vars: int) -> list[list[int]]:
+    """
+    The samples restricted to the variables 1..`num_vars`, ordered by variable.
 
+    >>> project([[1, -2, 3, -4], [-4, 3, 2, -1]], 2)
+    [[1, -2], [-1, 2]]
+    """
+    if not samples:
+        return samples
+    bits = sample_archive.to_bits(samples, len(samples[0]))
+    return sample_archive.to_literals(bits[:, :num_vars])
+
+
+@tracing.traced()
 def rejection_sampling(
     engine: Sampler, file_old: Path, file_new: Path, n: int, hitrate=1.0, oversample=0.05
 ) -> tuple[list[list[int]], int]:
@@ -174,6 +246,26 @@ def rejection_sampling(
     
     Uses the global constants `REJECTION_MAX_CANDIDATES` and `REJECTION_TOTAL_MAX_CANDIDATES`.
     """
+    samples = []
+    num_candidates = 0
+    for accepted, num_candidates in rejection_batches(engine, file_old, file_new, n, hitrate, oversample):
+        samples.extend(accepted)
+    return samples, num_candidates
+
+
+def rejection_batches(
+    engine: Sampler,
+    file_old: Path,
+    file_new: Path,
+    n: int,
+    hitrate=1.0,
+    oversample=0.05,
+    max_candidates=REJECTION_MAX_CANDIDATES,
+):
+    """
+    Rejection sampling in batches of at most `max_candidates` candidate samples (see `rejection_sampling`).
+    Yields the accepted samples of each batch and the number of candidates checked so far.
+    """
     assert n > 0
 
     # set up SAT solver for old model
@@ -183,71 +275,90 @@ def rejection_sampling(
     assert is_sat, f"{file_old} is UNSAT"
 
     # generate candidate samples for file_new and reject those that are valid for file_old
-    samples = []
     num_samples = 0
     num_candidates = 0
     next_candidates = min(
-        round(n / hitrate * (1 + oversample)), REJECTION_MAX_CANDIDATES
+        round(n / hitrate * (1 + oversample)), max_candidates
     )
     while num_samples < n and num_candidates < REJECTION_TOTAL_MAX_CANDIDATES:
         timer = Timer(enable_printing=False)
         candidates = get_samples(file_new, next_candidates, engine)
-        checks = 0
         num_candidates += next_candidates
-        for candidate in candidates:
-            # reject samples valid for file_old
-            checks += 1
-            if not checker_old.solve(assumptions=candidate):
-                samples.append(candidate)
-                num_samples += 1
-                if num_samples == n:
-                    break
-        else:  # no break
+        accepted = reject_valid(checker_old, candidates, n - num_samples)
+        num_samples += len(accepted)
+        yield accepted, num_candidates
+        if num_samples < n:
             # with m valid samples remaining, the hitrate is ~ m/n. We still need n-m samples, so we generate another (n-m)n/m candidate samples
             hitrate = num_samples / num_candidates
             if hitrate == 0.0:
                 hitrate = 0.0001
             next_candidates = min(
                 round((n - num_samples) / hitrate * (1 + oversample)) + 1,
-                REJECTION_MAX_CANDIDATES,
+                max_candidates,
             )
         check_time = timer.stop()
-        # print(f"Generated & checked {checks/check_time} candidates per second")
+        # print(f"Generated & checked {num_candidates/check_time} candidates per second")
     if num_samples < n:
         print(
             f"Warning: Rejection sampling aborted with {n} of {num_samples} samples found, after rejecting {num_candidates} candidate samples."
         )
-    return samples, num_candidates
 
 
+def reject_valid(checker_old: Solver, candidates: list[list[int]], n: int) -> list[list[int]]:
+    """The first `n` candidates that are not valid for the formula of `checker_old`"""
+    accepted = []
+    for candidate in candidates:
+        if not checker_old.solve(assumptions=candidate):
+            accepted.append(candidate)
+            if len(accepted) == n:
+                break
+    return accepted
+
+
+@tracing.traced()
 def tseitin_sampling(engine:Sampler, file_old: Path, file_new: Path, n: int) -> list[list[int]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / f"not_{file_old.stem}_and_{file_new.stem}.dimacs"
+        cnf, num_vars = tseitin_formula(file_old, file_new)
+        cnf.to_file(path)
+        samples = get_samples(path, n, engine, projection=num_vars)
+    return samples
+
+
+def tseitin_formula(file_old: Path, file_new: Path) -> tuple[CNF, int]:
+    """
+    not F and F', and the number of variables of F and F'.
+    The auxiliary variables of the Tseitin transformation of not F are numbered after the variables of both F and F'.
+    """
     f_old = CNF(from_file=file_old)
-    cnf = f_old.negate()  # not F
+    f_new = CNF(from_file=file_new)
+    num_vars = max(f_old.nv, f_new.nv)
+    cnf = f_old.negate(topv=num_vars)  # not F
     if cnf.auxvars:
         assert list(range(min(cnf.auxvars), max(cnf.auxvars) + 1)) == cnf.auxvars
     # print("auxvars:", cnf.auxvars)
-    f_new = CNF(from_file=file_new)
     cnf.extend(f_new.clauses)  # not F and F'
-
-    with tempfile.TemporaryDirectory() as tmp:
-        path = Path(tmp) / f"not_{file_old.stem}_and_{file_new.stem}.dimacs"
-        cnf.to_file(path)
-        samples = get_samples(path, n, engine)
-        # trim away aux variables
-        # samples = [sample[: min(cnf.auxvars) - 1] for sample in samples]
-    return samples
+    return cnf, num_vars
 
 
+@tracing.traced()
 def write_samples(samples: list[list[int]], path: Path):
-    """Write samples to a file, one per line"""
+    """
+    Write samples to a file, one per line.
+    If `path` ends with `.smpl`, the samples are written to a binary sample archive instead (see `sample_archive.py`).
+    """
+    if path.suffix == sample_archive.SUFFIX:
+        sample_archive.write_archive(path, samples)
+        return
     with path.open("w") as f:
         for clause in samples:
             f.write(" ".join(map(str, clause)) + "\n")
 
 
+@tracing.traced()
 def read_samples(path: Path) -> list[list[int]]:
     """
-    Read samples from a file.
+    Read samples from a file written by `write_samples`, or from a binary sample archive.
     
     File format:
     ```
@@ -257,10 +368,65 @@ def read_samples(path: Path) -> list[list[int]]:
     ```
     yields the sample list `[[1,-2,3], [-1,2,3], [1,2,3]]`
     """
+    if sample_archive.is_archive(path):
+        return sample_archive.read_archive(path)
     with path.open() as f:
         return [list(map(int, line.strip().split())) for line in f if line.strip()]
 
 
+def incomparable_stats(num_samples: int) -> dict:
+    """Statistics of an update whose old and new model have no configuration in common, so all samples are new"""
+    return {
+        "num_samples": num_samples,
+        "num_valid_old_expected": 0,
+        "num_valid_old": 0,
+        "num_needed_old": 0,
+        "num_retained": 0,
+        "num_retained_expected": 0,
+        "num_more_old": 0,
+        "num_needed_new": num_samples,
+        "num_candidates_new": 0,
+        "update_type": "incompareable",
+        "short_circuit": True,
+    }
+
+
+def refactoring_stats(num_samples: int) -> dict:
+    """Statistics of an update that does not change the configuration space, so all samples are retained"""
+    return {
+        "num_samples": num_samples,
+        "num_valid_old_expected": num_samples,
+        "num_valid_old": num_samples,
+        "num_needed_old": num_samples,
+        "num_retained": num_samples,
+        "num_retained_expected": num_samples,
+        "num_more_old": 0,
+        "num_needed_new": 0,
+        "num_candidates_new": 0,
+        "update_type": "refactoring",
+        "short_circuit": True,
+    }
+
+
+def needed_old(algorithm: Algorithm, num_samples: int, max_use: float) -> int:
+    """Number of samples of the new model that are drawn from the conjunction with the old model"""
+    match algorithm:
+        case Algorithm.rounding:
+            num_needed_old = math.ceil(num_samples * max_use)
+        case Algorithm.expectation_uniform:
+            nr = num_samples * max_use
+            if nr == int(nr):
+                num_needed_old = int(nr)
+            else:
+                num_needed_old = math.floor(nr)
+                x = nr - math.floor(nr)
+                if random.random() > x:
+                    num_needed_old += 1
+        case Algorithm.uniform:
+            num_needed_old = binomial(n=num_samples, p=max_use)
+    return num_needed_old
+
+
 def retainment_sampling(
     engine: Sampler,
     method: Method,
@@ -271,60 +437,55 @@ def retainment_sampling(
     samples_old: list[list[int]]|None=None,
     count_old:int|None=None,
     count_new:int|None=None,
+    count_conj:int|None=None,
 ) -> tuple[list[list[int]], dict]:
-    """Retainment sampling"""
+    """
+    Retainment sampling
+
+    Besides the counts of the different kinds of samples, the returned statistics contain the time spent in each phase (`time_<phase>`, see `PHASES`)
+    and the number of invocations, wall time and CPU time of the external tools (`<tool>_calls`, `<tool>_wall_time`, `<tool>_cpu_time`).
+    """
+    phases = PhaseTimer(PHASES)
+    tools_before = copy_tool_stats()
+
+    def breakdown():
+        return {**phases.as_dict(), **tool_stats_since(tools_before, TOOLS)}
 
     # compute model count of conjunction
     tmp_dir = Path(tempfile.mkdtemp())
-    file_conj = conjunction(file_old, file_new, directory=tmp_dir)
-    count_conj = compute_model_count(file_conj)
+    with phases.phase("conjunction"):
+        file_conj = conjunction(file_old, file_new, directory=tmp_dir)
+    if count_conj is None:
+        with phases.phase("count_conj"):
+            count_conj = compute_model_count(file_conj)
     assert count_conj is not None
 
     # check for empty intersection
     if count_conj == 0:
         # no retainment possible, fall back to regular sampling
-        return get_samples(file_new, num_samples, engine), {
-        "num_samples": num_samples,
-        "num_valid_old_expected": 0,
-        "num_valid_old": 0,
-        "num_needed_old": 0,
-        "num_retained": 0,
-        "num_retained_expected": 0,
-        "num_more_old": 0,
-        "num_needed_new": num_samples,
-        "num_candidates_new": 0,
-        "update_type": "incompareable",
-        "short_circuit": True,
-    }
+        with phases.phase("sample_new"):
+            samples = get_samples(file_new, num_samples, engine)
+        return samples, {**incomparable_stats(num_samples), **breakdown()}
 
     # generate samples for old model
     if samples_old is None:
-        samples_old = get_samples(file_old, num_samples, engine)
+        with phases.phase("sample_old"):
+            samples_old = get_samples(file_old, num_samples, engine)
     assert len(samples_old) == num_samples
 
     # get model counts for old and new file
     if count_old is None:
-        count_old = compute_model_count(file_old)
+        with phases.phase("count_old"):
+            count_old = compute_model_count(file_old)
     assert count_old
     if count_new is None:
-        count_new = compute_model_count(file_new)
+        with phases.phase("count_new"):
+            count_new = compute_model_count(file_new)
     assert count_new
 
     # check for refactoring update (no change in configuration space)
     if count_conj == count_old and count_conj == count_new:
-        return samples_old, {
-        "num_samples": num_samples,
-        "num_valid_old_expected": num_samples,
-        "num_valid_old": num_samples,
-        "num_needed_old": num_samples,
-        "num_retained": num_samples,
-        "num_retained_expected": num_samples,
-        "num_more_old": 0,
-        "num_needed_new": 0,
-        "num_candidates_new": 0,
-        "update_type": "refactoring",
-        "short_circuit": True,
-    }
+        return samples_old, {**refactoring_stats(num_samples), **breakdown()}
 
     # determine update types
     if count_conj == count_old:
@@ -341,10 +502,11 @@ def retainment_sampling(
         is_sat = checker_old.append_formula(f_old.clauses, no_return=False)
         assert is_sat, f"{file_old} is UNSAT"
 
-    f_new = CNF(from_file=file_new)
-    checker_new = Solver()
-    is_sat = checker_new.append_formula(f_new.clauses, no_return=False)
-    assert is_sat, f"{file_new} is UNSAT"
+    with phases.phase("check_old"):
+        f_new = CNF(from_file=file_new)
+        checker_new = Solver()
+        is_sat = checker_new.append_formula(f_new.clauses, no_return=False)
+        assert is_sat, f"{file_new} is UNSAT"
 
     # compute expected retainment
     max_keep = count_conj / count_old
@@ -352,28 +514,16 @@ def retainment_sampling(
     expected_retainment = min(max_keep, max_use)
 
     # check which samples can be kept
-    samples_old_and_new = []
-    for sample in samples_old:
-        if checker_new.solve(assumptions=sample):
-            samples_old_and_new.append(sample)
+    with phases.phase("check_old"):
+        samples_old_and_new = []
+        for sample in samples_old:
+            if checker_new.solve(assumptions=sample):
+                samples_old_and_new.append(sample)
 
     # determine number of samples for new/old
     num_valid_old = len(samples_old_and_new)
     num_valid_old_expected = num_samples * max_keep
-    match algorithm:
-        case Algorithm.rounding:
-            num_needed_old = math.ceil(num_samples * max_use)
-        case Algorithm.expectation_uniform:
-            nr = num_samples * max_use
-            if nr == int(nr):
-                num_needed_old = int(nr)
-            else:
-                num_needed_old = math.floor(nr)
-                x = nr - math.floor(nr)
-                if random.random() > x:
-                    num_needed_old += 1
-        case Algorithm.uniform:
-            num_needed_old = binomial(n=num_samples, p=max_use)
+    num_needed_old = needed_old(algorithm, num_samples, max_use)
     num_needed_new = num_samples - num_needed_old
 
     # samples for the conjunction (old)
@@ -381,7 +531,8 @@ def retainment_sampling(
     if num_valid_old < num_needed_old:
         # generate more samples for the conjunction
         num_more_old = num_needed_old - num_valid_old
-        samples_conj = get_samples(file_conj, num_more_old, engine)
+        with phases.phase("sample_conj"):
+            samples_conj = get_samples(file_conj, num_more_old, engine)
         if VALIDATE_SAMPLES:
             for sample in samples_conj:
                 assert checker_new.solve(
@@ -398,16 +549,20 @@ def retainment_sampling(
         samples_new = []
         num_candidates_new = 0
     elif method == Method.rejection:
-        samples_new, num_candidates_new = rejection_sampling(
-            engine, file_old, file_new, n=num_needed_new, hitrate=1 - max_use
-        )
+        with phases.phase("sample_new"):
+            samples_new, num_candidates_new = rejection_sampling(
+                engine, file_old, file_new, n=num_needed_new, hitrate=1 - max_use
+            )
         if len(samples_new) != num_needed_new:
             print(
                 f"Rejection sampling failed, falling back to regular sampling with SPUR."
             )
-            return get_samples_spur(file_new, num_samples), {"spur_fallback": True}
+            with phases.phase("sample_new"):
+                samples = get_samples_spur(file_new, num_samples)
+            return samples, {"spur_fallback": True, **breakdown()}
     elif method == Method.tseitin:
-        samples_new = tseitin_sampling(engine, file_old, file_new, n=num_needed_new)
+        with phases.phase("sample_new"):
+            samples_new = tseitin_sampling(engine, file_old, file_new, n=num_needed_new)
         num_candidates_new = 0
     if VALIDATE_SAMPLES:
         for sample in samples_new:
@@ -434,7 +589,8 @@ def retainment_sampling(
         "num_needed_new": num_needed_new,
         "num_candidates_new": num_candidates_new,
         "update_type": update_type,
-        "short_circuit": False
+        "short_circuit": False,
+        **breakdown(),
     }
 
 
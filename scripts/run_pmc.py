@@ -1,8 +1,16 @@
+import argparse
+import concurrent.futures
+import hashlib
 import os
 import platform
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
-import sys
+from pathlib import Path
+
+from utils import run_tool
 
 # Select pmc binary
 current_os = platform.system()
@@ -14,74 +22,118 @@ else:
     raise OSError(f"Unsupported operating system: {current_os}")
 
 
-def run_pmc(input_dir):
-    input_dir = input_dir.rstrip("/")
-    output_dir = f"{input_dir}_pmc"
-
-    os.makedirs(output_dir, exist_ok=True)
-
-    def process_dir(in_subdir, out_subdir, label):
-        os.makedirs(out_subdir, exist_ok=True)
-        print(f"Processing {label}...")
-        start = time.time()
-
-        for fname in os.listdir(in_subdir):
-            if not (fname.endswith(".cnf") or fname.endswith(".dimacs")):
-                continue
-
-            in_file = os.path.join(in_subdir, fname)
-            out_file = os.path.join(out_subdir, fname)
-
-            with open(in_file) as f:
-                original_lines = f.readlines()
-
-            header = [line for line in original_lines if line.startswith("c ")]
-            p_line = next(
-                (line for line in original_lines if line.startswith("p cnf")), None
-            )
-            clauses = [
-                line
-                for line in original_lines
-                if not line.startswith("c ") and not line.startswith("p cnf")
-            ]
-
-            result = subprocess.run(
-                [
-                    PMC,
-                    "-vivification",
-                    "-eliminateLit",
-                    "-litImplied",
-                    "-iterate=10",
-                    "-verb=0",
-                    in_file,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL,
-                text=True,
-            )
+PMC_OPTIONS = ["-vivification", "-eliminateLit", "-litImplied", "-iterate=10", "-verb=0"]
+CACHE_DIR = Path("data") / "pmc_cache"
+"""
+Preprocessed files by the hash of the input file, the pmc binary and its options.
+Files that did not change since they were last preprocessed (e.g. most snapshots of a regenerated history) are copied from here instead of running pmc again.
+"""
+
+_pmc_hash = None
+
+
+def cache_key(in_file) -> str:
+    global _pmc_hash
+    if _pmc_hash is None:
+        _pmc_hash = file_hash(PMC).hexdigest()
+    return file_hash(in_file, f"{_pmc_hash} {' '.join(PMC_OPTIONS)}\n").hexdigest()
+
+
+def file_hash(path, prefix=""):
+    digest = hashlib.sha256(prefix.encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest
+
+
+def preprocess_file(in_file, out_file, cache_dir=None) -> bool:
+    """
+    Preprocess `in_file` with pmc and write the result to `out_file`. Returns whether the result was in the cache.
+    If pmc fails, the original problem is written and nothing is cached.
+    """
+    cached_file = None
+    if cache_dir is not None:
+        cached_file = Path(cache_dir) / f"{cache_key(in_file)}.dimacs"
+        if cached_file.exists():
+            shutil.copyfile(cached_file, out_file)
+            return True
+
+    # the output of pmc and the result are streamed through files, to not hold large formulas in memory
+    tmp_file = f"{out_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with tempfile.TemporaryFile("w+") as pmc_output:
+        result = run_tool(
+            "pmc",
+            [PMC, *PMC_OPTIONS, in_file],
+            stdout=pmc_output,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        pmc_output.seek(0)
+        solved = any(line.startswith("s ") for line in pmc_output)
+        pmc_output.seek(0)
+        # pmc exits with 30 if it solved the problem, which is not an error
+        failed = result.returncode != 0 and not solved
+        if failed:
+            print(f"Warning: pmc failed on {in_file} (exit code {result.returncode}), keeping the original problem")
+
+        with open(in_file) as original, open(tmp_file, "w") as f:
+            p_line = None
+            for line in original:
+                if line.startswith("c "):
+                    f.write(line)
+                elif p_line is None and line.startswith("p cnf"):
+                    p_line = line
+            f.write("\n")
+
+            if solved or failed:
+                # Keep original problem — pmc solved it prematurely or did not finish
+                if p_line:
+                    f.write(p_line + "\n")
+                original.seek(0)
+                for line in original:
+                    if not line.startswith("c ") and not line.startswith("p cnf"):
+                        f.write(line)
+            else:
+                # Use pmc-rewritten CNF
+                for line in pmc_output:
+                    if not line.startswith("c "):
+                        f.write(line if line.endswith("\n") else line + "\n")
+
+    if cached_file is not None and not failed:
+        cached_file.parent.mkdir(exist_ok=True, parents=True)
+        shutil.copyfile(tmp_file, f"{tmp_file}.cache")
+        os.replace(f"{tmp_file}.cache", cached_file)
+    os.replace(tmp_file, out_file)
+    return False
+
+
+def process_dir(in_subdir, out_subdir, label, jobs=1, cache_dir=CACHE_DIR):
+    """Preprocess all CNF files in `in_subdir` with `jobs` pmc processes in parallel"""
+    os.makedirs(out_subdir, exist_ok=True)
+    print(f"Processing {label}...")
+    start = time.time()
+
+    files = [
+        (os.path.join(in_subdir, fname), os.path.join(out_subdir, fname))
+        for fname in sorted(os.listdir(in_subdir))
+        if fname.endswith(".cnf") or fname.endswith(".dimacs")
+    ]
+    # pmc runs as a separate process, so threads are enough to run several at once
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        cached = list(
+            executor.map(lambda files: preprocess_file(*files, cache_dir), files)
+        )
 
-            pmc_lines = result.stdout.splitlines()
-            solved_line = next(
-                (line for line in pmc_lines if line.startswith("s ")), None
-            )
+    end = time.time()
+    print(f"Time for {label}: {end - start:.1f}s ({sum(cached)}/{len(files)} cached)")
 
-            with open(out_file, "w") as f:
-                f.writelines(header)
-                f.write("\n")
 
-                if solved_line:
-                    # Keep original problem — pmc solved it prematurely
-                    if p_line:
-                        f.write(p_line + "\n")
-                    f.writelines(clauses)
-                else:
-                    # Use pmc-rewritten CNF
-                    body = [line for line in pmc_lines if not line.startswith("c ")]
-                    for line in body:
-                        f.write(line + "\n")
+def run_pmc(input_dir, jobs=1, cache_dir=CACHE_DIR):
+    input_dir = input_dir.rstrip("/")
+    output_dir = f"{input_dir}_pmc"
 
-        end = time.time()
-        print(f"Time for {label}: {end - start:.1f}s")
+    os.makedirs(output_dir, exist_ok=True)
 
     # Decide if input_dir is a direct CNF directory or a container of directories
     entries = [os.path.join(input_dir, e) for e in os.listdir(input_dir)]
@@ -94,16 +146,36 @@ def run_pmc(input_dir):
 
     if cnf_files:
         # Direct CNF files in input_dir
-        process_dir(input_dir, output_dir, os.path.basename(input_dir))
+        process_dir(input_dir, output_dir, os.path.basename(input_dir), jobs, cache_dir)
     else:
         # Subdirectories
         for subdir in sorted(subdirs):
             subname = os.path.basename(subdir)
-            process_dir(subdir, os.path.join(output_dir, subname), subname)
+            process_dir(
+                subdir, os.path.join(output_dir, subname), subname, jobs, cache_dir
+            )
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python run_pmc.py <input_dir>")
-        sys.exit(1)
-    run_pmc(sys.argv[1])
+    arg_parser = argparse.ArgumentParser(
+        prog="run_pmc",
+        description="Preprocess the CNF files in a directory (or in its subdirectories) with pmc",
+    )
+    arg_parser.add_argument("input_dir")
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of files preprocessed in parallel (default: number of cores)",
+    )
+    arg_parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIR,
+        help=f"cache of preprocessed files (default: {CACHE_DIR})",
+    )
+    arg_parser.add_argument(
+        "--no-cache", action="store_true", help="always run pmc, without reading or writing the cache"
+    )
+    args = arg_parser.parse_args()
+    run_pmc(args.input_dir, args.jobs, None if args.no_cache else args.cache_dir)
@@ -0,0 +1,369 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from run_pmc import file_hash
+
+"""
+Binary archive of samples, with one bit per variable and sample.
+
+A sample assigns every variable 1..`num_vars`, so it is stored as a row of `ceil(num_vars / 8)` bytes in which bit `i` is set
+if variable `i + 1` is true. Rows are written in chunks of `chunk_rows` rows, optionally compressed with zlib or zstd
+(if `zstandard` is installed); uniform samples hardly compress, so the rows are stored uncompressed by default.
+
+File layout:
+```
+magic (8 bytes) | offset of the header (8 bytes, little endian) | padding to 64 bytes | chunks | header (JSON)
+```
+The header contains `num_vars`, `num_samples`, `chunk_rows`, `compression`, the offset and size of each chunk,
+and the `provenance` of the samples (e.g. the hash of the formula, the seed and the sampler).
+The header is written last, so samples can be appended chunk by chunk without holding all of them in memory (see `SampleWriter`).
+
+Archives are read through a memory map, so reading a range of rows only reads (and decompresses) the chunks containing them.
+Uncompressed archives are mapped as one `(num_samples, row bytes)` array.
+
+```
+python scripts/sample_archive.py info samples.smpl
+python scripts/sample_archive.py export samples.smpl samples.txt
+python scripts/sample_archive.py import samples.txt samples.smpl --compression zlib
+```
+`export` writes the samples as text in the format of `retainment_sampling.read_samples` (one sample per line),
+`import` converts such a text file to an archive.
+"""
+
+MAGIC = b"SMPLARC1"
+DATA_OFFSET = 64
+SUFFIX = ".smpl"
+DEFAULT_CHUNK_ROWS = 4096
+COMPRESSIONS = ["none", "zlib", "zstd"]
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def to_bits(samples, num_vars: int) -> np.ndarray:
+    """
+    Boolean matrix with one row per sample and one column per variable, from samples given as lists of literals.
+
+    >>> to_bits([[1, -2, 3], [-3, 2, -1]], 3).astype(int).tolist()
+    [[1, 0, 1], [0, 1, 0]]
+    """
+    literals = np.asarray(samples, dtype=np.int64)
+    if literals.size == 0:
+        return np.zeros((len(literals), num_vars), dtype=bool)
+    if literals.ndim != 2 or literals.shape[1] != num_vars:
+        raise ValueError(f"samples must assign all {num_vars} variables")
+    variables = np.abs(literals)
+    if np.array_equal(variables, np.broadcast_to(np.arange(1, num_vars + 1), variables.shape)):
+        return literals > 0  # literals ordered by variable, as written by the samplers
+    if variables.min() < 1 or variables.max() > num_vars:
+        raise ValueError(f"samples contain variables outside of 1..{num_vars}")
+    bits = np.zeros(literals.shape, dtype=bool)
+    assigned = np.zeros(literals.shape, dtype=bool)
+    rows = np.arange(len(literals))[:, None]
+    bits[rows, variables - 1] = literals > 0
+    assigned[rows, variables - 1] = True
+    if not assigned.all():
+        raise ValueError(f"samples must assign all {num_vars} variables")
+    return bits
+
+
+def to_literals(bits: np.ndarray) -> list[list[int]]:
+    """
+    Samples as lists of literals, ordered by variable.
+
+    >>> to_literals(np.array([[True, False, True]]))
+    [[1, -2, 3]]
+    """
+    variables = np.arange(1, bits.shape[1] + 1)
+    return np.where(bits, variables, -variables).tolist()
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data, 1)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+class SampleWriter:
+    """
+    Write samples to an archive in chunks.
+
+    ```
+    with SampleWriter(path, num_vars, provenance={"seed": 1}) as writer:
+        writer.write(samples)
+    ```
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        num_vars: int,
+        compression: str = "none",
+        provenance: dict | None = None,
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression '{compression}', expected one of {', '.join(COMPRESSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("compression 'zstd' needs the zstandard package, use 'zlib' instead")
+        self.path = Path(path)
+        self.num_vars = num_vars
+        self.compression = compression
+        self.provenance = provenance or dict()
+        self.chunk_rows = chunk_rows
+        self.row_bytes = (num_vars + 7) // 8
+        self.num_samples = 0
+        self.chunks: list[tuple[int, int]] = []
+        self.pending: list[np.ndarray] = []
+        """Packed rows that do not fill a chunk yet"""
+        self.num_pending = 0
+        # unique per process, so that processes writing the same archive do not write into the same temporary file
+        self.tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self.file = self.tmp_path.open("wb")
+        self.file.write(MAGIC + bytes(DATA_OFFSET - len(MAGIC)))
+
+    def write(self, samples):
+        """Append samples given as lists of literals"""
+        self.write_bits(to_bits(samples, self.num_vars))
+
+    def write_bits(self, bits: np.ndarray):
+        """Append samples given as a boolean matrix (see `to_bits`)"""
+        self.write_packed(np.packbits(bits, axis=1, bitorder="little"))
+
+    def write_packed(self, rows: np.ndarray):
+        """Append samples given as packed rows (see `SampleArchive.packed`)"""
+        self.pending.append(rows)
+        self.num_pending += len(rows)
+        self.num_samples += len(rows)
+        if self.num_pending >= self.chunk_rows:
+            rows = np.concatenate(self.pending)
+            full = len(rows) - len(rows) % self.chunk_rows
+            for start in range(0, full, self.chunk_rows):
+                self._write_chunk(rows[start : start + self.chunk_rows])
+            self.pending = [rows[full:]]
+            self.num_pending = len(rows) - full
+
+    def _write_chunk(self, rows: np.ndarray):
+        data = compress(np.ascontiguousarray(rows).tobytes(), self.compression)
+        self.chunks.append((self.file.tell(), len(data)))
+        self.file.write(data)
+
+    def close(self):
+        """Write the remaining samples and the header, then move the archive into place"""
+        if self.num_pending:
+            self._write_chunk(np.concatenate(self.pending))
+        self.pending = []
+        self.num_pending = 0
+        header_offset = self.file.tell()
+        header = {
+            "num_vars": self.num_vars,
+            "num_samples": self.num_samples,
+            "chunk_rows": self.chunk_rows,
+            "compression": self.compression,
+            "chunks": self.chunks,
+            "provenance": self.provenance,
+        }
+        self.file.write(json.dumps(header).encode())
+        self.file.seek(len(MAGIC))
+        self.file.write(struct.pack("<Q", header_offset))
+        self.file.close()
+        self.tmp_path.replace(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            self.tmp_path.unlink(missing_ok=True)
+
+
+class SampleArchive:
+    """
+    Read samples from an archive written by `SampleWriter`.
+
+    ```
+    with SampleArchive(path) as archive:
+        samples = archive.samples(1000, 2000)
+    ```
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[: len(MAGIC)] != MAGIC:
+            self.mmap.close()
+            raise ValueError(f"{path} is not a sample archive")
+        (header_offset,) = struct.unpack_from("<Q", self.mmap, len(MAGIC))
+        header = json.loads(self.mmap[header_offset:])
+        self.num_vars: int = header["num_vars"]
+        self.num_samples: int = header["num_samples"]
+        self.chunk_rows: int = header["chunk_rows"]
+        self.compression: str = header["compression"]
+        self.chunks: list[tuple[int, int]] = header["chunks"]
+        self.provenance: dict = header["provenance"]
+        self.row_bytes = (self.num_vars + 7) // 8
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def packed(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """
+        Rows `start` to `stop` (exclusive) with 8 variables per byte.
+        For uncompressed archives, this is a view of the memory map that must not be used after closing the archive.
+        """
+        start, stop, _ = slice(start, stop).indices(self.num_samples)
+        if stop <= start:
+            return np.zeros((0, self.row_bytes), dtype=np.uint8)
+        if self.compression == "none":
+            # all chunks are uncompressed and written one after the other
+            rows = np.frombuffer(
+                self.mmap,
+                dtype=np.uint8,
+                count=self.num_samples * self.row_bytes,
+                offset=DATA_OFFSET,
+            ).reshape(self.num_samples, self.row_bytes)
+            return rows[start:stop]
+        first, last = start // self.chunk_rows, (stop - 1) // self.chunk_rows
+        data = b"".join(
+            decompress(self.mmap[offset : offset + size], self.compression)
+            for offset, size in self.chunks[first : last + 1]
+        )
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, self.row_bytes)
+        return rows[start - first * self.chunk_rows : stop - first * self.chunk_rows]
+
+    def bits(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Rows `start` to `stop` (exclusive) as a boolean matrix with one column per variable"""
+        return np.unpackbits(
+            self.packed(start, stop), axis=1, count=self.num_vars, bitorder="little"
+        ).astype(bool)
+
+    def samples(self, start: int = 0, stop: int | None = None) -> list[list[int]]:
+        """Rows `start` to `stop` (exclusive) as lists of literals"""
+        return to_literals(self.bits(start, stop))
+
+    def iter_chunks(self):
+        """All rows as boolean matrices of up to `chunk_rows` rows"""
+        for start in range(0, self.num_samples, self.chunk_rows):
+            yield self.bits(start, start + self.chunk_rows)
+
+    def close(self):
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def is_archive(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_archive(
+    path: Path, samples, num_vars: int | None = None, compression: str = "none", provenance: dict | None = None
+):
+    """Write samples given as lists of literals to an archive"""
+    if num_vars is None:
+        num_vars = len(samples[0]) if len(samples) else 0
+    with SampleWriter(path, num_vars, compression, provenance) as writer:
+        writer.write(samples)
+
+
+def read_archive(path: Path, start: int = 0, stop: int | None = None) -> list[list[int]]:
+    """Read samples from an archive as lists of literals"""
+    with SampleArchive(path) as archive:
+        return archive.samples(start, stop)
+
+
+def export_text(path: Path, text_path: Path):
+    """Write the samples of an archive as text, one sample per line"""
+    with SampleArchive(path) as archive, text_path.open("w") as f:
+        for bits in archive.iter_chunks():
+            for sample in to_literals(bits):
+                f.write(" ".join(map(str, sample)) + "\n")
+
+
+def import_text(text_path: Path, path: Path, compression: str = "none", provenance: dict | None = None):
+    """Write the samples of a text file (one sample per line) to an archive"""
+    writer = None
+    batch = []
+    with text_path.open() as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(list(map(int, line.split())))
+            if len(batch) == DEFAULT_CHUNK_ROWS:
+                if writer is None:
+                    writer = SampleWriter(path, len(batch[0]), compression, provenance)
+                writer.write(batch)
+                batch = []
+    if writer is None:
+        writer = SampleWriter(path, len(batch[0]) if batch else 0, compression, provenance)
+    writer.write(batch)
+    writer.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="sample_archive", description="Inspect and convert binary sample archives"
+    )
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info", help="print the header of an archive")
+    info_parser.add_argument("archive", type=Path)
+    export_parser = subparsers.add_parser("export", help="write the samples of an archive as text")
+    export_parser.add_argument("archive", type=Path)
+    export_parser.add_argument("text", type=Path)
+    import_parser = subparsers.add_parser("import", help="write the samples of a text file to an archive")
+    import_parser.add_argument("text", type=Path)
+    import_parser.add_argument("archive", type=Path)
+    import_parser.add_argument(
+        "--compression",
+        choices=[compression for compression in COMPRESSIONS if compression != "zstd" or zstandard],
+        default="none",
+        help="compression of the chunks (default: none)",
+    )
+    import_parser.add_argument("--formula", type=Path, help="formula the samples are from, recorded by its hash")
+    args = arg_parser.parse_args()
+
+    match args.command:
+        case "info":
+            with SampleArchive(args.archive) as archive:
+                print(f"samples: {archive.num_samples}")
+                print(f"variables: {archive.num_vars}")
+                print(f"compression: {archive.compression} ({len(archive.chunks)} chunks of {archive.chunk_rows} rows)")
+                for key, value in archive.provenance.items():
+                    print(f"{key}: {value}")
+        case "export":
+            export_text(args.archive, args.text)
+        case "import":
+            provenance = {"formula": file_hash(args.formula).hexdigest()} if args.formula else None
+            import_text(args.text, args.archive, args.compression, provenance)
+
+
+if __name__ == "__main__":
+    main()
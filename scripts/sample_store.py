@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import sample_archive
+from run_pmc import file_hash
+from utils import label
+
+"""
+Persistent store of the samples generated by `retainment_sampling.get_samples`, so that reruns with the same seed
+(after a crash, or to change what is reported) do not have to run the samplers again.
+
+The samples of one call are stored as a sample archive (see `sample_archive.py`) under a key derived from
+the hash of the formula, the sampler, the seed passed to the sampler, the number of samples, whether the formula was simplified,
+and the variables the samples are projected onto (see `get_samples`).
+`get_samples` derives the seed of each call from the random number generator seeded by `history_sampling.py --seed`,
+so the same run asks for the same keys in the same order.
+
+The size of the store is limited to `SAMPLE_STORE_MAX_GB` gigabytes (default: 10). When it grows beyond that,
+the least recently used archives (by modification time, which is updated on every hit) are deleted.
+```
+python scripts/sample_store.py             # size and number of archives
+python scripts/sample_store.py --max-gb 1  # evict down to 1 GB
+python scripts/sample_store.py --clear
+```
+The store is used by `history_sampling.py --sample-store`, in the directory given by `--sample-store-dir` (default: `data/sample_store`).
+Without the flag the samplers always run, as needed for measuring their runtime.
+"""
+
+DEFAULT_DIR = Path("data") / "sample_store"
+DEFAULT_MAX_BYTES = int(float(os.getenv("SAMPLE_STORE_MAX_GB", 10)) * 10**9)
+KEY_VERSION = 1
+"""Changes if the samples generated for the same key change"""
+
+
+class SampleStore:
+    def __init__(self, directory: Path = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size: int | None = None
+        """Total size of the archives, computed on the first write"""
+        self._hashes: dict[tuple[str, int, int], str] = dict()
+        """Hash of each formula by path, modification time and size"""
+
+    def formula_hash(self, file: Path) -> str:
+        stat = file.stat()
+        key = (str(file.resolve()), stat.st_mtime_ns, stat.st_size)
+        if key not in self._hashes:
+            self._hashes[key] = file_hash(file).hexdigest()
+        return self._hashes[key]
+
+    def key(
+        self, file: Path, sampler: str, seed: int, n: int, simplified: bool = False, projection: int | None = None
+    ) -> str:
+        provenance = self.provenance(file, sampler, seed, n, simplified, projection)
+        return hashlib.sha256(json.dumps(provenance, sort_keys=True).encode()).hexdigest()
+
+    def provenance(
+        self, file: Path, sampler: str, seed: int, n: int, simplified: bool = False, projection: int | None = None
+    ) -> dict:
+        provenance = {
+            "version": KEY_VERSION,
+            "formula": self.formula_hash(file),
+            "sampler": str(sampler),
+            "seed": seed,
+            "num_samples": n,
+            "simplified": simplified,
+        }
+        if projection is not None:
+            # only for projected samples, so that the keys of the other samples stay the same
+            provenance["projection"] = projection
+        return provenance
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}{sample_archive.SUFFIX}"
+
+    def get(self, key: str) -> list[list[int]] | None:
+        """The stored samples for `key`, or `None` if there are none"""
+        path = self.path(key)
+        try:
+            samples = sample_archive.read_archive(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except FileNotFoundError:
+            pass  # evicted by another process in the meantime
+        return samples
+
+    def put(self, key: str, samples: list[list[int]], provenance: dict | None = None):
+        """Store `samples` under `key`, and evict old samples if the store is too large"""
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        try:
+            sample_archive.write_archive(path, samples, provenance=provenance)
+        except ValueError:
+            return  # samples that do not assign all variables cannot be stored
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.archives())
+        else:
+            self.size += path.stat().st_size
+        if self.size > self.max_bytes:
+            self.evict(self.max_bytes)
+
+    def archives(self) -> list[tuple[Path, int, int]]:
+        """Path, size and modification time of each archive"""
+        archives = []
+        for path in self.directory.glob(f"*/*{sample_archive.SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            archives.append((path, stat.st_size, stat.st_mtime_ns))
+        return archives
+
+    def evict(self, max_bytes: int) -> int:
+        """Delete the least recently used archives until the store is at most `max_bytes` large, returns how many were deleted"""
+        archives = sorted(self.archives(), key=lambda archive: archive[2])
+        self.size = sum(size for _, size, _ in archives)
+        deleted = 0
+        for path, size, _ in archives:
+            if self.size <= max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+            deleted += 1
+        return deleted
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="sample_store", description="Show the size of the sample store and evict samples"
+    )
+    arg_parser.add_argument(
+        "--directory", type=Path, default=DEFAULT_DIR, help=f"sample store (default: {DEFAULT_DIR})"
+    )
+    arg_parser.add_argument(
+        "--max-gb", type=float, help="delete the least recently used samples until the store is at most this large"
+    )
+    arg_parser.add_argument("--clear", action="store_true", help="delete all samples")
+    args = arg_parser.parse_args()
+
+    store = SampleStore(args.directory)
+    if args.clear:
+        args.max_gb = 0
+    if args.max_gb is not None:
+        deleted = store.evict(int(args.max_gb * 10**9))
+        print(f"deleted {label(deleted, 'archive')}")
+    archives = store.archives()
+    print(
+        f"{store.directory}: {label(len(archives), 'archive')}, {sum(size for _, size, _ in archives) / 10**9:.3f} GB"
+    )
+
+
+if __name__ == "__main__":
+    main()
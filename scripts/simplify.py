@@ -0,0 +1,339 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+from pysat.formula import CNF
+from pysat.solvers import Solver
+
+import generate
+import tracing
+from utils import Timer
+
+"""
+Simplification of CNF formulas that keeps track of what it removed, so that samples and model counts of the simplified formula
+can be mapped back to the original formula.
+
+The simplification removes tautologies and duplicate literals and clauses, propagates unit clauses, detects the backbone
+(the literals that are true in every model, found with a SAT solver), and removes subsumed clauses.
+The remaining variables are renumbered to 1..k, so the counting and sampling tools only see the variables that are still constrained.
+What was removed is recorded in a `Simplification`:
+- `backbone`: the literals fixed by unit propagation or by the backbone detection,
+- `free`: the variables that no longer occur in any clause (they can be assigned arbitrarily),
+- `variables`: the original variable of each variable of the simplified formula.
+
+A uniform sample of the simplified formula, expanded with `Simplification.expand` (backbone literals set, free variables chosen at random),
+is a uniform sample of the original formula, and its model count is `Simplification.model_count(count of the simplified formula)`.
+
+```
+python scripts/simplify.py data/histories_unified/BusyBox
+```
+writes the simplified files and, next to each of them, the `Simplification` as `<file>.simplify.json`.
+With `history_sampling.py --simplify`, all inputs of the sampler are simplified on the fly instead (see `sample`).
+"""
+
+SIDECAR_SUFFIX = ".simplify.json"
+
+
+class Unsatisfiable(Exception):
+    """The formula has no models"""
+
+
+@dataclass
+class Simplification:
+    clauses: list[list[int]]
+    """Clauses of the simplified formula, over the variables 1..len(variables)"""
+    num_vars: int
+    """Number of variables of the original formula"""
+    variables: list[int]
+    """Original variable of each variable of the simplified formula"""
+    backbone: list[int]
+    """Literals of the original formula that are true in every model"""
+    free: list[int]
+    """Original variables that are neither in the backbone nor in the simplified formula"""
+
+    def expand(self, sample: list[int]) -> list[int]:
+        """
+        Map a sample of the simplified formula to a sample of the original formula, assigning the free variables at random.
+
+        >>> Simplification([[1, 2]], 3, [2, 3], [-1], []).expand([1, -2])
+        [-1, 2, -3]
+        """
+        expanded = [0] * self.num_vars
+        for lit in self.backbone:
+            expanded[abs(lit) - 1] = lit
+        for lit in sample:
+            var = self.variables[abs(lit) - 1]
+            expanded[var - 1] = var if lit > 0 else -var
+        for var in self.free:
+            expanded[var - 1] = random.choice([var, -var])
+        return expanded
+
+    def model_count(self, count: int) -> int:
+        """Model count of the original formula, given the model count of the simplified formula"""
+        return count * 2 ** len(self.free)
+
+    def write(self, path: Path, var_names: dict[int, str] | None = None):
+        """Write the simplified formula in DIMACS format to `path` and the mapping to `<path>.simplify.json`"""
+        with path.open("w") as f:
+            for new_var, var in enumerate(self.variables, start=1):
+                if var_names and var in var_names:
+                    f.write(f"c {new_var} {var_names[var]}\n")
+            f.write(f"p cnf {len(self.variables)} {len(self.clauses)}\n")
+            for clause in self.clauses:
+                f.write(" ".join(map(str, clause)) + " 0\n")
+        with sidecar_path(path).open("w") as f:
+            json.dump(
+                {
+                    "num_vars": self.num_vars,
+                    "variables": self.variables,
+                    "backbone": self.backbone,
+                    "free": self.free,
+                },
+                f,
+            )
+
+    @staticmethod
+    def read(path: Path) -> "Simplification":
+        """Read a simplified formula written by `write`"""
+        with sidecar_path(path).open() as f:
+            mapping = json.load(f)
+        return Simplification(CNF(from_file=path).clauses, **mapping)
+
+
+def sidecar_path(path: Path) -> Path:
+    return path.with_name(path.name + SIDECAR_SUFFIX)
+
+
+class _Formula:
+    """Clauses by id with occurrence lists, for removing satisfied clauses and false literals without scanning all clauses"""
+
+    def __init__(self):
+        self.clauses: dict[int, list[int]] = dict()
+        self.occurrences: defaultdict[int, set[int]] = defaultdict(set)
+        """Ids of the clauses each literal occurs in"""
+        self.next_id = 0
+
+    def add(self, clause: list[int]):
+        id = self.next_id
+        self.next_id += 1
+        self.clauses[id] = clause
+        for lit in clause:
+            self.occurrences[lit].add(id)
+
+    def remove(self, id: int) -> list[int]:
+        clause = self.clauses.pop(id)
+        for lit in clause:
+            self.occurrences[lit].discard(id)
+        return clause
+
+    def variables(self) -> set[int]:
+        return {abs(lit) for lit, ids in self.occurrences.items() if ids}
+
+
+def propagate(formula: _Formula, fixed: set[int], units: list[int]):
+    """Assign the literals in `units` and everything they imply, removing satisfied clauses and false literals"""
+    queue = []
+
+    def assign(lit):
+        if -lit in fixed:
+            raise Unsatisfiable
+        if lit not in fixed:
+            fixed.add(lit)
+            queue.append(lit)
+
+    for lit in units:
+        assign(lit)
+    while queue:
+        lit = queue.pop()
+        for id in list(formula.occurrences[lit]):
+            formula.remove(id)
+        for id in list(formula.occurrences[-lit]):
+            clause = [l for l in formula.remove(id) if l != -lit]
+            if not clause:
+                raise Unsatisfiable
+            if len(clause) == 1:
+                assign(clause[0])
+            else:
+                formula.add(clause)
+
+
+def find_backbone(clauses: list[list[int]], variables: set[int]) -> list[int]:
+    """
+    Literals of `variables` that are true in every model of `clauses`.
+    Every model found rules out the candidates it does not satisfy, so only the remaining candidates need a solver call.
+    """
+    backbone = []
+    with Solver(bootstrap_with=clauses) as solver:
+        if not solver.solve():
+            raise Unsatisfiable
+        model = solver.get_model()
+        candidates = {lit for lit in model if abs(lit) in variables}
+        for lit in sorted(candidates, key=abs):
+            if lit not in candidates:
+                continue
+            if solver.solve(assumptions=[-lit]):
+                model = set(solver.get_model())
+                candidates = {l for l in candidates if l in model}
+            else:
+                backbone.append(lit)
+                solver.add_clause([lit])
+    return backbone
+
+
+def remove_subsumed(formula: _Formula):
+    """Remove all clauses that contain all literals of another clause (including duplicates)"""
+    for id in sorted(formula.clauses, key=lambda id: len(formula.clauses[id])):
+        if id not in formula.clauses:
+            continue
+        clause = formula.clauses[id]
+        # a clause that is subsumed by `clause` contains its least frequent literal
+        pivot = min(clause, key=lambda lit: len(formula.occurrences[lit]))
+        for other in list(formula.occurrences[pivot]):
+            if other != id and len(formula.clauses[other]) >= len(clause):
+                if set(clause).issubset(formula.clauses[other]):
+                    formula.remove(other)
+
+
+@tracing.traced()
+def simplify(clauses: list[list[int]], num_vars: int, backbone=True) -> Simplification:
+    """Simplify the formula given by `clauses` over the variables 1..`num_vars`"""
+    formula = _Formula()
+    units = []
+    seen = set()
+    for clause in clauses:
+        literals = frozenset(clause)
+        if any(-lit in literals for lit in literals) or literals in seen:
+            continue  # tautology or duplicate
+        seen.add(literals)
+        if len(literals) == 0:
+            raise Unsatisfiable
+        if len(literals) == 1:
+            units.extend(literals)
+        else:
+            formula.add(sorted(literals, key=abs))
+    del seen
+
+    fixed: set[int] = set()
+    propagate(formula, fixed, units)
+    if backbone and formula.clauses:
+        propagate(
+            formula,
+            fixed,
+            find_backbone(list(formula.clauses.values()), formula.variables()),
+        )
+    remove_subsumed(formula)
+
+    variables = sorted(formula.variables())
+    new_var = {var: i for i, var in enumerate(variables, start=1)}
+    fixed_vars = {abs(lit) for lit in fixed}
+    return Simplification(
+        clauses=[
+            [new_var[lit] if lit > 0 else -new_var[-lit] for lit in clause]
+            for clause in formula.clauses.values()
+        ],
+        num_vars=num_vars,
+        variables=variables,
+        backbone=sorted(fixed, key=abs),
+        free=[
+            var
+            for var in range(1, num_vars + 1)
+            if var not in new_var and var not in fixed_vars
+        ],
+    )
+
+
+def simplify_file(file: Path) -> Simplification:
+    cnf = CNF(from_file=file)
+    return simplify(cnf.clauses, cnf.nv)
+
+
+_simplified: dict[str, tuple[Path, Simplification]] = dict()
+"""Simplified files by the hash of the original file, written to `_simplified_dir`"""
+_simplified_dir: tempfile.TemporaryDirectory | None = None
+
+
+def sample(file: Path, n: int, get_samples) -> list[list[int]]:
+    """
+    `n` samples of `file`, generated with `get_samples(path, n)` on the simplified formula and expanded.
+    The simplification of each file is done once until `clear` is called.
+    """
+    global _simplified_dir
+    key = hashlib.sha1(file.read_bytes()).hexdigest()
+    if key not in _simplified:
+        if _simplified_dir is None:
+            _simplified_dir = tempfile.TemporaryDirectory()
+        path = Path(_simplified_dir.name) / f"{key}.dimacs"
+        simplification = simplify_file(file)
+        simplification.write(path)
+        _simplified[key] = (path, simplification)
+    path, simplification = _simplified[key]
+    if not simplification.variables:
+        # nothing left to sample, all models differ only in the free variables
+        return [simplification.expand([]) for _ in range(n)]
+    return [simplification.expand(sample) for sample in get_samples(path, n)]
+
+
+def clear():
+    """Forget the simplified files, e.g. at the end of a benchmark in a long-lived worker (see `in_process.py`)"""
+    global _simplified_dir
+    _simplified.clear()
+    if _simplified_dir is not None:
+        _simplified_dir.cleanup()
+        _simplified_dir = None
+
+
+def simplify_dir(in_dir: Path, out_dir: Path):
+    out_dir.mkdir(exist_ok=True, parents=True)
+    print(f"Processing {in_dir.name}...")
+    timer = Timer(enable_printing=False)
+    for file in sorted(in_dir.iterdir()):
+        if file.suffix not in [".cnf", ".dimacs"]:
+            continue
+        file_timer = Timer(enable_printing=False)
+        cnf = CNF(from_file=file)
+        try:
+            simplification = simplify(cnf.clauses, cnf.nv)
+        except Unsatisfiable:
+            print(f"  {file.name}: UNSAT, skipped")
+            continue
+        simplification.write(out_dir / file.name, generate.parse_var_names(file))
+        print(
+            f"  {file.name}: {cnf.nv} -> {len(simplification.variables)} variables, "
+            f"{len(cnf.clauses)} -> {len(simplification.clauses)} clauses, "
+            f"backbone {len(simplification.backbone)}, free {len(simplification.free)} ({file_timer.stop():.2f}s)"
+        )
+    print(f"Time for {in_dir.name}: {timer.stop():.1f}s")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="simplify",
+        description="Simplify CNF files and record the backbone and the removed variables",
+    )
+    arg_parser.add_argument(
+        "input_dir", type=Path, help="directory with CNF files, or with subdirectories with CNF files"
+    )
+    arg_parser.add_argument(
+        "-o", "--output", type=Path, help="output directory (default: <input_dir>_simplified)"
+    )
+    args = arg_parser.parse_args()
+
+    input_dir = Path(os.path.normpath(args.input_dir))
+    output_dir = args.output or input_dir.with_name(f"{input_dir.name}_simplified")
+    # like run_pmc.py: either a directory with CNF files or a directory of such directories
+    if any(file.suffix in [".cnf", ".dimacs"] for file in input_dir.iterdir()):
+        simplify_dir(input_dir, output_dir)
+    else:
+        for subdir in sorted(input_dir.iterdir()):
+            if subdir.is_dir():
+                simplify_dir(subdir, output_dir / subdir.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import random
+import shutil
+import time
+
+from pysat.formula import CNF
+from pysat.solvers import Solver
+
+"""
+Stand-in for the KUS repository with a deterministic runtime, for performance tests of the pipeline without the real sampler:
+```
+KUS=scripts/stubs/kus SHARPSAT=scripts/stubs/sharpsat.py python scripts/history_sampling.py -s kus -m tseitin data/test/history1
+```
+Accepts the arguments used by `kus_backend.run_kus` and writes samples in KUS's output format.
+Given a formula `<file>`, it "compiles" it to `<file>.nnf` (a copy of the formula) first, which takes `STUB_COMPILE_LATENCY` seconds
+(default: 0.5), given `--dDNNF <file>.nnf`, it samples from that file without compiling.
+The samples are found by a SAT solver with random phases, so they are valid but not uniform.
+Each call takes `STUB_LATENCY` seconds (default: 0.05) plus `STUB_SAMPLE_LATENCY` seconds per sample (default: 0.0001), independent of the formula.
+"""
+
+LATENCY = float(os.getenv("STUB_LATENCY", "0.05"))
+SAMPLE_LATENCY = float(os.getenv("STUB_SAMPLE_LATENCY", "0.0001"))
+COMPILE_LATENCY = float(os.getenv("STUB_COMPILE_LATENCY", "0.5"))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog="KUS", description="KUS stub")
+    arg_parser.add_argument("--samples", type=int, default=10)
+    arg_parser.add_argument("--outputfile", default="samples.txt")
+    arg_parser.add_argument("--seed", type=int)
+    arg_parser.add_argument("--dDNNF")
+    arg_parser.add_argument("DIMACS", nargs="?")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    nnf_file = args.dDNNF
+    if nnf_file is None:
+        nnf_file = args.DIMACS + ".nnf"
+        shutil.copyfile(args.DIMACS, nnf_file)
+        time.sleep(COMPILE_LATENCY)
+    rng = random.Random(args.seed)
+    cnf = CNF(from_file=nnf_file)
+    with Solver(name="m22", bootstrap_with=cnf.clauses) as solver, open(args.outputfile, "w") as f:
+        assert solver.solve(), "UNSAT"
+        for i in range(args.samples):
+            solver.set_phases([var if rng.random() < 0.5 else -var for var in range(1, cnf.nv + 1)])
+            solver.solve()
+            model = {abs(lit): lit for lit in solver.get_model()}
+            # variables that do not occur in any clause are free
+            sample = [model.get(var, var if rng.random() < 0.5 else -var) for var in range(1, cnf.nv + 1)]
+            f.write(f"{i + 1}, {' '.join(map(str, sample))}\n")
+    # pad to the deterministic latency
+    remaining = LATENCY + SAMPLE_LATENCY * args.samples - (time.perf_counter() - start)
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import time
+
+from pysat.formula import CNF
+from pysat.solvers import Solver
+
+"""
+Stand-in for sharpSAT with a deterministic runtime, for performance tests of the pipeline without the real model counter (see `spur.py`).
+
+Instead of the number of models, it prints the number of distinct assignments of the first `STUB_PROJECTION` variables (default: 10) that can be extended to a model.
+These projected counts are consistent in the way retainment sampling relies on (the count of a conjunction is at most the count of each operand, and equal formulas have equal counts),
+but they are not the real model counts.
+Each call takes `STUB_LATENCY` seconds (default: 0.05), if counting is faster.
+"""
+
+LATENCY = float(os.getenv("STUB_LATENCY", "0.05"))
+PROJECTION = int(os.getenv("STUB_PROJECTION", "10"))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog="sharpSAT", description="sharpSAT stub")
+    arg_parser.add_argument("-decot")
+    arg_parser.add_argument("-decow")
+    arg_parser.add_argument("-tmpdir")
+    arg_parser.add_argument("file")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    cnf = CNF(from_file=args.file)
+    occurring = set(abs(lit) for clause in cnf.clauses for lit in clause)
+    projection = [var for var in range(1, min(PROJECTION, cnf.nv) + 1) if var in occurring]
+    # projection variables that do not occur in any clause can take any value
+    num_free = min(PROJECTION, cnf.nv) - len(projection)
+    count = 0
+    with Solver(name="m22", bootstrap_with=cnf.clauses) as solver:
+        while solver.solve():
+            model = {abs(lit): lit for lit in solver.get_model()}
+            count += 1
+            if not projection:
+                break
+            # block this assignment of the projection variables
+            solver.add_clause([-model[var] for var in projection])
+    print(f"c s exact arb int {count * 2**num_free}")
+    remaining = LATENCY - (time.perf_counter() - start)
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import random
+import time
+
+from pysat.formula import CNF
+from pysat.solvers import Solver
+
+"""
+Stand-in for SPUR with a deterministic runtime, for performance tests of the pipeline without the real sampler:
+```
+SPUR=scripts/stubs/spur.py SHARPSAT=scripts/stubs/sharpsat.py python scripts/history_sampling.py -m tseitin data/test/history1
+```
+Accepts the arguments used by `retainment_sampling.get_samples_spur` and writes samples in SPUR's output format.
+The samples are found by a SAT solver with random phases, so they are valid but not uniform.
+Each call takes `STUB_LATENCY` seconds (default: 0.05) plus `STUB_SAMPLE_LATENCY` seconds per sample (default: 0.0001), independent of the formula.
+"""
+
+LATENCY = float(os.getenv("STUB_LATENCY", "0.05"))
+SAMPLE_LATENCY = float(os.getenv("STUB_SAMPLE_LATENCY", "0.0001"))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog="spur", description="SPUR stub")
+    arg_parser.add_argument("-cnf", required=True)
+    arg_parser.add_argument("-s", type=int, required=True)
+    arg_parser.add_argument("-out", required=True)
+    arg_parser.add_argument("-seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    rng = random.Random(args.seed)
+    cnf = CNF(from_file=args.cnf)
+    with Solver(name="m22", bootstrap_with=cnf.clauses) as solver, open(args.out, "w") as f:
+        if not solver.solve():
+            f.write("UNSAT\n")
+        else:
+            f.write("#START_SAMPLES\n")
+            for _ in range(args.s):
+                solver.set_phases(
+                    [var if rng.random() < 0.5 else -var for var in range(1, cnf.nv + 1)]
+                )
+                solver.solve()
+                model = {abs(lit): lit > 0 for lit in solver.get_model()}
+                # variables that do not occur in any clause are free
+                line = "".join(
+                    ("1" if model[var] else "0") if var in model else "*"
+                    for var in range(1, cnf.nv + 1)
+                )
+                f.write(f"1,{line}\n")
+            f.write("#END_SAMPLES\n")
+    # pad to the deterministic latency
+    remaining = LATENCY + SAMPLE_LATENCY * args.s - (time.perf_counter() - start)
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from pysat.formula import CNF
+
+import generate
+from benchmark import JOURNAL_FILE, OUTPUT_DIR as RESULTS_DIR, is_success, log_file, repetition_path
+from utils import git_commit
+
+"""
+Scalability sweeps over generated histories.
+
+A sweep generates histories from several base models with `generate.apply_random_steps`, for all combinations of step counts and change probabilities,
+runs every sampling method with different numbers of samples on them with `benchmark.py`,
+and fits and plots how runtime and peak memory scale with the number of variables, clauses, snapshots and samples.
+```
+python scripts/sweep.py generate small --models ea2468 adderii --steps 10 50 100
+python scripts/sweep.py run small -n 100 1000 -t 3600 --cores 5
+# ... optimize something, then measure again on the same histories ...
+python scripts/sweep.py run small -n 100 1000 -t 3600 --cores 5
+python scripts/sweep.py analyze small
+```
+`generate` writes the histories to `data/generated/sweep_<name>` (unified and preprocessed like by `generate_histories.sh`)
+and a description of the sweep to `experiments/sweep_<name>.json`, to which `run` adds each results folder.
+`analyze` compares all runs of the sweep: it writes the measurements and the fitted scaling exponents to `results/sweep_<name>_*.csv`
+and the plots to `output/plots/sweep/`.
+
+Scaling is fitted as a power law (a line in log-log space) over all jobs of a method, separately for each quantity.
+The "knee" of a curve is the value of the quantity after which the local exponent increases the most.
+"""
+
+EXPERIMENTS_DIR = Path("experiments")
+OUTPUT_DIR_PLOTS = Path("output") / "plots" / "sweep"
+MODELS_DIR = Path("data") / "unwise"
+DEFAULT_MODELS = ["ea2468", "uclinux-base", "adderii", "automotive01"]
+DEFAULT_STEPS = [10, 50]
+DEFAULT_P_REMOVE_CLAUSE = [0.4]
+DEFAULT_P_REMOVE_VAR = [0.3]
+P_ADD_CLAUSE = 0.9
+P_RENAME_VAR = 0.1
+DEFAULT_SEED = 56926
+DEFAULT_SAMPLES = [100, 1000]
+METHODS = {
+    "none": ["-m", "none"],
+    "tseitin": ["-a", "uniform", "-m", "tseitin"],
+    "rejection": ["-a", "uniform", "-m", "rejection"],
+}
+QUANTITIES = ["variables", "clauses", "snapshots", "samples"]
+METRICS = {"runtime": "runtime (s)", "peak_memory": "peak memory (bytes)"}
+
+
+def sweep_file(name) -> Path:
+    return EXPERIMENTS_DIR / f"sweep_{name}.json"
+
+
+def read_sweep(name) -> dict:
+    with sweep_file(name).open() as f:
+        return json.load(f)
+
+
+def write_sweep(sweep: dict):
+    with sweep_file(sweep["name"]).open("w") as f:
+        json.dump(sweep, f, indent=2)
+
+
+def resolve_model(model: str) -> Path:
+    """A base model given by name (in `data/unwise`) or path"""
+    path = Path(model)
+    if path.exists():
+        return path
+    return MODELS_DIR / f"{model}.dimacs"
+
+
+def history_stats(directory: Path) -> dict:
+    """Number of snapshots, variables (of the unified models) and average number of clauses of a history"""
+    num_vars = 0
+    num_clauses = []
+    files = sorted(directory.glob("*.dimacs"))
+    for file in files:
+        with file.open() as f:
+            for line in f:
+                if line.startswith("p cnf"):
+                    _, _, variables, clauses = line.split()
+                    num_vars = max(num_vars, int(variables))
+                    num_clauses.append(int(clauses))
+                    break
+    return {
+        "snapshots": len(files),
+        "variables": num_vars,
+        "clauses": float(np.mean(num_clauses)) if num_clauses else 0,
+    }
+
+
+def generate_sweep(args):
+    out_dir = f"sweep_{args.name}"
+    generated_dir = generate.OUTPUT_DIR / out_dir
+    histories = []
+    for model in args.models:
+        path = resolve_model(model)
+        cnf = CNF(from_file=path)
+        var_names = generate.parse_var_names(path)
+        for steps, p_remove_clause, p_remove_var in itertools.product(
+            args.steps, args.p_remove_clause, args.p_remove_var
+        ):
+            history = f"{path.stem}_s{steps}_pc{p_remove_clause}_pv{p_remove_var}"
+            print(f"generating {history}")
+            generate.apply_random_steps(
+                name=path.stem,
+                base_clauses=cnf.clauses,
+                base_var_names=var_names,
+                steps=steps,
+                out_dir=f"{out_dir}/{history}",
+                prob_remove_clause=p_remove_clause,
+                prob_add_clause=P_ADD_CLAUSE,
+                prob_remove_var=p_remove_var,
+                prob_rename_var=P_RENAME_VAR,
+                seed=args.seed,
+            )
+            histories.append(
+                {
+                    "history": history,
+                    "model": path.stem,
+                    "steps": steps,
+                    "p_remove_clause": p_remove_clause,
+                    "p_remove_var": p_remove_var,
+                }
+            )
+
+    # unify the variables of the snapshots and preprocess them, like generate_histories.sh
+    final_dir = Path(f"{generated_dir}_unified")
+    for old_dir in [final_dir, Path(f"{final_dir}_pmc")]:
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+    subprocess.run(["./scripts/unify.sh", str(generated_dir)], check=True)
+    if not args.no_pmc:
+        subprocess.run([sys.executable, "scripts/run_pmc.py", str(final_dir)], check=True)
+        final_dir = Path(f"{final_dir}_pmc")
+
+    for history in histories:
+        history["path"] = str(final_dir / history["history"])
+        history |= history_stats(final_dir / history["history"])
+    sweep = {
+        "name": args.name,
+        "seed": args.seed,
+        "histories": histories,
+        "runs": [],
+    }
+    write_sweep(sweep)
+    num_histories = len(histories)
+    print(
+        f"wrote {num_histories} {'history' if num_histories == 1 else 'histories'} to {final_dir}, sweep: {sweep_file(args.name)}"
+    )
+
+
+def run_sweep(args):
+    sweep = read_sweep(args.name)
+    batch_path = EXPERIMENTS_DIR / f"sweep_{args.name}_batch.txt"
+    param_path = EXPERIMENTS_DIR / f"sweep_{args.name}_params.txt"
+    with batch_path.open("w") as f:
+        for history in sweep["histories"]:
+            f.write(history["path"] + "\n")
+    with param_path.open("w") as f:
+        for num_samples in args.samples:
+            for method in args.methods:
+                params = ["--seed", str(sweep["seed"]), *METHODS[method], "-n", str(num_samples)]
+                f.write(" ".join(params) + "\n")
+
+    run_name = f"sweep_{args.name}"
+    started = datetime.datetime.now()
+    cmd = [
+        sys.executable,
+        "scripts/benchmark.py",
+        "-t",
+        str(args.timeout),
+        "--cores",
+        str(args.cores),
+        "--repetitions",
+        str(args.repetitions),
+        "--name",
+        run_name,
+        *args.benchmark_args.split(),
+        "--param-file",
+        str(param_path),
+        "--batch-file",
+        str(batch_path),
+        "--",
+        sys.executable,
+        "scripts/history_sampling.py",
+    ]
+    subprocess.run(cmd, check=True)
+
+    # the results folder of the run is the newest one with its name
+    results_dirs = sorted(
+        path
+        for path in RESULTS_DIR.glob(f"*_{run_name}")
+        if path.stat().st_mtime >= started.timestamp()
+    )
+    if not results_dirs:
+        print("results folder of the run not found")
+        exit(1)
+    sweep["runs"].append(
+        {
+            "results": str(results_dirs[-1]),
+            "commit": git_commit(),
+            "date": started.isoformat(timespec="seconds"),
+        }
+    )
+    write_sweep(sweep)
+    print(f"added run {results_dirs[-1]} to {sweep_file(args.name)}")
+
+
+def read_run(results_dir: Path, histories: dict[str, dict]) -> list[dict]:
+    """Runtime and peak memory of each successful job in a results folder"""
+    rows = []
+    with (results_dir / JOURNAL_FILE).open() as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            history = histories.get(record["file"])
+            if history is None or not is_success(record["result"]):
+                continue
+            params = record["params"]
+            repetition = record.get("repetition", 1)
+            log = log_file(record["file"], repetition_path(str(results_dir), repetition), params)
+            peak_memory = np.nan
+            if os.path.exists(log):
+                with open(log) as f:
+                    match = re.search(r"Peak memory: (\d+) bytes", f.read())
+                if match:
+                    peak_memory = int(match.group(1))
+            rows.append(
+                {
+                    "history": history["history"],
+                    "model": history["model"],
+                    "variables": history["variables"],
+                    "clauses": history["clauses"],
+                    "snapshots": history["snapshots"],
+                    "samples": int(params[params.index("-n") + 1]),
+                    "method": params[params.index("-m") + 1],
+                    "repetition": repetition,
+                    "runtime": float(record["result"]),
+                    "peak_memory": peak_memory,
+                }
+            )
+    return rows
+
+
+def fit_scaling(data: pd.DataFrame, metric: str, quantity: str) -> dict:
+    """
+    Exponent of a power law `metric ~ quantity^exponent`, and the knee of the curve
+
+    The knee is the value of `quantity` at which the exponent between consecutive values (of the median of `metric`) increases the most.
+    """
+    data = data[(data[metric] > 0) & (data[quantity] > 0)]
+    medians = data.groupby(quantity)[metric].median()
+    if len(medians) < 2:
+        return {"exponent": np.nan, "knee": np.nan}
+    x, y = np.log(data[quantity].to_numpy(float)), np.log(data[metric].to_numpy(float))
+    exponent, _ = np.polyfit(x, y, 1)
+    knee = np.nan
+    if len(medians) >= 3:
+        local_exponents = np.diff(np.log(medians.to_numpy(float))) / np.diff(
+            np.log(medians.index.to_numpy(float))
+        )
+        knee = medians.index[1 + int(np.argmax(np.diff(local_exponents)))]
+    return {"exponent": exponent, "knee": knee}
+
+
+def plot_scaling(data: pd.DataFrame, metric: str, quantity: str, output_path: Path):
+    fig, ax = plt.subplots(figsize=(5, 3.5))
+    for (run, method), group in data.groupby(["run", "method"]):
+        medians = group.groupby(quantity)[metric].median()
+        ax.plot(medians.index, medians.to_numpy(), "o-", label=f"{method} ({run})", markersize=3)
+    ax.set_xscale("log")
+    ax.set_yscale("log")
+    ax.set_xlabel(quantity)
+    ax.set_ylabel(METRICS[metric])
+    ax.grid(True, which="both", alpha=0.3)
+    ax.legend(fontsize="x-small")
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+
+
+def analyze_sweep(args):
+    sweep = read_sweep(args.name)
+    histories = {history["path"]: history for history in sweep["histories"]}
+    runs = [{"results": str(path), "commit": None} for path in args.results] or sweep["runs"]
+    rows = []
+    for run in runs:
+        run_label = run.get("commit") or Path(run["results"]).name
+        for row in read_run(Path(run["results"]), histories):
+            rows.append({"run": run_label, **row})
+    if not rows:
+        print("no successful jobs found")
+        exit(1)
+    data = pd.DataFrame(rows)
+
+    RESULTS_DIR.mkdir(exist_ok=True, parents=True)
+    OUTPUT_DIR_PLOTS.mkdir(exist_ok=True, parents=True)
+    data_path = RESULTS_DIR / f"sweep_{args.name}_measurements.csv"
+    data.to_csv(data_path, index=False)
+
+    fits = []
+    for metric in METRICS:
+        for quantity in QUANTITIES:
+            for (run, method), group in data.groupby(["run", "method"]):
+                fits.append(
+                    {
+                        "run": run,
+                        "method": method,
+                        "metric": metric,
+                        "quantity": quantity,
+                        **fit_scaling(group, metric, quantity),
+                    }
+                )
+            plot_scaling(
+                data, metric, quantity, OUTPUT_DIR_PLOTS / f"{args.name}_{metric}_{quantity}.pdf"
+            )
+    fits = pd.DataFrame(fits)
+    fits_path = RESULTS_DIR / f"sweep_{args.name}_scaling.csv"
+    fits.to_csv(fits_path, index=False)
+    print(fits.to_string(index=False))
+    print(f"wrote {data_path}, {fits_path} and plots to {OUTPUT_DIR_PLOTS}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="sweep", description="Scalability sweeps over generated histories"
+    )
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="generate the histories of a sweep")
+    generate_parser.add_argument("name", help="name of the sweep")
+    generate_parser.add_argument(
+        "--models",
+        nargs="+",
+        default=DEFAULT_MODELS,
+        help=f"base models, as names in {MODELS_DIR} or paths (default: {' '.join(DEFAULT_MODELS)})",
+    )
+    generate_parser.add_argument(
+        "--steps", nargs="+", type=int, default=DEFAULT_STEPS, help="numbers of steps"
+    )
+    generate_parser.add_argument(
+        "--p-remove-clause",
+        nargs="+",
+        type=float,
+        default=DEFAULT_P_REMOVE_CLAUSE,
+        help="probabilities to remove clauses in a step",
+    )
+    generate_parser.add_argument(
+        "--p-remove-var",
+        nargs="+",
+        type=float,
+        default=DEFAULT_P_REMOVE_VAR,
+        help="probabilities to remove variables in a step",
+    )
+    generate_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    generate_parser.add_argument(
+        "--no-pmc", action="store_true", help="do not preprocess the snapshots with pmc"
+    )
+
+    run_parser = subparsers.add_parser("run", help="benchmark all methods on the histories of a sweep")
+    run_parser.add_argument("name", help="name of the sweep")
+    run_parser.add_argument(
+        "-n",
+        "--samples",
+        nargs="+",
+        type=int,
+        default=DEFAULT_SAMPLES,
+        help="numbers of samples per snapshot",
+    )
+    run_parser.add_argument(
+        "-m",
+        "--methods",
+        nargs="+",
+        choices=list(METHODS),
+        default=list(METHODS),
+        help="sampling methods",
+    )
+    run_parser.add_argument("-t", "--timeout", type=int, default=3600)
+    run_parser.add_argument("-c", "--cores", type=int, default=0)
+    run_parser.add_argument("--repetitions", type=int, default=1)
+    run_parser.add_argument(
+        "--benchmark-args",
+        default="",
+        help='further options for benchmark.py, e.g. --benchmark-args="--in-process --precompute"',
+    )
+
+    analyze_parser = subparsers.add_parser(
+        "analyze", help="fit and plot the scaling of all runs of a sweep"
+    )
+    analyze_parser.add_argument("name", help="name of the sweep")
+    analyze_parser.add_argument(
+        "results",
+        nargs="*",
+        type=Path,
+        help="results folders to analyze (default: all runs of the sweep)",
+    )
+    args = arg_parser.parse_args()
+
+    match args.command:
+        case "generate":
+            generate_sweep(args)
+        case "run":
+            run_sweep(args)
+        case "analyze":
+            analyze_sweep(args)
+
+
+if __name__ == "__main__":
+    main()
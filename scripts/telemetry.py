@@ -0,0 +1,152 @@
+import os
+import resource
+import threading
+import time
+
+"""
+Live metrics for long benchmark runs, written periodically to a file in the Prometheus text format.
+The files can be watched directly or collected with the textfile collector of the Prometheus node exporter.
+
+Metrics are disabled unless `init` is called, e.g. by `init_from_env` if the environment variable `METRICS_FILE` is set.
+While disabled, `set_gauge`, `inc` and `observe` return immediately.
+`benchmark.py --metrics <dir>` sets `METRICS_FILE` for each job to a file in `<dir>`.
+"""
+
+METRICS_INTERVAL = 5
+"""Seconds between two updates of the metrics file"""
+
+
+class Metrics:
+    """Registry of gauges, counters and summaries that is periodically written to `path`"""
+
+    def __init__(self, path, labels: dict | None = None, interval=METRICS_INTERVAL):
+        self.path = path
+        self.labels = labels or dict()
+        self.interval = interval
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.values: dict[str, dict[tuple, float]] = dict()
+        self.types: dict[str, str] = dict()
+        self.help: dict[str, str] = dict()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _add(self, name, kind, help, labels, value, increment):
+        key = tuple(sorted({**self.labels, **(labels or dict())}.items()))
+        with self.lock:
+            self.types.setdefault(name, kind)
+            if help:
+                self.help.setdefault(name, help)
+            series = self.values.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value if increment else value
+
+    def set(self, name, value, labels=None, help=None):
+        self._add(name, "gauge", help, labels, value, increment=False)
+
+    def inc(self, name, amount=1, labels=None, help=None):
+        self._add(name, "counter", help, labels, amount, increment=True)
+
+    def observe(self, name, value, labels=None, help=None):
+        """Record an observation of a summary, e.g. the duration of a call"""
+        self._add(name + "_count", "counter", help, labels, 1, increment=True)
+        self._add(name + "_sum", "counter", help, labels, value, increment=True)
+        self._add(name + "_last", "gauge", help, labels, value, increment=False)
+
+    def render(self) -> str:
+        self.set("process_resident_memory_bytes", memory_in_use())
+        self.set("elapsed_seconds", time.time() - self.start_time)
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.values.items()):
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.types[name]}")
+                for labels, value in series.items():
+                    label_str = ",".join(
+                        f'{key}="{escape(str(label_value))}"'
+                        for key, label_value in labels
+                    )
+                    lines.append(
+                        f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # write to a temporary file and rename it, so that readers never see a partial file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Warning: could not write metrics to {self.path}: {e}")
+
+    def close(self):
+        """Stop the periodic updates and write the final values"""
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+
+
+def escape(value: str) -> str:
+    """
+    Escape a label value for the Prometheus text format
+
+    >>> escape('data/"BusyBox"')
+    'data/\\\\"BusyBox\\\\"'
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def memory_in_use() -> int:
+    """Resident memory of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no procfs (e.g. macOS): fall back to the peak, which is reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+_metrics: Metrics | None = None
+
+
+def init(path, labels: dict | None = None):
+    """Enable metrics for this process, written to `path`"""
+    global _metrics
+    close()
+    _metrics = Metrics(path, labels)
+
+
+def init_from_env(labels: dict | None = None):
+    """Enable metrics if the environment variable `METRICS_FILE` is set"""
+    path = os.getenv("METRICS_FILE")
+    if path:
+        init(path, labels)
+
+
+def close():
+    global _metrics
+    if _metrics is not None:
+        _metrics.close()
+        _metrics = None
+
+
+def set_gauge(name, value, labels=None, help=None):
+    if _metrics is not None:
+        _metrics.set(name, value, labels, help)
+
+
+def inc(name, amount=1, labels=None, help=None):
+    if _metrics is not None:
+        _metrics.inc(name, amount, labels, help)
+
+
+def observe(name, value, labels=None, help=None):
+    if _metrics is not None:
+        _metrics.observe(name, value, labels, help)
@@ -0,0 +1,188 @@
+import argparse
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+"""
+Hierarchical tracing of the sampling pipeline, exported in the Chrome trace event format (open with https://ui.perfetto.dev or chrome://tracing).
+
+Tracing is disabled unless the environment variable `TRACE_DIR` is set; while disabled, `span` returns a shared no-op context manager.
+When enabled, every process appends the spans it recorded to `<TRACE_DIR>/trace_<pid>.jsonl` as soon as its outermost span on a thread ends,
+so spans of child processes (e.g. `history_sampling.py` jobs of `benchmark.py`, or pool workers) are collected as well.
+Merge the files of a run into a single trace with
+```
+python scripts/tracing.py <TRACE_DIR> -o trace.json
+```
+`benchmark.py --trace <dir>` sets `TRACE_DIR` for all jobs and merges the files into `<dir>/trace.json` when all jobs are done.
+
+Spans nest by time per thread. Every external tool run with `utils.run_tool` (SPUR, KUS, sharpSAT, pmc) gets its own span with the command line,
+as does every phase timed with `utils.PhaseTimer`.
+"""
+
+TRACE_DIR_ENV = "TRACE_DIR"
+MERGED_TRACE_FILE = "trace.json"
+
+_trace_dir = os.getenv(TRACE_DIR_ENV)
+_lock = threading.Lock()
+_events: list[dict] = []
+_local = threading.local()
+_NO_SPAN = contextlib.nullcontext()
+
+
+def init(trace_dir):
+    """Enable tracing for this process and the processes it starts, written to `trace_dir`"""
+    global _trace_dir
+    _trace_dir = str(trace_dir)
+    os.environ[TRACE_DIR_ENV] = _trace_dir
+
+
+def is_enabled() -> bool:
+    return _trace_dir is not None
+
+
+def now_us() -> float:
+    """Timestamp in microseconds, comparable between processes on the same machine"""
+    return time.time_ns() / 1000
+
+
+def _depth() -> int:
+    return getattr(_local, "depth", 0)
+
+
+def _record(event: dict):
+    with _lock:
+        _events.append(event)
+
+
+def flush():
+    """Append the recorded events to the trace file of this process"""
+    global _events
+    if _trace_dir is None:
+        return
+    with _lock:
+        events, _events = _events, []
+        if not events:
+            return
+        path = Path(_trace_dir) / f"trace_{os.getpid()}.jsonl"
+        new_file = not path.exists()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as f:
+            if new_file:
+                metadata = {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "args": {"name": " ".join(sys.argv)},
+                }
+                f.write(json.dumps(metadata) + "\n")
+            for event in events:
+                f.write(json.dumps(event, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def _span(name, cat, args):
+    _local.depth = _depth() + 1
+    start = now_us()
+    try:
+        yield
+    finally:
+        end = now_us()
+        _local.depth -= 1
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start,
+            "dur": end - start,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+        }
+        if args:
+            event["args"] = args
+        _record(event)
+        if _local.depth == 0:
+            flush()
+
+
+def span(name: str, cat: str = "span", args: dict | None = None):
+    """
+    Context manager recording the time spent in its body as a span.
+
+    >>> with span("count", args={"file": "a.dimacs"}):
+    ...     compute_model_count("a.dimacs")
+    """
+    if _trace_dir is None:
+        return _NO_SPAN
+    return _span(name, cat, args)
+
+
+def traced(name: str | None = None, cat: str = "function"):
+    """Decorator recording each call of the decorated function as a span"""
+
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace_dir is None:
+                return function(*args, **kwargs)
+            with _span(span_name, cat, None):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _after_fork():
+    # a forked child inherits the events of its parent, which the parent writes itself
+    global _events, _lock
+    _events = []
+    _lock = threading.Lock()
+    _local.depth = 0
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush)
+
+
+def merge(trace_dir: Path, output_path: Path) -> int:
+    """Merge the trace files in `trace_dir` into one Chrome trace at `output_path`. Returns the number of events."""
+    events = []
+    for path in sorted(trace_dir.glob("trace_*.jsonl")):
+        with path.open() as f:
+            for line in f:
+                if line.strip():
+                    events.append(json.loads(line))
+    with output_path.open("w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="tracing",
+        description="Merge the trace files written with TRACE_DIR into a Chrome trace",
+    )
+    arg_parser.add_argument("trace_dir", type=Path, help="the TRACE_DIR of the run")
+    arg_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help=f"output file. Default: <trace_dir>/{MERGED_TRACE_FILE}",
+    )
+    args = arg_parser.parse_args()
+
+    output_path = args.output or args.trace_dir / MERGED_TRACE_FILE
+    num_events = merge(args.trace_dir, output_path)
+    print(f"wrote {num_events} events to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
+import contextlib
 import os
 import re
+import resource
+import subprocess
+import sys
 import time
 import types
 
+import memory_profile
+import tracing
+
 
 class Timer:
     """
@@ -50,6 +57,10 @@ class Timer:
         """Starts the timer"""
         self._start_time = time.perf_counter()
 
+    def elapsed(self):
+        """Returns the time since the timer was started in seconds, without stopping it"""
+        return time.perf_counter() - self._start_time  # type: ignore
+
     def stop(self):
         """Stops the timer and returns the elapsed time in seconds"""
         self._stop_time = time.perf_counter()
@@ -63,6 +74,153 @@ class Timer:
         return self.last_timing
 
 
+class PhaseTimer:
+    """
+    Accumulates the time spent in named phases.
+
+    >>> phases = PhaseTimer(["count", "sample"])
+    >>> with phases.phase("count"):
+    ...     squares = [x * x for x in range(10**6)]
+    >>> phases.as_dict()
+    {"time_count": 0.031, "time_sample": 0.0}
+    """
+
+    def __init__(self, names=()):
+        self.times = {name: 0.0 for name in names}
+        self.peaks = {name: 0 for name in names}
+        """Peak of the Python heap in each phase, if memory profiling is enabled"""
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        timer = Timer(enable_printing=False)
+        memory = dict()
+        try:
+            with tracing.span(name, cat="phase"), memory_profile.measure_peak() as memory:
+                yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + timer.stop()
+            if "peak" in memory:
+                self.peaks[name] = max(self.peaks.get(name, 0), memory["peak"])
+
+    def as_dict(self, prefix="time_"):
+        result = {prefix + name: time for name, time in self.times.items()}
+        if memory_profile.is_enabled():
+            result |= {f"peak_memory_{name}": peak for name, peak in self.peaks.items()}
+        return result
+
+
+tool_stats: dict[str, dict[str, float]] = dict()
+"""Number of invocations, wall time and CPU time of each external tool run with `run_tool` in this process"""
+
+
+def run_tool(tool, cmd, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Run the external program `tool` with `subprocess.run(cmd, **kwargs)`, recording its wall and CPU time in `tool_stats`
+    and, if tracing is enabled, a span with the command line.
+    """
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    timer = Timer(enable_printing=False)
+    try:
+        with tracing.span(tool, cat="tool", args={"cmd": " ".join(map(str, cmd))}):
+            if memory_profile.is_enabled():
+                result, peak_rss = memory_profile.run_sampled(cmd, **kwargs)
+                print(f"[memory] {tool}: peak resident memory {peak_rss / 2**20:.1f} MiB")
+                return result
+            return subprocess.run(cmd, **kwargs)
+    finally:
+        wall_time = timer.stop()
+        usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_time = (usage_after.ru_utime - usage_before.ru_utime) + (
+            usage_after.ru_stime - usage_before.ru_stime
+        )
+        record_tool_stats(tool, wall_time, cpu_time)
+
+
+def record_tool_stats(tool, wall_time: float, cpu_time: float):
+    """Add an invocation of `tool` to `tool_stats`, for tools that are not run with `run_tool` (e.g. by a worker process)"""
+    stats = tool_stats.setdefault(
+        tool, {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0}
+    )
+    stats["calls"] += 1
+    stats["wall_time"] += wall_time
+    stats["cpu_time"] += cpu_time
+
+
+def tool_stats_since(before: dict[str, dict[str, float]], tools=()) -> dict:
+    """
+    Tool statistics accumulated since the copy `before` of `tool_stats` was taken, as a flat dict,
+    e.g. `{"spur_calls": 3, "spur_wall_time": 1.2, "spur_cpu_time": 1.1}`.
+    Tools in `tools` are always included, even if they were not run.
+    """
+    result = dict()
+    for tool in [*tools, *(t for t in tool_stats if t not in tools)]:
+        now = tool_stats.get(tool, {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0})
+        then = before.get(tool, {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0})
+        for key in ["calls", "wall_time", "cpu_time"]:
+            result[f"{tool}_{key}"] = now[key] - then[key]
+    return result
+
+
+def copy_tool_stats() -> dict[str, dict[str, float]]:
+    return {tool: stats.copy() for tool, stats in tool_stats.items()}
+
+
+_peak_baseline: tuple[int, int] | None = None
+"""`ru_maxrss` of this process and of its children when the measurement was last reset, see `reset_peak_memory`"""
+
+
+def _max_rss() -> tuple[int, int]:
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    )
+
+
+def reset_peak_memory():
+    """
+    Measure the peak memory of the following work only, e.g. of one job in a long-lived worker (see `in_process.py`).
+    On Linux, the peak resident memory of this process is reset. The peak of the child processes cannot be reset,
+    so it is only known if a child process of the following work uses more memory than all earlier ones.
+    """
+    global _peak_baseline
+    if _peak_baseline is None:
+        # nothing measured before in this process
+        _peak_baseline = (0, 0)
+        return
+    peak_self, peak_children = _max_rss()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        peak_self = 0
+    except OSError:
+        pass
+    _peak_baseline = (peak_self, peak_children)
+
+
+def peak_memory_usage() -> tuple[int | None, int | None]:
+    """
+    Peak resident memory in bytes of this process and of the largest of its terminated child processes (e.g. SPUR or sharpSAT)
+    since `reset_peak_memory`. A peak is `None` if it is unknown, because it did not exceed the peak before the reset.
+    """
+    baseline = _peak_baseline or (0, 0)
+    return tuple(
+        peak if peak > before or before == 0 else None for peak, before in zip(_max_rss(), baseline)
+    )  # type: ignore
+
+
+def git_commit() -> str | None:
+    """Short hash of the checked out commit, recorded with benchmark results, or `None` outside of a git checkout"""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
 def pluralize(value, unit):
     """
     >>> pluralize(2, "minute")
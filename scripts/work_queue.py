@@ -0,0 +1,278 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import queue
+
+from benchmark import log_file, process_file, read_record, record_file
+import telemetry
+from utils import label
+
+"""
+Distribute the jobs of `benchmark.py` over several machines.
+
+The coordinator is `benchmark.py` started with `--listen HOST:PORT`. Instead of running the jobs itself, it hands them out to workers:
+```
+python scripts/work_queue.py HOST:PORT --cores 4
+```
+Workers can be started on any machine that has the same input files and programs at the same (relative) paths, e.g. a shared checkout of this repository.
+Each core of a worker opens its own connection and pulls the next job as soon as it is idle, so long and short jobs are balanced automatically.
+Jobs run under the same timeout and accounting rules as local jobs, the worker sends back the result, the log and the result record,
+which the coordinator writes to the results folder.
+The log is not streamed while the job runs: as for local jobs, the output of the job is only written to the log when it ends,
+so it arrives at the coordinator together with the result.
+If a worker disconnects, its running job is handed out again.
+
+Protocol: newline-delimited JSON messages over TCP. A worker sends `{"type": "request"}`, the coordinator answers with
+`{"type": "job", "id", "file", "params", "command", "timeout"}`, `{"type": "wait", "seconds"}` (all jobs are handed out but not finished yet), or `{"type": "done"}`.
+After running a job, the worker sends `{"type": "result", "id", "name", "result", "log", "record"}` or `{"type": "error", "id", "message", "log", "record"}`,
+where `record` is the result record written by the job (see `benchmark.read_record`).
+"""
+
+POLL_INTERVAL = 5
+"""Seconds an idle worker waits before asking for a job again"""
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """
+    >>> parse_address("localhost:4711")
+    ("localhost", 4711)
+    """
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def send(stream, message: dict):
+    stream.write((json.dumps(message) + "\n").encode())
+    stream.flush()
+
+
+def receive(stream) -> dict | None:
+    """Read the next message, or `None` if the connection was closed"""
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class JobQueue:
+    """Keeps track of the jobs that are waiting to be handed out, currently running, or finished"""
+
+    def __init__(self, jobs, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = collections.deque(enumerate(jobs))
+        self.running = dict()
+        self.num_unfinished = len(jobs)
+        self.finished = queue.Queue()
+        """`(file, params, future)` tuples of finished jobs"""
+
+    def update_metrics(self):
+        telemetry.set_gauge("benchmark_jobs_running", len(self.running))
+        telemetry.set_gauge("benchmark_jobs_queued", len(self.pending))
+
+    def next_job(self):
+        """Returns the next `(id, (file, params))` to run, or `None` if no job is waiting"""
+        with self.lock:
+            if not self.pending:
+                return None
+            id, job = self.pending.popleft()
+            self.running[id] = job
+            self.update_metrics()
+            return id, job
+
+    def is_done(self):
+        with self.lock:
+            return self.num_unfinished == 0
+
+    def job(self, id):
+        """The `(file, params)` of the running job `id`, or `None` if it is not running (e.g. already finished by another worker)"""
+        with self.lock:
+            return self.running.get(id)
+
+    def requeue(self, id):
+        """Hand out a running job again, e.g. because its worker disconnected"""
+        with self.lock:
+            job = self.running.pop(id, None)
+            if job is not None:
+                self.pending.appendleft((id, job))
+            self.update_metrics()
+
+    def finish(self, id, result=None, exception=None):
+        with self.lock:
+            job = self.running.pop(id, None)
+            if job is None:
+                return None  # already finished by another worker
+            self.num_unfinished -= 1
+            self.update_metrics()
+        future = concurrent.futures.Future()
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+        file, params = job
+        self.finished.put((file, params, future))
+        return job
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """Serves jobs to a single worker connection"""
+
+    def handle(self):
+        jobs: JobQueue = self.server.job_queue  # type: ignore
+        output_path = self.server.output_path  # type: ignore
+        current = None
+        try:
+            while (message := receive(self.rfile)) is not None:
+                if message["type"] in ["result", "error"]:
+                    job = jobs.job(message["id"])
+                    if job is not None:
+                        # written before the job is finished, since the result record is read as soon as it is
+                        file, params = job
+                        path = log_file(file, output_path, params)
+                        with open(path, "a") as log:
+                            log.write(message["log"])
+                        if message.get("record"):
+                            with open(record_file(path), "w") as f:
+                                json.dump(message["record"], f)
+                    if message["type"] == "result":
+                        jobs.finish(message["id"], result=(message["name"], message["result"]))
+                    else:
+                        jobs.finish(message["id"], exception=RuntimeError(message["message"]))
+                    current = None
+                elif message["type"] == "request":
+                    if jobs.is_done():
+                        send(self.wfile, {"type": "done"})
+                        return
+                    next_job = jobs.next_job()
+                    if next_job is None:
+                        send(self.wfile, {"type": "wait", "seconds": POLL_INTERVAL})
+                        continue
+                    current, (file, params) = next_job
+                    send(
+                        self.wfile,
+                        {
+                            "type": "job",
+                            "id": current,
+                            "file": file,
+                            "params": params,
+                            "command": jobs.command,
+                            "timeout": jobs.timeout,
+                        },
+                    )
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"connection to {self.client_address[0]} failed: {e}")
+        finally:
+            if current is not None:
+                print(f"lost worker {self.client_address[0]}, job will be handed out again")
+                jobs.requeue(current)
+
+
+def serve_jobs(address, jobs, output_path, command, timeout):
+    """
+    Serve the jobs, given as `(file, params)` pairs, to workers connecting to `address`.
+    Yields a `(file, params, future)` tuple for each job as soon as it is completed.
+    """
+    job_queue = JobQueue(jobs, command, timeout)
+    job_queue.update_metrics()
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer(parse_address(address), WorkerHandler)
+    server.daemon_threads = True
+    server.job_queue = job_queue  # type: ignore
+    server.output_path = output_path  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"serving {label(len(jobs), 'job')} on {address}")
+    try:
+        for _ in range(len(jobs)):
+            yield job_queue.finished.get()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_worker(address, slot):
+    """Pull jobs from the coordinator at `address` and run them, one at a time"""
+    worker_name = f"{socket.gethostname()}/{slot}"
+    with socket.create_connection(parse_address(address)) as connection:
+        stream = connection.makefile("rwb")
+        with tempfile.TemporaryDirectory() as tmp:
+            while True:
+                send(stream, {"type": "request", "worker": worker_name})
+                message = receive(stream)
+                if message is None or message["type"] == "done":
+                    break
+                if message["type"] == "wait":
+                    time.sleep(message["seconds"])
+                    continue
+                file, params = message["file"], message["params"]
+                try:
+                    name, result = process_file(
+                        file, tmp, params, message["command"], message["timeout"]
+                    )
+                    reply = {"type": "result", "name": name, "result": result}
+                except Exception as e:
+                    reply = {"type": "error", "message": f"{worker_name}: {e}"}
+                reply["id"] = message["id"]
+                path = log_file(file, tmp, params)
+                if os.path.exists(path):
+                    with open(path) as log:
+                        reply["log"] = log.read()
+                    os.remove(path)
+                else:
+                    reply["log"] = ""
+                reply["record"] = read_record(path)
+                if os.path.exists(record_file(path)):
+                    os.remove(record_file(path))
+                send(stream, reply)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog="work_queue",
+        description="Worker running jobs served by `benchmark.py --listen`",
+    )
+    arg_parser.add_argument(
+        "address", help="HOST:PORT the coordinator is listening on"
+    )
+    arg_parser.add_argument(
+        "-c",
+        "--cores",
+        action="store",
+        type=int,
+        default=0,
+        help="number of jobs to run in parallel. A value of 0 (default) uses as many cores as are available",
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--work-dir",
+        action="store",
+        type=str,
+        help="working directory for the program",
+    )
+    args = arg_parser.parse_args()
+
+    if args.work_dir:
+        os.chdir(args.work_dir)
+    num_cores = args.cores or multiprocessing.cpu_count()
+    print(f"working for {args.address} on {label(num_cores, 'core')}")
+    threads = [
+        threading.Thread(target=run_worker, args=(args.address, slot))
+        for slot in range(num_cores)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("all jobs done")
+
+
+if __name__ == "__main__":
+    main()